@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save, pre_save
+        from . import directory
+        from .models import User
+
+        pre_save.connect(directory.remember_old, sender=User, dispatch_uid='staff_directory')
+        post_save.connect(directory.on_user_saved, sender=User, dispatch_uid='staff_directory')
+        post_delete.connect(directory.on_user_deleted, sender=User, dispatch_uid='staff_directory')
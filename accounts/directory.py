@@ -0,0 +1,131 @@
+"""
+Cached staff directory for role pickers (doctors, technicians, pharmacists)
+
+staff_choices(role) returns a compact list of (id, display name) tuples,
+kept in the default cache. A role's entry is dropped when one of its users
+is created or deleted, or saved with a change to a field the directory
+shows (DIRECTORY_FIELDS; see AccountsConfig.ready), so logins, which only
+touch last_login, leave it alone. StaffChoiceField renders its options from it,
+so showing a picker costs no query; only validating a submitted choice
+looks the user up.
+
+Writes that bypass signals (queryset.update(), raw SQL imports) must call
+invalidate(). With a per-process cache such as the default LocMemCache,
+other processes only see a change once DIRECTORY_TIMEOUT expires.
+"""
+from django import forms
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+CACHE_PREFIX = 'staff_directory'
+DIRECTORY_TIMEOUT = 300
+# Fields whose change can move a user into, out of or within a directory
+DIRECTORY_FIELDS = ('role', 'is_active', 'first_name', 'last_name', 'username')
+
+
+def _cache_key(role):
+    return f'{CACHE_PREFIX}:{role}'
+
+
+def display_name(first_name, last_name, username):
+    return f'{first_name} {last_name}'.strip() or username
+
+
+def staff_choices(role):
+    """[(id, display name), ...] for every user with role, ordered by name"""
+    key = _cache_key(role)
+    choices = cache.get(key)
+    if choices is None:
+        users = get_user_model().objects.filter(role=role).order_by('first_name', 'last_name', 'pk')
+        choices = [
+            (pk, display_name(first_name, last_name, username))
+            for pk, first_name, last_name, username in users.values_list(
+                'pk', 'first_name', 'last_name', 'username'
+            )
+        ]
+        cache.set(key, choices, DIRECTORY_TIMEOUT)
+    return choices
+
+
+def invalidate(*args, roles=None, **kwargs):
+    """Drop the entries of roles (default: every role); also usable directly as a callback"""
+    if roles is None:
+        roles = [role for role, _ in get_user_model().ROLE_CHOICES]
+    cache.delete_many([_cache_key(role) for role in roles])
+
+
+def remember_old(sender, instance, raw=False, update_fields=None, **kwargs):
+    """pre_save: the user's DIRECTORY_FIELDS before this save"""
+    instance._directory_old = None
+    if raw or not instance.pk:
+        return
+    if update_fields is not None and not set(update_fields) & set(DIRECTORY_FIELDS):
+        # e.g. the last_login update on every login: nothing the directory shows
+        instance._directory_old = tuple(getattr(instance, field) for field in DIRECTORY_FIELDS)
+        return
+    instance._directory_old = sender.objects.filter(pk=instance.pk).values_list(*DIRECTORY_FIELDS).first()
+
+
+def on_user_saved(sender, instance, **kwargs):
+    """post_save: drop the old and new role's entries if a shown field changed"""
+    old = getattr(instance, '_directory_old', None)
+    if old == tuple(getattr(instance, field) for field in DIRECTORY_FIELDS):
+        return
+    invalidate(roles={instance.role} | ({old[0]} if old else set()))
+
+
+def on_user_deleted(sender, instance, **kwargs):
+    invalidate(roles=[instance.role])
+
+
+class DirectoryChoices:
+    """Lazy choices: read from the directory each time a widget renders"""
+
+    def __init__(self, field):
+        self.field = field
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for pk, name in staff_choices(self.field.role):
+            yield (pk, self.field.label_format.format(name=name))
+
+    def __len__(self):
+        return len(staff_choices(self.field.role)) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(staff_choices(self.field.role))
+
+
+class StaffChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField for the users with one role, rendered from the cached
+    directory. cleaned_data still holds the User instance.
+    """
+
+    def __init__(self, role, label_format='{name}', queryset=None, **kwargs):
+        self.role = role
+        self.label_format = label_format
+        if queryset is None:
+            queryset = get_user_model().objects.filter(role=role)
+        super().__init__(queryset, **kwargs)
+
+    def _get_choices(self):
+        return DirectoryChoices(self)
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+
+class StaffDirectoryAdminMixin:
+    """
+    ModelAdmin mixin serving staff foreign keys from the directory; set
+    staff_fields = {'doctor': 'doctor', ...} (field name -> role).
+    """
+    staff_fields = {}
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        role = self.staff_fields.get(db_field.name)
+        if role is not None and 'queryset' not in kwargs:
+            kwargs['queryset'] = get_user_model().objects.filter(role=role)
+            return db_field.formfield(form_class=StaffChoiceField, role=role, **kwargs)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
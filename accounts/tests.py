@@ -1,3 +1,79 @@
+from django.contrib.admin.sites import site
+from django.core.cache import cache
 from django.test import TestCase
+from django.test.client import RequestFactory
 
-# Create your tests here.
+from appointments.forms import AppointmentBookingForm
+from lab.models import LabTest
+from . import directory
+from .models import User
+
+
+class StaffDirectoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctors = [
+            User.objects.create_user('dr_tola', role='doctor', first_name='Tola', last_name='Abdi'),
+            User.objects.create_user('dr_anonymous', role='doctor'),
+        ]
+        cls.technician = User.objects.create_user('tech_gemechu', role='lab_tech', first_name='Gemechu')
+        User.objects.create_user('st_chaltu', role='student', first_name='Chaltu')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_choices_are_compact_and_ordered(self):
+        self.assertEqual(directory.staff_choices('doctor'), [
+            (self.doctors[1].pk, 'dr_anonymous'), (self.doctors[0].pk, 'Tola Abdi'),
+        ])
+        self.assertEqual(directory.staff_choices('lab_tech'), [(self.technician.pk, 'Gemechu')])
+
+    def test_booking_form_renders_doctors_without_queries(self):
+        str(AppointmentBookingForm()['doctor'])
+        with self.assertNumQueries(0):
+            html = str(AppointmentBookingForm()['doctor'])
+        self.assertIn('Dr. Tola Abdi', html)
+        self.assertNotIn('Gemechu', html)
+
+        form = AppointmentBookingForm({'doctor': self.technician.pk})
+        form.is_valid()
+        self.assertIn('doctor', form.errors)
+        form = AppointmentBookingForm({'doctor': self.doctors[0].pk})
+        form.is_valid()
+        self.assertEqual(form.cleaned_data['doctor'], self.doctors[0])
+
+    def test_save_and_delete_invalidate(self):
+        directory.staff_choices('doctor')
+        new = User.objects.create_user('dr_bontu', role='doctor', first_name='Bontu')
+        self.assertIn((new.pk, 'Bontu'), directory.staff_choices('doctor'))
+
+        self.technician.role = 'doctor'
+        self.technician.save()
+        self.assertEqual(directory.staff_choices('lab_tech'), [])
+
+        new.delete()
+        self.assertNotIn(new.pk, dict(directory.staff_choices('doctor')))
+
+    def test_only_shown_fields_invalidate_and_only_their_role(self):
+        doctor = self.doctors[0]
+        directory.staff_choices('doctor')
+        directory.staff_choices('lab_tech')
+        self.client.force_login(doctor)
+        doctor.email = 'tola@example.com'
+        doctor.save()
+        with self.assertNumQueries(0):
+            directory.staff_choices('doctor')
+
+        doctor.last_name = 'Abdisa'
+        doctor.save()
+        with self.assertNumQueries(0):
+            directory.staff_choices('lab_tech')
+        self.assertIn((doctor.pk, 'Tola Abdisa'), directory.staff_choices('doctor'))
+
+    def test_admin_picker_is_limited_to_role(self):
+        request = RequestFactory().get('/')
+        field = site._registry[LabTest].formfield_for_foreignkey(
+            LabTest._meta.get_field('technician'), request
+        )
+        self.assertIsInstance(field, directory.StaffChoiceField)
+        self.assertEqual([pk for pk, _ in field.choices][1:], [self.technician.pk])
@@ -1,3 +1,20 @@
 from django.contrib import admin
+from .models import DailyRollup, OutbreakAlert, RollupWatermark
 
-# Register your models here.
+@admin.register(DailyRollup)
+class DailyRollupAdmin(admin.ModelAdmin):
+    list_display = ['metric', 'day', 'dimension', 'count', 'total']
+    list_filter = ['metric']
+    date_hierarchy = 'day'
+    ordering = ['metric', '-day', 'dimension']
+
+@admin.register(RollupWatermark)
+class RollupWatermarkAdmin(admin.ModelAdmin):
+    list_display = ['source', 'last_pk', 'updated_at']
+
+@admin.register(OutbreakAlert)
+class OutbreakAlertAdmin(admin.ModelAdmin):
+    list_display = ['day', 'college', 'source', 'condition', 'observed', 'expected', 'score', 'acknowledged']
+    list_filter = ['acknowledged', 'source', 'college']
+    list_editable = ['acknowledged']
+    date_hierarchy = 'day'
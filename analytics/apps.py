@@ -4,3 +4,27 @@ from django.apps import AppConfig
 class AnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analytics'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save, pre_save
+        from appointments.signals import appointment_status_changed
+        from lab.models import LabTest
+        from medical.models import Consultation
+        from . import outbreaks, reports, rollups
+
+        for model in rollups.source_models().values():
+            pre_save.connect(rollups.remember_old_day, sender=model, dispatch_uid='daily_rollups')
+            post_save.connect(rollups.on_row_changed, sender=model, dispatch_uid='daily_rollups')
+            post_delete.connect(rollups.on_row_changed, sender=model, dispatch_uid='daily_rollups')
+        appointment_status_changed.connect(rollups.on_status_changed, dispatch_uid='daily_rollups')
+
+        for model in (LabTest, Consultation):
+            pre_save.connect(outbreaks.remember_old_case, sender=model, dispatch_uid='outbreaks')
+            post_save.connect(outbreaks.on_case_saved, sender=model, dispatch_uid='outbreaks')
+            post_delete.connect(outbreaks.on_case_deleted, sender=model, dispatch_uid='outbreaks')
+
+        # After the rollup receivers, so their on_commit refresh runs before the API cache moves on
+        for model in rollups.source_models().values():
+            post_save.connect(reports.source_changed, sender=model, dispatch_uid='analytics_api')
+            post_delete.connect(reports.source_changed, sender=model, dispatch_uid='analytics_api')
+        appointment_status_changed.connect(reports.appointment_status_changed, dispatch_uid='analytics_api')
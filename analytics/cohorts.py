@@ -0,0 +1,161 @@
+"""
+Cohort statistics over whole tables with NumPy
+
+Questions such as "how many days pass between a student's visits" or
+"what share of second-years come back" need every row of a large table
+grouped and compared, which is slow row by row in Python. Here the few
+columns a question needs are read with values_list in chunks into NumPy
+arrays. All grouping is then vectorised: lexsort and diff for intervals,
+unique/bincount for per-group counts, percentile for distributions.
+
+A visit is an appointment whose status is in VISIT_STATUSES, unless the
+caller passes other statuses.
+"""
+from itertools import islice
+from typing import NamedTuple
+
+import numpy as np
+
+from django.contrib.auth import get_user_model
+
+CHUNK_SIZE = 50000
+VISIT_STATUSES = ('Completed',)
+PERCENTILES = (25, 50, 75, 90, 99)
+# Upper bounds (days) of the revisit interval histogram; the last bucket is open-ended
+INTERVAL_BUCKETS = (7, 30, 90, 180, 365)
+
+
+def load_columns(queryset, fields, dtypes, chunk_size=CHUNK_SIZE):
+    """
+    One NumPy array per field of queryset, read chunk_size rows at a time.
+    Date fields should use dtype 'datetime64[D]'; use 'U' (or object) for text.
+    """
+    chunks = {field: [] for field in fields}
+    rows = queryset.order_by().values_list(*fields).iterator(chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        for field, dtype, column in zip(fields, dtypes, zip(*chunk)):
+            chunks[field].append(np.array(column, dtype=dtype))
+    return {
+        field: np.concatenate(parts) if parts else np.array([], dtype=dtype)
+        for (field, parts), dtype in zip(chunks.items(), dtypes)
+    }
+
+
+def visits(start=None, end=None, statuses=VISIT_STATUSES):
+    """student_id and date (as day numbers) of every visit from start to end"""
+    from appointments.models import Appointment
+    queryset = Appointment.objects.filter(status__in=statuses)
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    columns = load_columns(queryset, ['student_id', 'date'], [np.int64, 'datetime64[D]'])
+    return columns['student_id'], columns['date'].astype(np.int64)
+
+
+class Distribution(NamedTuple):
+    count: int
+    mean: float
+    percentiles: dict
+    histogram: list  # [(label, count)]
+
+    @classmethod
+    def of(cls, values, buckets):
+        labels = [f'{low}-{high}' for low, high in zip((0,) + tuple(b + 1 for b in buckets), buckets)]
+        labels.append(f'{buckets[-1] + 1}+')
+        counts = np.bincount(np.searchsorted(buckets, values, side='left'), minlength=len(labels))
+        if not len(values):
+            return cls(0, 0.0, {p: None for p in PERCENTILES}, list(zip(labels, counts.tolist())))
+        return cls(
+            int(len(values)),
+            round(float(values.mean()), 2),
+            dict(zip(PERCENTILES, np.percentile(values, PERCENTILES).round(1).tolist())),
+            list(zip(labels, counts.tolist())),
+        )
+
+
+def revisit_intervals(start=None, end=None, statuses=VISIT_STATUSES):
+    """Distribution of days between consecutive visits of the same student"""
+    students, days = visits(start, end, statuses)
+    order = np.lexsort((days, students))
+    students, days = students[order], days[order]
+    same_student = students[1:] == students[:-1]
+    intervals = np.diff(days)[same_student]
+    return Distribution.of(intervals, INTERVAL_BUCKETS)
+
+
+class GroupRate(NamedTuple):
+    group: object
+    students: int  # students of the group with at least one visit
+    repeat_students: int  # ... with two or more
+    visits: int
+
+    @property
+    def repeat_rate(self):
+        return self.repeat_students / self.students if self.students else 0.0
+
+    @property
+    def visits_per_student(self):
+        return self.visits / self.students if self.students else 0.0
+
+
+def repeat_visit_rate(by='year', start=None, end=None, statuses=VISIT_STATUSES):
+    """GroupRate per value of a StudentProfile field (year, college, ...), in group order"""
+    from students.models import StudentProfile
+    students, _ = visits(start, end, statuses)
+    visited, per_student = np.unique(students, return_counts=True)
+
+    profiles = load_columns(StudentProfile.objects.all(), ['pk', by], [np.int64, object])
+    order = np.argsort(profiles['pk'])
+    profile_pks, profile_groups = profiles['pk'][order], profiles[by][order]
+    groups, group_index = np.unique(profile_groups[np.searchsorted(profile_pks, visited)], return_inverse=True)
+
+    n = len(groups)
+    students_per_group = np.bincount(group_index, minlength=n)
+    repeats_per_group = np.bincount(group_index, weights=per_student >= 2, minlength=n).astype(np.int64)
+    visits_per_group = np.bincount(group_index, weights=per_student, minlength=n).astype(np.int64)
+    return [
+        GroupRate(group, int(s), int(r), int(v))
+        for group, s, r, v in zip(groups.tolist(), students_per_group, repeats_per_group, visits_per_group)
+    ]
+
+
+class Throughput(NamedTuple):
+    doctor_id: int
+    username: str
+    consultations: int
+    days: int  # days with at least one consultation
+    per_day: float
+    per_day_p90: float
+    busiest_day: int
+
+
+def doctor_throughput(start=None, end=None):
+    """Consultations per doctor and per working day, busiest doctor first"""
+    from medical.models import Consultation
+    queryset = Consultation.objects.all()
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    columns = load_columns(queryset, ['doctor_id', 'date'], [np.int64, 'datetime64[D]'])
+    doctors, days = columns['doctor_id'], columns['date'].astype(np.int64)
+    if not len(doctors):
+        return []
+
+    # One row per (doctor, day) with its consultation count, sorted by doctor
+    pairs, per_day = np.unique(np.stack([doctors, days], axis=1), axis=0, return_counts=True)
+    doctor_ids, first, days_worked = np.unique(pairs[:, 0], return_index=True, return_counts=True)
+    totals = np.add.reduceat(per_day, first)
+    busiest = np.maximum.reduceat(per_day, first)
+    p90 = [np.percentile(per_day[i:i + n], 90) for i, n in zip(first, days_worked)]
+
+    names = dict(get_user_model().objects.filter(pk__in=doctor_ids.tolist()).values_list('pk', 'username'))
+    results = [
+        Throughput(int(pk), names.get(int(pk), ''), int(total), int(n), round(total / n, 2), round(float(q), 1), int(top))
+        for pk, total, n, q, top in zip(doctor_ids, totals, days_worked, p90, busiest)
+    ]
+    return sorted(results, key=lambda row: (-row.consultations, row.doctor_id))
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutbreakAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('college', models.CharField(max_length=100)),
+                ('source', models.CharField(choices=[('lab', 'Lab positive'), ('diagnosis', 'Diagnosis')], max_length=20)),
+                ('condition', models.CharField(help_text='Test type for lab positives, ICD-10 code for diagnoses', max_length=50)),
+                ('day', models.DateField(help_text='Last day of the window')),
+                ('observed', models.PositiveIntegerField(help_text='Cases in the window')),
+                ('expected', models.FloatField(help_text='Cases the baseline days predict for the window')),
+                ('score', models.FloatField()),
+                ('acknowledged', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-day', '-score'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='outbreakalert',
+            constraint=models.UniqueConstraint(fields=('college', 'source', 'condition', 'day'), name='unique_outbreak_alert'),
+        ),
+    ]
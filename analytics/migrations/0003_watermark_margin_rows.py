@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_outbreak_alerts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupwatermark',
+            name='margin_rows',
+            field=models.PositiveIntegerField(blank=True, help_text='Rows within WATERMARK_MARGIN below last_pk at the last refresh; empty means re-check them', null=True),
+        ),
+    ]
@@ -1,3 +1,60 @@
 from django.db import models
 
-# Create your models here.
+class DailyRollup(models.Model):
+    """
+    One aggregate per (metric, day, dimension), e.g. appointments of one
+    doctor on one day. Maintained by analytics.rollups; reports read these
+    rows instead of the raw tables.
+    """
+    metric = models.CharField(max_length=50)
+    day = models.DateField()
+    dimension = models.CharField(max_length=50, blank=True, help_text="Doctor id, status, test type... as text; blank when the source value is empty")
+    count = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Sum of the metric's amount field, if it has one")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['metric', 'day', 'dimension'], name='unique_daily_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.metric} {self.day} {self.dimension or '-'}: {self.count}"
+
+class RollupWatermark(models.Model):
+    """Highest primary key of a source table already folded into the rollups"""
+    source = models.CharField(max_length=50, unique=True)
+    last_pk = models.BigIntegerField(default=0)
+    margin_rows = models.PositiveIntegerField(null=True, blank=True, help_text="Rows within WATERMARK_MARGIN below last_pk at the last refresh; empty means re-check them")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source} up to #{self.last_pk}"
+
+class OutbreakAlert(models.Model):
+    """
+    A spike flagged by analytics.outbreaks: more cases of one condition in
+    one college over the window ending on day than its baseline predicts
+    """
+    SOURCES = (
+        ('lab', 'Lab positive'),
+        ('diagnosis', 'Diagnosis'),
+    )
+
+    college = models.CharField(max_length=100)
+    source = models.CharField(max_length=20, choices=SOURCES)
+    condition = models.CharField(max_length=50, help_text="Test type for lab positives, ICD-10 code for diagnoses")
+    day = models.DateField(help_text="Last day of the window")
+    observed = models.PositiveIntegerField(help_text="Cases in the window")
+    expected = models.FloatField(help_text="Cases the baseline days predict for the window")
+    score = models.FloatField()
+    acknowledged = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-day', '-score']
+        constraints = [
+            models.UniqueConstraint(fields=['college', 'source', 'condition', 'day'], name='unique_outbreak_alert'),
+        ]
+
+    def __str__(self):
+        return f"{self.condition} in {self.college} on {self.day}: {self.observed} cases (expected {self.expected:.1f})"
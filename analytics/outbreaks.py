@@ -0,0 +1,297 @@
+"""
+Sliding-window outbreak detection per college
+
+Students share dorms, so a handful of positive malaria or TB results in
+one college within a few days matters more than the monthly totals. The
+detector keeps a RingCounter of daily case counts for every
+(college, source, condition). Each ring covers the last WINDOW_DAYS plus
+BASELINE_DAYS days. Each new case updates one slot, then the window's
+cases are compared with what the baseline days before it predict:
+
+    expected = baseline cases / BASELINE_DAYS * WINDOW_DAYS
+    score    = (observed - expected) / sqrt(max(expected, MIN_EXPECTED))
+
+A key is flagged when observed >= MIN_CASES and score >= THRESHOLD (a
+Poisson z-score, as in the CDC's EARS methods), at most once per window.
+
+Cases are lab tests whose result reads positive (source 'lab', condition
+the test type) and coded consultations (source 'diagnosis', condition the
+ICD-10 code). Saves feed the process-wide detector on commit (see
+AnalyticsConfig.ready), and flagged spikes are stored as OutbreakAlert.
+The detector warms up from the last WINDOW_DAYS + BASELINE_DAYS days,
+never the whole history, and reloads after RELOAD_SECONDS. Both happen
+in a background thread, never in the request that saved the case. Cases
+saved by other processes or bulk imports reach the alerts through
+scan_recent(), which refresh_rollups runs. replay() runs any date range
+through a fresh detector to backtest thresholds (see the
+detect_outbreaks command).
+"""
+import datetime
+import heapq
+import logging
+import math
+import threading
+import time
+from array import array
+from operator import itemgetter
+from typing import NamedTuple
+
+from django.db import connections, transaction
+from django.db.models import Q
+
+from .models import OutbreakAlert
+from .rollups import POSITIVE_RESULTS, is_positive
+
+logger = logging.getLogger(__name__)
+
+WINDOW_DAYS = 3
+BASELINE_DAYS = 28
+THRESHOLD = 3.0
+MIN_CASES = 3
+# Floor for the expected count, so a condition with no baseline needs
+# MIN_CASES cases rather than one to be flagged
+MIN_EXPECTED = 0.5
+RELOAD_SECONDS = 900
+REPLAY_CHUNK_SIZE = 2000
+
+
+class RingCounter:
+    """Daily counts for the last `size` days, in one array indexed by day ordinal modulo size"""
+    __slots__ = ('counts', 'newest')
+
+    def __init__(self, size):
+        self.counts = array('I', [0]) * size
+        self.newest = None
+
+    def add(self, day, n=1):
+        """Count n cases (negative to retract) on day, an ordinal; False if day has left the ring"""
+        size = len(self.counts)
+        if self.newest is None:
+            self.newest = day
+        elif day > self.newest:
+            for skipped in range(self.newest + 1, min(day, self.newest + size) + 1):
+                self.counts[skipped % size] = 0
+            self.newest = day
+        elif day <= self.newest - size:
+            return False
+        slot = day % size
+        self.counts[slot] = max(self.counts[slot] + n, 0)
+        return True
+
+    def total(self, first, last):
+        """Cases from day first to last inclusive, counting only days still in the ring"""
+        size = len(self.counts)
+        first = max(first, self.newest - size + 1)
+        last = min(last, self.newest)
+        return sum(self.counts[day % size] for day in range(first, last + 1))
+
+
+class Alert(NamedTuple):
+    college: str
+    source: str
+    condition: str
+    day: datetime.date
+    observed: int
+    expected: float
+    score: float
+
+
+class OutbreakDetector:
+    def __init__(self, window_days=WINDOW_DAYS, baseline_days=BASELINE_DAYS,
+                 threshold=THRESHOLD, min_cases=MIN_CASES):
+        self.window_days = window_days
+        self.baseline_days = baseline_days
+        self.threshold = threshold
+        self.min_cases = min_cases
+        self.counters = {}
+        self.last_alert = {}
+
+    def observe(self, college, source, condition, day, n=1):
+        """Count n cases of condition in college on day; the Alert if that makes a spike, else None"""
+        key = (college, source, condition)
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters[key] = RingCounter(self.window_days + self.baseline_days)
+        if not counter.add(day.toordinal(), n) or n <= 0:
+            return None
+
+        newest = counter.newest
+        window_start = newest - self.window_days + 1
+        observed = counter.total(window_start, newest)
+        baseline = counter.total(window_start - self.baseline_days, window_start - 1)
+        expected = baseline / self.baseline_days * self.window_days
+        score = (observed - expected) / math.sqrt(max(expected, MIN_EXPECTED))
+        if observed < self.min_cases or score < self.threshold:
+            return None
+
+        last = self.last_alert.get(key)
+        if last is not None and newest - last < self.window_days:
+            return None
+        self.last_alert[key] = newest
+        return Alert(college, source, condition, datetime.date.fromordinal(newest),
+                     observed, round(expected, 2), round(score, 2))
+
+
+def cases(start=None, end=None):
+    """(day, college, source, condition) of every case from start to end, oldest first"""
+    from lab.models import LabTest
+    from medical.models import Consultation
+
+    days = Q()
+    if start:
+        days &= Q(date__gte=start)
+    if end:
+        days &= Q(date__lte=end)
+    positives = (LabTest.objects.filter(days, POSITIVE_RESULTS).order_by('date', 'id')
+                 .values_list('date', 'student__college', 'test_type').iterator(REPLAY_CHUNK_SIZE))
+    diagnoses = (Consultation.objects.filter(days, diagnosis_code__isnull=False).order_by('date', 'id')
+                 .values_list('date', 'student__college', 'diagnosis_code__code').iterator(REPLAY_CHUNK_SIZE))
+    return heapq.merge(
+        ((day, college, 'lab', test_type) for day, college, test_type in positives),
+        ((day, college, 'diagnosis', code) for day, college, code in diagnoses),
+        key=itemgetter(0),
+    )
+
+
+def replay(start=None, end=None, detector=None):
+    """Feed every case from start to end through detector (a fresh one by default); returns its alerts"""
+    detector = detector or OutbreakDetector()
+    alerts = []
+    for day, college, source, condition in cases(start, end):
+        alert = detector.observe(college, source, condition, day)
+        if alert:
+            alerts.append(alert)
+    return alerts
+
+
+def save_alert(alert, window_days=WINDOW_DAYS):
+    """Store alert unless its key was already flagged within the window; returns the new OutbreakAlert or None"""
+    key = {'college': alert.college, 'source': alert.source, 'condition': alert.condition}
+    window_start = alert.day - datetime.timedelta(days=window_days - 1)
+    if OutbreakAlert.objects.filter(**key, day__gte=window_start, day__lte=alert.day).exists():
+        return None
+    record, created = OutbreakAlert.objects.get_or_create(**key, day=alert.day, defaults={
+        'observed': alert.observed, 'expected': alert.expected, 'score': alert.score,
+    })
+    if not created:
+        return None
+    logger.warning('Possible outbreak: %s', record)
+    return record
+
+
+def _live_replay():
+    """A fresh detector fed the days the live one covers, and the alerts it raised"""
+    detector = OutbreakDetector()
+    since = datetime.date.today() - datetime.timedelta(days=detector.window_days + detector.baseline_days - 1)
+    return detector, replay(start=since, detector=detector)
+
+
+def scan_recent():
+    """Store the alerts of the live window's cases, whichever process saved them; returns the new ones"""
+    _, alerts = _live_replay()
+    return [record for record in map(save_alert, alerts) if record]
+
+
+class LiveDetector:
+    """The process-wide detector, warmed up from recent records and reloaded periodically"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._detector = None
+        self._loaded_at = None
+        self._reloading = False
+
+    def reload(self):
+        detector, alerts = _live_replay()
+        with self._lock:
+            self._detector = detector
+            self._loaded_at = time.monotonic()
+        return alerts
+
+    def _reload_in_background(self):
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._background_reload, name='outbreak-detector-reload', daemon=True).start()
+
+    def _background_reload(self):
+        try:
+            for alert in self.reload():
+                save_alert(alert)
+        except Exception:
+            logger.exception('Could not reload the outbreak detector')
+        finally:
+            self._reloading = False
+            connections.close_all()
+
+    def record(self, college, source, condition, day, n=1):
+        """Count a committed case (n=-1 retracts one); returns the stored OutbreakAlert, if any"""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > RELOAD_SECONDS:
+            self._reload_in_background()
+        with self._lock:
+            if self._detector is None:
+                # Still warming up: the reload reads this committed case itself
+                return None
+            alert = self._detector.observe(college, source, condition, day, n)
+        return save_alert(alert) if alert else None
+
+
+detector = LiveDetector()
+
+
+# Signal receivers
+
+def _case(sender, lab_result=None, test_type=None, diagnosis_code_id=None):
+    from lab.models import LabTest
+    if issubclass(sender, LabTest):
+        return ('lab', test_type) if is_positive(lab_result) else None
+    return ('diagnosis', diagnosis_code_id) if diagnosis_code_id else None
+
+
+def _case_of(sender, instance):
+    return _case(sender, getattr(instance, 'result', None), getattr(instance, 'test_type', None),
+                 getattr(instance, 'diagnosis_code_id', None))
+
+
+def remember_old_case(sender, instance, raw=False, **kwargs):
+    """pre_save: a lab result edited to positive, or a consultation coded later, is a new case"""
+    instance._outbreak_old_case = None
+    if instance.pk and not raw:
+        fields = ['result', 'test_type'] if hasattr(instance, 'result') else ['diagnosis_code_id']
+        row = sender.objects.filter(pk=instance.pk).values(*fields).first()
+        if row:
+            instance._outbreak_old_case = _case(sender, row.get('result'), row.get('test_type'),
+                                                row.get('diagnosis_code_id'))
+
+
+def _record_on_commit(student_id, day, case, n):
+    def record():
+        from medical.models import DiagnosisCode
+        from students.models import StudentProfile
+        college = StudentProfile.objects.filter(pk=student_id).values_list('college', flat=True).first()
+        source, condition = case
+        if source == 'diagnosis':
+            condition = DiagnosisCode.objects.filter(pk=condition).values_list('code', flat=True).first()
+        if college and condition:
+            detector.record(college, source, condition, day, n)
+    # robust: the case has committed either way; scan_recent() catches a missed alert
+    transaction.on_commit(record, robust=True)
+
+
+def on_case_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old, new = getattr(instance, '_outbreak_old_case', None), _case_of(sender, instance)
+    if old == new:
+        return
+    if old:
+        _record_on_commit(instance.student_id, instance.date, old, -1)
+    if new:
+        _record_on_commit(instance.student_id, instance.date, new, 1)
+
+
+def on_case_deleted(sender, instance, **kwargs):
+    case = _case_of(sender, instance)
+    if case:
+        _record_on_commit(instance.student_id, instance.date, case, -1)
@@ -0,0 +1,165 @@
+"""
+Aggregate reports behind the analytics API, and the versions that key their caches
+
+Each report reads one or more sources ('appointments', 'consultations',
+'lab_tests', 'bills', the names analytics.rollups uses). Every source
+has a version in the cache: a generation number and the time it last
+changed. source_changed() bumps it on commit whenever a row is saved or
+deleted (see AnalyticsConfig.ready). Bulk loaders and the rollup commands
+call invalidate(). Reading a version is one cache read and no query of
+the source tables, so the API can answer conditional GETs and find cached
+responses cheaply. Versions are only correct across processes (web
+workers, the rollup cron job, management commands) with a shared cache:
+set CACHE_TABLE in such deployments (see settings).
+
+Top diagnoses and lab positivity read the daily rollups. Visits and
+revenue need student and service columns that the rollups do not keep,
+so they aggregate the source tables over an indexed date range.
+"""
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth, TruncWeek, TruncYear
+
+from . import rollups
+from .cohorts import VISIT_STATUSES
+
+CACHE_PREFIX = 'analytics_api'
+SOURCES = ('appointments', 'consultations', 'lab_tests', 'bills')
+
+PERIODS = {
+    'day': F,
+    'week': TruncWeek,
+    'month': TruncMonth,
+    'year': TruncYear,
+}
+STUDENT_GROUPS = ('college', 'department', 'year', 'gender')
+
+
+def _version_key(source):
+    return f'{CACHE_PREFIX}:version:{source}'
+
+
+def _new_version(previous=None):
+    # Whole seconds, as Last-Modified has no finer resolution; always later than the previous one
+    now = int(time.time())
+    if previous is not None:
+        now = max(now, previous[1] + 1)
+    return (time.time_ns(), now)
+
+
+def versions(sources):
+    """{source: (generation, last modified as a Unix timestamp)}"""
+    keys = {_version_key(source): source for source in sources}
+    found = cache.get_many(keys)
+    for key, source in keys.items():
+        if key not in found:
+            # Seeded from the clock, so an evicted version never matches an old ETag
+            cache.add(key, _new_version(), None)
+            found[key] = cache.get(key)
+    return {source: found[key] for key, source in keys.items()}
+
+
+def invalidate(*sources):
+    """Bump the version of sources (all of them if none given)"""
+    keys = [_version_key(source) for source in sources or SOURCES]
+    current = cache.get_many(keys)
+    cache.set_many({key: _new_version(current.get(key)) for key in keys}, None)
+
+
+def source_changed(sender, **kwargs):
+    source = next((name for name, model in rollups.source_models().items() if issubclass(sender, model)), None)
+    if source:
+        transaction.on_commit(lambda: invalidate(source))
+
+
+def appointment_status_changed(sender, **kwargs):
+    invalidate('appointments')
+
+
+# Reports
+
+def _date_range(start, end, field='date'):
+    return Q(**{f'{field}__gte': start, f'{field}__lte': end})
+
+
+def visits(start, end, by='college', period='month'):
+    """Visits and distinct students per period and student group"""
+    from appointments.models import Appointment
+    group = f'student__{by}'
+    rows = (Appointment.objects.filter(_date_range(start, end), status__in=VISIT_STATUSES)
+            .annotate(period=PERIODS[period]('date'))
+            .values('period', group).order_by('period', group)
+            .annotate(visits=Count('pk'), students=Count('student', distinct=True)))
+    return [
+        {'period': row['period'], by: row[group], 'visits': row['visits'], 'students': row['students']}
+        for row in rows
+    ]
+
+
+def top_diagnoses(start, end, limit=10):
+    """Most frequent coded diagnoses, with their share of all consultations"""
+    from medical.models import DiagnosisCode
+    rows = rollups.totals('consultations_by_diagnosis', start, end)
+    consultations = sum(count for _, count, _ in rows)
+    coded = [(int(dimension), count) for dimension, count, _ in rows if dimension][:limit]
+    codes = DiagnosisCode.objects.in_bulk([pk for pk, _ in coded])
+    return [
+        {
+            'code': codes[pk].code if pk in codes else None,
+            'name': codes[pk].name if pk in codes else None,
+            'consultations': count,
+            'share': round(count / consultations, 4),
+        }
+        for pk, count in coded
+    ]
+
+
+def lab_positivity(start, end):
+    """Tests, positives and positivity rate per test type"""
+    positives = {dimension: count for dimension, count, _ in rollups.totals('lab_positives_by_type', start, end)}
+    return [
+        {
+            'test_type': test_type,
+            'tests': tests,
+            'positives': positives.get(test_type, 0),
+            'rate': round(positives.get(test_type, 0) / tests, 4),
+        }
+        for test_type, tests, _ in rollups.totals('lab_tests_by_type', start, end)
+    ]
+
+
+def _money(amount):
+    # As text with two decimals, like DRF's DecimalField; SQLite's SUM drops the scale
+    return str(Decimal(amount or 0).quantize(Decimal('0.01')))
+
+
+def revenue(start, end):
+    """Billed and paid amounts per service, largest first"""
+    from billing.models import Bill
+    rows = (Bill.objects.filter(_date_range(start, end))
+            .values('service').order_by()
+            .annotate(bills=Count('pk'), billed=Sum('amount'), paid=Sum('amount', filter=Q(status='Paid'))))
+    rows = sorted(rows, key=lambda row: (-row['billed'], row['service']))
+    return [
+        {
+            'service': row['service'],
+            'bills': row['bills'],
+            'billed': _money(row['billed']),
+            'paid': _money(row['paid']),
+        }
+        for row in rows
+    ]
+
+
+# name -> (function, sources it reads)
+REPORTS = {
+    'visits': (visits, ['appointments']),
+    'top_diagnoses': (top_diagnoses, ['consultations']),
+    'lab_positivity': (lab_positivity, ['lab_tests']),
+    'revenue': (revenue, ['bills']),
+}
+
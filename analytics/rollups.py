@@ -0,0 +1,226 @@
+"""
+Daily rollups of appointments, consultations, lab tests and bills
+
+Each metric counts (and optionally sums) the rows of one source table per
+day and dimension. A day is always recomputed whole from the source's
+date index, never adjusted by +1/-1, so the rollups cannot drift.
+Recomputation is triggered in three ways:
+
+* Signals (see AnalyticsConfig.ready): saves, deletes and bulk status
+  transitions refresh the days they touch once the transaction commits.
+* refresh_new_rows(): picks up rows inserted without signals (the bulk
+  and COPY importers) past each source's high-water mark, and re-checks
+  the WATERMARK_MARGIN rows just below it for rows that committed late
+  (a lower pk, but committed after the mark was read). The
+  refresh_rollups command runs it periodically, and can also refresh
+  the last few days to catch in-place queryset.update() calls.
+* rebuild(): recomputes any date range from scratch (rebuild_rollups).
+
+Reports read only DailyRollup through series() and totals(), so their
+cost depends on the number of days, not on the size of the source tables.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+
+from .models import DailyRollup, RollupWatermark
+
+# Days recomputed per transaction by rebuild()
+REBUILD_WINDOW_DAYS = 31
+# Rows below the watermark re-checked on each refresh. Must exceed the rows
+# that can be in flight at once (import workers x batch size); anything
+# committing further behind needs rebuild_rollups.
+WATERMARK_MARGIN = 50000
+
+
+# A lab result is positive when it starts with this word, as the lab enters
+# them ("Positive", "Positive (P. falciparum)"); "Not positive",
+# "Non-positive" or "Negative" are not
+POSITIVE_RESULT = 'positive'
+POSITIVE_RESULTS = Q(result__istartswith=POSITIVE_RESULT)
+
+
+def is_positive(result):
+    """Whether a lab result reads positive: POSITIVE_RESULTS for one value"""
+    return (result or '').lower().startswith(POSITIVE_RESULT)
+
+
+class Metric(NamedTuple):
+    source: str
+    dimension: str
+    filter: Q = Q()
+    total: str = None
+
+
+METRICS = {
+    'appointments_by_doctor': Metric('appointments', 'doctor_id'),
+    'appointments_by_status': Metric('appointments', 'status'),
+    'consultations_by_diagnosis': Metric('consultations', 'diagnosis_code_id'),
+    'lab_tests_by_type': Metric('lab_tests', 'test_type'),
+    'lab_positives_by_type': Metric('lab_tests', 'test_type', POSITIVE_RESULTS),
+    'bills_by_status': Metric('bills', 'status', total='amount'),
+}
+
+
+def source_models():
+    from appointments.models import Appointment
+    from billing.models import Bill
+    from lab.models import LabTest
+    from medical.models import Consultation
+    return {
+        'appointments': Appointment,
+        'consultations': Consultation,
+        'lab_tests': LabTest,
+        'bills': Bill,
+    }
+
+
+def metrics_for(source):
+    return {name: metric for name, metric in METRICS.items() if metric.source == source}
+
+
+def _recompute(source, **day_lookups):
+    """
+    Replace the rollups of source's metrics for the days selected by
+    day_lookups, e.g. __in=[...] or __gte=start, __lte=end
+    """
+    model = source_models()[source]
+    days_filter = Q(**{f'date{lookup}': value for lookup, value in day_lookups.items()})
+    rollup_filter = Q(**{f'day{lookup}': value for lookup, value in day_lookups.items()})
+    with transaction.atomic():
+        for name, metric in metrics_for(source).items():
+            aggregates = {'count': Count('pk')}
+            if metric.total:
+                aggregates['total'] = Sum(metric.total)
+            rows = (model.objects.filter(days_filter, metric.filter)
+                    .values('date', metric.dimension).order_by().annotate(**aggregates))
+            DailyRollup.objects.filter(rollup_filter, metric=name).delete()
+            DailyRollup.objects.bulk_create([
+                DailyRollup(
+                    metric=name, day=row['date'],
+                    dimension='' if row[metric.dimension] is None else str(row[metric.dimension]),
+                    count=row['count'], total=row.get('total') or 0,
+                )
+                for row in rows
+            ], update_conflicts=True, unique_fields=['metric', 'day', 'dimension'], update_fields=['count', 'total'])
+
+
+def refresh_days(source, days):
+    """Recompute source's metrics for a few specific days"""
+    days = sorted({day for day in days if day is not None})
+    if days:
+        _recompute(source, __in=days)
+
+
+def rebuild(start, end, sources=None):
+    """Recompute every metric (or those of sources) from start to end inclusive, in windows"""
+    for source in sources or source_models():
+        window_start = start
+        while window_start <= end:
+            window_end = min(window_start + datetime.timedelta(days=REBUILD_WINDOW_DAYS - 1), end)
+            _recompute(source, __gte=window_start, __lte=window_end)
+            window_start = window_end + datetime.timedelta(days=1)
+
+
+def _margin(model, last_pk):
+    return model.objects.filter(pk__gt=max(last_pk - WATERMARK_MARGIN, 0), pk__lte=last_pk)
+
+
+def _days(rows):
+    return set(rows.order_by().values_list('date', flat=True).distinct())
+
+
+def refresh_new_rows(source):
+    """
+    Fold rows added past the source's high-water mark, or committed late
+    just below it, into the rollups; returns days refreshed
+    """
+    model = source_models()[source]
+    watermark, _ = RollupWatermark.objects.get_or_create(source=source)
+    high = model.objects.filter(pk__gt=watermark.last_pk).aggregate(high=Max('pk'))['high']
+    late = _margin(model, watermark.last_pk).count() != watermark.margin_rows
+    if high is None and not late:
+        return 0
+    last_pk = high or watermark.last_pk
+    # Counted before the days are read: a row committing in between changes the next count
+    margin_rows = _margin(model, last_pk).count()
+
+    days = set()
+    if late:
+        days |= _days(_margin(model, watermark.last_pk))
+    if high is not None:
+        days |= _days(model.objects.filter(pk__gt=watermark.last_pk, pk__lte=high))
+    refresh_days(source, days)
+    watermark.last_pk, watermark.margin_rows = last_pk, margin_rows
+    watermark.save(update_fields=['last_pk', 'margin_rows', 'updated_at'])
+    return len(days)
+
+
+def high_water_marks(sources=None):
+    """{source: highest pk now}; taken before a full rebuild, so rows added during it are not skipped"""
+    return {
+        source: source_models()[source].objects.aggregate(high=Max('pk'))['high'] or 0
+        for source in sources or source_models()
+    }
+
+
+def advance_watermarks(marks):
+    for source, high in marks.items():
+        RollupWatermark.objects.update_or_create(source=source, defaults={'last_pk': high, 'margin_rows': None})
+
+
+# Reading
+
+def series(metric, start, end, dimension=None):
+    """{day: count} for metric between start and end, for one dimension or all combined"""
+    rows = DailyRollup.objects.filter(metric=metric, day__gte=start, day__lte=end)
+    if dimension is not None:
+        rows = rows.filter(dimension=str(dimension))
+    result = defaultdict(int)
+    for day, count in rows.values_list('day', 'count'):
+        result[day] += count
+    return dict(sorted(result.items()))
+
+
+def totals(metric, start, end):
+    """[(dimension, count, total)] for metric between start and end, largest count first"""
+    rows = (DailyRollup.objects.filter(metric=metric, day__gte=start, day__lte=end)
+            .values('dimension').order_by().annotate(count=Sum('count'), total=Sum('total')))
+    return sorted(
+        ((row['dimension'], row['count'], row['total'] or Decimal('0')) for row in rows),
+        key=lambda item: (-item[1], item[0]),
+    )
+
+
+# Signal receivers
+
+def _source_of(model):
+    for source, source_model in source_models().items():
+        if issubclass(model, source_model):
+            return source
+    return None
+
+
+def remember_old_day(sender, instance, raw=False, **kwargs):
+    """pre_save: an edit that moves a row to another day must refresh both days"""
+    instance._rollup_old_day = None
+    if instance.pk and not raw:
+        instance._rollup_old_day = (sender.objects.filter(pk=instance.pk)
+                                    .values_list('date', flat=True).first())
+
+
+def on_row_changed(sender, instance, **kwargs):
+    source = _source_of(sender)
+    days = {instance.date, getattr(instance, '_rollup_old_day', None)}
+    # robust: the save has committed either way; refresh_rollups --days repairs a failed refresh
+    transaction.on_commit(lambda: refresh_days(source, days), robust=True)
+
+
+def on_status_changed(sender, pks, status, **kwargs):
+    from appointments.models import Appointment
+    days = Appointment.objects.filter(pk__in=pks).order_by().values_list('date', flat=True).distinct()
+    refresh_days('appointments', days)
@@ -0,0 +1,27 @@
+import datetime
+from rest_framework import serializers
+from .reports import PERIODS, STUDENT_GROUPS
+
+# Range used when a request gives no start or end
+DEFAULT_RANGE_DAYS = 365
+
+
+class DateRangeSerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, data):
+        data['end'] = data.get('end') or datetime.date.today()
+        data['start'] = data.get('start') or data['end'] - datetime.timedelta(days=DEFAULT_RANGE_DAYS - 1)
+        if data['start'] > data['end']:
+            raise serializers.ValidationError('start must not be after end.')
+        return data
+
+
+class VisitsQuerySerializer(DateRangeSerializer):
+    by = serializers.ChoiceField(choices=STUDENT_GROUPS, default='college')
+    period = serializers.ChoiceField(choices=list(PERIODS), default='month')
+
+
+class TopDiagnosesQuerySerializer(DateRangeSerializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
@@ -1,3 +1,414 @@
+from datetime import date, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+from rest_framework.throttling import ScopedRateThrottle
+
+from appointments.models import Appointment
+from appointments.transitions import transition
+from billing.models import Bill
+from lab.models import LabTest
+from students.models import StudentProfile
+from medical.models import Consultation, DiagnosisCode
+from . import cohorts, outbreaks, reports, rollups
+from .models import DailyRollup, OutbreakAlert, RollupWatermark
+
+User = get_user_model()
+
+
+class DailyRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctors = [User.objects.create_user(f'dr_{i}', role='doctor') for i in range(2)]
+        user = User.objects.create_user('st_roba', role='student')
+        cls.student = StudentProfile.objects.create(
+            user=user, student_id='HU-UGR-2023-60000', college='CoE',
+            department='Civil', gender='M', year=2
+        )
+        cls.day = date(2024, 9, 2)
+
+    def book(self, doctor, day, hour=8, **kwargs):
+        return Appointment.objects.create(
+            student=self.student, doctor=doctor, date=day, time=time(hour, 0), reason='Visit', **kwargs
+        )
+
+    def rollup(self, metric, day):
+        return dict(DailyRollup.objects.filter(metric=metric, day=day).values_list('dimension', 'count'))
+
+    def test_saves_deletes_and_transitions_refresh_their_days(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.book(self.doctors[0], self.day)
+            self.book(self.doctors[0], self.day, hour=9)
+            self.book(self.doctors[1], self.day)
+        self.assertEqual(self.rollup('appointments_by_doctor', self.day),
+                         {str(self.doctors[0].pk): 2, str(self.doctors[1].pk): 1})
+        self.assertEqual(self.rollup('appointments_by_status', self.day), {'Pending': 3})
+
+        next_day = self.day + timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.date = next_day
+            first.save()
+        self.assertEqual(self.rollup('appointments_by_status', self.day), {'Pending': 2})
+        self.assertEqual(self.rollup('appointments_by_status', next_day), {'Pending': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transition(Appointment.objects.filter(date=self.day), 'Approved')
+        self.assertEqual(self.rollup('appointments_by_status', self.day), {'Approved': 2})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.rollup('appointments_by_status', next_day), {})
+
+    def test_watermark_picks_up_bulk_inserts_once(self):
+        Bill.objects.bulk_create([
+            Bill(student=self.student, service='Consultation Fee', amount=Decimal('25.00'), date=self.day),
+            Bill(student=self.student, service='X-Ray', amount=Decimal('75.00'), date=self.day, status='Paid'),
+            Bill(student=self.student, service='ECG', amount=Decimal('40.00'), date=self.day),
+        ])
+        self.assertFalse(DailyRollup.objects.exists())
+
+        self.assertEqual(rollups.refresh_new_rows('bills'), 1)
+        self.assertEqual(rollups.totals('bills_by_status', self.day, self.day),
+                         [('Pending', 2, Decimal('65.00')), ('Paid', 1, Decimal('75.00'))])
+        self.assertEqual(RollupWatermark.objects.get(source='bills').last_pk, Bill.objects.latest('pk').pk)
+        self.assertEqual(rollups.refresh_new_rows('bills'), 0)
+
+    def test_watermark_picks_up_rows_that_commit_late(self):
+        later = self.day + timedelta(days=1)
+        Bill.objects.bulk_create([Bill(pk=1000, student=self.student, service='X-Ray',
+                                       amount=Decimal('75.00'), date=self.day)])
+        self.assertEqual(rollups.refresh_new_rows('bills'), 1)
+        self.assertEqual(rollups.refresh_new_rows('bills'), 0)
+
+        # A lower pk committing after the watermark passed it, as parallel importers do
+        Bill.objects.bulk_create([Bill(pk=990, student=self.student, service='ECG',
+                                       amount=Decimal('40.00'), date=later)])
+        self.assertEqual(rollups.refresh_new_rows('bills'), 2)  # Every day in the margin
+        self.assertEqual(rollups.totals('bills_by_status', later, later), [('Pending', 1, Decimal('40.00'))])
+        self.assertEqual(RollupWatermark.objects.get(source='bills').last_pk, 1000)
+        self.assertEqual(rollups.refresh_new_rows('bills'), 0)
+
+    def test_positive_results_match_by_leading_word(self):
+        results = ['Positive', 'positive (P. vivax)', 'Not positive', 'Non-positive', 'Negative', '']
+        LabTest.objects.bulk_create([
+            LabTest(student=self.student, test_type='Malaria', result=result, date=self.day) for result in results
+        ])
+        rollups.rebuild(self.day, self.day, ['lab_tests'])
+        self.assertEqual(rollups.series('lab_positives_by_type', self.day, self.day), {self.day: 2})
+        self.assertEqual([rollups.is_positive(result) for result in results],
+                         [True, True, False, False, False, False])
+        self.assertEqual(len(list(outbreaks.cases(self.day, self.day))), 2)
+
+    def test_rebuild_matches_source_and_reports_read_only_rollups(self):
+        days = [self.day + timedelta(days=i) for i in range(40)]
+        LabTest.objects.bulk_create(
+            [LabTest(student=self.student, test_type='Malaria', result='Positive', date=day) for day in days[::2]]
+            + [LabTest(student=self.student, test_type='TB', result='Negative', date=day) for day in days]
+        )
+        out = StringIO()
+        call_command('rebuild_rollups', '--source', 'lab_tests', stdout=out)
+        self.assertIn('lab_tests: rebuilt', out.getvalue())
+
+        with self.assertNumQueries(1):
+            self.assertEqual(sum(rollups.series('lab_tests_by_type', days[0], days[-1]).values()), 60)
+        with self.assertNumQueries(1):
+            positives = rollups.series('lab_positives_by_type', days[0], days[9], dimension='Malaria')
+        self.assertEqual(list(positives), days[0:10:2])
+        self.assertEqual(RollupWatermark.objects.get(source='lab_tests').last_pk, LabTest.objects.latest('pk').pk)
+
+        # A partial rebuild replaces only its own days
+        LabTest.objects.filter(date=days[0]).delete()
+        rollups.rebuild(days[0], days[0], ['lab_tests'])
+        self.assertEqual(self.rollup('lab_tests_by_type', days[0]), {})
+        self.assertEqual(self.rollup('lab_tests_by_type', days[1]), {'TB': 1})
+
+    def test_refresh_command(self):
+        Appointment.objects.bulk_create([
+            Appointment(student=self.student, doctor=self.doctors[0], date=date.today(), time=time(8, 0), reason='Visit')
+        ])
+        out = StringIO()
+        call_command('refresh_rollups', '--days', '2', stdout=out)
+        self.assertIn('appointments: 1 days', out.getvalue())
+        self.assertEqual(rollups.series('appointments_by_status', date.today(), date.today()), {date.today(): 1})
+
+
+class OutbreakDetectorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user('dr_ebise', role='doctor')
+        cls.students = {}
+        for i, college in enumerate(['CHE', 'CNCS']):
+            user = User.objects.create_user(f'st_{college.lower()}', role='student')
+            cls.students[college] = StudentProfile.objects.create(
+                user=user, student_id=f'HU-UGR-2023-6100{i}', college=college,
+                department='General', gender='F', year=1
+            )
+
+    def setUp(self):
+        outbreaks.detector = outbreaks.LiveDetector()
+        outbreaks.detector.reload()
+
+    def test_ring_counter_forgets_days_that_leave_the_window(self):
+        ring = outbreaks.RingCounter(5)
+        ring.add(100)
+        ring.add(100)
+        ring.add(102)
+        self.assertEqual(ring.total(98, 102), 3)
+        ring.add(106)
+        self.assertEqual(ring.total(100, 106), 2)
+        self.assertFalse(ring.add(101))
+        ring.add(106, -5)
+        self.assertEqual(ring.total(0, 200), 1)
+
+    def test_spike_over_baseline_is_flagged_once_per_window(self):
+        detector = outbreaks.OutbreakDetector(window_days=3, baseline_days=28)
+        start = date(2024, 10, 1)
+        # One case every other day is the college's normal rate
+        for i in range(0, 28, 2):
+            self.assertIsNone(detector.observe('CHE', 'lab', 'Malaria', start + timedelta(days=i)))
+        spike_day = start + timedelta(days=30)
+        alerts = [detector.observe('CHE', 'lab', 'Malaria', spike_day) for _ in range(8)]
+        flagged = [alert for alert in alerts if alert]
+        self.assertEqual(len(flagged), 1)
+        self.assertEqual((flagged[0].day, flagged[0].college), (spike_day, 'CHE'))
+        self.assertGreaterEqual(flagged[0].score, outbreaks.THRESHOLD)
+        # Other colleges and conditions have their own counters
+        self.assertIsNone(detector.observe('CNCS', 'lab', 'Malaria', spike_day))
+        self.assertEqual(len(detector.counters), 2)
+
+    def test_live_saves_raise_one_alert(self):
+        today = date.today()
+        student = self.students['CHE']
+        with self.captureOnCommitCallbacks(execute=True):
+            pending = LabTest.objects.create(student=student, test_type='Malaria')
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                LabTest.objects.create(student=student, test_type='Malaria', result='Positive')
+        self.assertFalse(OutbreakAlert.objects.exists())
+
+        # A result entered later counts as a new case
+        with self.assertLogs('analytics.outbreaks', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            pending.result = 'Positive (P. falciparum)'
+            pending.save()
+        alert = OutbreakAlert.objects.get()
+        self.assertEqual((alert.college, alert.source, alert.condition, alert.day, alert.observed),
+                         ('CHE', 'lab', 'Malaria', today, 3))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            LabTest.objects.create(student=student, test_type='Malaria', result='Positive')
+        self.assertEqual(OutbreakAlert.objects.count(), 1)
+
+    def test_warm_up_never_runs_in_the_saving_request(self):
+        detector = outbreaks.LiveDetector()
+        with mock.patch.object(outbreaks, 'replay') as replay, \
+                mock.patch.object(detector, '_reload_in_background') as reload_in_background:
+            self.assertIsNone(detector.record('CHE', 'lab', 'Malaria', date.today()))
+        replay.assert_not_called()
+        reload_in_background.assert_called_once()
+
+    def test_detector_errors_do_not_fail_committed_saves(self):
+        with mock.patch.object(outbreaks.detector, 'record', side_effect=RuntimeError('detector broke')), \
+                self.assertLogs(level='ERROR'), self.captureOnCommitCallbacks(execute=True):
+            LabTest.objects.create(student=self.students['CHE'], test_type='Malaria', result='Positive')
+        self.assertEqual(LabTest.objects.count(), 1)
+
+    def test_refresh_rollups_stores_alerts_for_cases_no_detector_saw(self):
+        LabTest.objects.bulk_create([
+            LabTest(student=self.students['CHE'], test_type='TB', result='Positive') for _ in range(3)
+        ])
+        out = StringIO()
+        with self.assertLogs('analytics.outbreaks', 'WARNING'):
+            call_command('refresh_rollups', stdout=out)
+        self.assertIn('Outbreak alerts stored: 1', out.getvalue())
+        self.assertEqual(OutbreakAlert.objects.get().condition, 'TB')
+
+    def test_replay_backtests_coded_diagnoses(self):
+        code = DiagnosisCode.objects.get(code='J11')
+        student = self.students['CNCS']
+        day = date(2024, 11, 4)
+        appointments = Appointment.objects.bulk_create([
+            Appointment(student=student, doctor=self.doctor, date=day, time=time(8 + i, 0), reason='Cough')
+            for i in range(4)
+        ])
+        consultations = Consultation.objects.bulk_create([
+            Consultation(appointment=appointment, student=student, doctor=self.doctor,
+                         symptoms='Cough', diagnosis='Flu', diagnosis_code=code)
+            for appointment in appointments
+        ])
+        Consultation.objects.filter(pk__in=[c.pk for c in consultations]).update(date=day)
+
+        alerts = outbreaks.replay(day, day)
+        self.assertEqual([(a.college, a.source, a.condition, a.observed) for a in alerts],
+                         [('CNCS', 'diagnosis', 'J11', 3)])
+        self.assertEqual(outbreaks.replay(day, day, outbreaks.OutbreakDetector(min_cases=5)), [])
+
+        out = StringIO()
+        with self.assertLogs('analytics.outbreaks', 'WARNING'):
+            call_command('detect_outbreaks', '--from', str(day), '--save', stdout=out)
+        self.assertIn('Alerts stored: 1', out.getvalue())
+        self.assertEqual(OutbreakAlert.objects.get().condition, 'J11')
+
+
+class CohortStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctors = [User.objects.create_user(f'dr_c{i}', role='doctor') for i in range(2)]
+        cls.students = []
+        for i, year in enumerate([1, 1, 2]):
+            user = User.objects.create_user(f'st_c{i}', role='student')
+            cls.students.append(StudentProfile.objects.create(
+                user=user, student_id=f'HU-UGR-2023-6200{i}', college='CBE',
+                department='Accounting', gender='M', year=year
+            ))
+        d = date(2024, 1, 1)
+        plan = [
+            # (student, doctor, day offset, status)
+            (0, 0, 0, 'Completed'), (0, 0, 10, 'Completed'), (0, 1, 50, 'Completed'),
+            (1, 0, 0, 'Completed'), (1, 0, 3, 'Cancelled'),
+            (2, 1, 5, 'Completed'), (2, 0, 400, 'Completed'),
+        ]
+        appointments = Appointment.objects.bulk_create([
+            Appointment(student=cls.students[s], doctor=cls.doctors[doc], date=d + timedelta(days=offset),
+                        time=time(8, 0), reason='Visit', status=status)
+            for s, doc, offset, status in plan
+        ])
+        for appointment in appointments:
+            if appointment.status == 'Completed':
+                consultation = Consultation.objects.create(
+                    appointment=appointment, student=appointment.student, doctor=appointment.doctor,
+                    symptoms='-', diagnosis='-'
+                )
+                Consultation.objects.filter(pk=consultation.pk).update(date=appointment.date)
+
+    def test_revisit_intervals(self):
+        distribution = cohorts.revisit_intervals()
+        self.assertEqual(distribution.count, 3)  # 10 and 40 days for the first student, 395 for the third
+        self.assertEqual(distribution.mean, round((10 + 40 + 395) / 3, 2))
+        self.assertEqual(distribution.percentiles[50], 40.0)
+        self.assertEqual(dict(distribution.histogram),
+                         {'0-7': 0, '8-30': 1, '31-90': 1, '91-180': 0, '181-365': 0, '366+': 1})
+        # Counting cancelled appointments adds a 3-day interval for the second student
+        self.assertEqual(cohorts.revisit_intervals(statuses=['Completed', 'Cancelled']).count, 4)
+        self.assertEqual(cohorts.revisit_intervals(end=date(2024, 1, 31)).count, 1)
+
+    def test_repeat_visit_rate_by_year(self):
+        rows = cohorts.repeat_visit_rate('year')
+        self.assertEqual([(r.group, r.students, r.repeat_students, r.visits) for r in rows],
+                         [(1, 2, 1, 4), (2, 1, 1, 2)])
+        self.assertEqual(rows[0].repeat_rate, 0.5)
+        self.assertEqual(cohorts.repeat_visit_rate('college')[0].group, 'CBE')
+
+    def test_doctor_throughput(self):
+        rows = cohorts.doctor_throughput()
+        first, second = rows
+        self.assertEqual((first.username, first.consultations, first.days, first.busiest_day), ('dr_c0', 4, 3, 2))
+        self.assertEqual((second.username, second.consultations, second.days), ('dr_c1', 2, 2))
+        self.assertEqual(cohorts.doctor_throughput(start=date(2030, 1, 1)), [])
+
+        out = StringIO()
+        call_command('cohort_stats', 'throughput', stdout=out)
+        self.assertIn('dr_c0', out.getvalue())
+        call_command('cohort_stats', 'repeat-rate', '--by', 'college', stdout=out)
+        self.assertIn('CBE', out.getvalue())
+
+
+class AnalyticsApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.nurse = User.objects.create_user('nurse_api', role='nurse')
+        user = User.objects.create_user('st_api', role='student')
+        cls.student = StudentProfile.objects.create(
+            user=user, student_id='HU-UGR-2023-63000', college='CHE',
+            department='Nursing', gender='F', year=2
+        )
+        day = date.today() - timedelta(days=3)
+        Bill.objects.bulk_create([
+            Bill(student=cls.student, service='X-Ray', amount=Decimal('75.00'), date=day, status='Paid'),
+            Bill(student=cls.student, service='X-Ray', amount=Decimal('75.00'), date=day),
+            Bill(student=cls.student, service='Consultation Fee', amount=Decimal('25.00'), date=day),
+        ])
+        LabTest.objects.bulk_create([
+            LabTest(student=cls.student, test_type='Malaria', result=result, date=day)
+            for result in ['Positive', 'Negative', 'Negative', 'Positive']
+        ])
+        doctor = User.objects.create_user('dr_visits', role='doctor')
+        Appointment.objects.bulk_create([
+            Appointment(student=cls.student, doctor=doctor, date=day, time=time(8 + i, 0), reason='Visit', status=status)
+            for i, status in enumerate(['Completed', 'Completed', 'Cancelled'])
+        ])
+        rollups.rebuild(day, day)
+        cls.day = day
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.nurse)
+
+    def test_reports_need_staff(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/analytics/revenue/').status_code, 403)
+        client.force_authenticate(self.student.user)
+        self.assertEqual(client.get('/api/analytics/revenue/').status_code, 403)
+
+    def test_revenue_and_lab_positivity(self):
+        response = self.client.get('/api/analytics/revenue/')
+        self.assertEqual(response.json()['results'], [
+            {'service': 'X-Ray', 'bills': 2, 'billed': '150.00', 'paid': '75.00'},
+            {'service': 'Consultation Fee', 'bills': 1, 'billed': '25.00', 'paid': '0.00'},
+        ])
+        response = self.client.get('/api/analytics/lab-positivity/')
+        self.assertEqual(response.json()['results'],
+                         [{'test_type': 'Malaria', 'tests': 4, 'positives': 2, 'rate': 0.5}])
+        response = self.client.get('/api/analytics/visits/', {'period': 'day', 'by': 'department'})
+        self.assertEqual(response.json()['results'],
+                         [{'period': str(self.day), 'department': 'Nursing', 'visits': 2, 'students': 1}])
+        self.assertEqual(self.client.get('/api/analytics/visits/', {'period': 'fortnight'}).status_code, 400)
+
+    def test_conditional_and_repeat_requests_run_no_query(self):
+        first = self.client.get('/api/analytics/revenue/')
+        etag = first['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/analytics/revenue/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get('/api/analytics/revenue/',
+                                             HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+            self.assertEqual(self.client.get('/api/analytics/revenue/').json(), first.json())
+        # Another query string is another representation
+        self.assertEqual(self.client.get('/api/analytics/revenue/', {'start': '2020-01-01'},
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # A new lab test does not touch revenue, a new bill does
+        with self.captureOnCommitCallbacks(execute=True):
+            LabTest.objects.create(student=self.student, test_type='TB')
+        self.assertEqual(self.client.get('/api/analytics/revenue/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Bill.objects.create(student=self.student, service='ECG', amount=Decimal('40.00'))
+        response = self.client.get('/api/analytics/revenue/', HTTP_IF_NONE_MATCH=etag,
+                                   HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertNotEqual(response['Last-Modified'], first['Last-Modified'])
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_invalidate_moves_last_modified_forward(self):
+        before = reports.versions(['bills'])['bills']
+        reports.invalidate('bills')
+        after = reports.versions(['bills'])['bills']
+        self.assertNotEqual(after[0], before[0])
+        self.assertGreater(after[1], before[1])
+        self.assertNotEqual(http_date(after[1]), http_date(before[1]))
 
-# Create your tests here.
+    def test_requests_are_throttled_per_user(self):
+        with mock.patch.object(ScopedRateThrottle, 'THROTTLE_RATES', {'analytics': '2/minute'}):
+            for _ in range(2):
+                self.assertEqual(self.client.get('/api/analytics/lab-positivity/').status_code, 200)
+            self.assertEqual(self.client.get('/api/analytics/lab-positivity/').status_code, 429)
+            other = APIClient()
+            other.force_authenticate(User.objects.create_user('dr_api', role='doctor'))
+            self.assertEqual(other.get('/api/analytics/lab-positivity/').status_code, 200)
@@ -0,0 +1,11 @@
+from django.urls import path
+from . import views
+
+app_name = 'analytics'
+
+urlpatterns = [
+    path('visits/', views.VisitsView.as_view(), name='visits'),
+    path('diagnoses/top/', views.TopDiagnosesView.as_view(), name='top_diagnoses'),
+    path('lab-positivity/', views.LabPositivityView.as_view(), name='lab_positivity'),
+    path('revenue/', views.RevenueView.as_view(), name='revenue'),
+]
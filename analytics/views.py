@@ -1,3 +1,94 @@
-from django.shortcuts import render
+"""
+Read-only analytics API for reporting dashboards
 
-# Create your views here.
+Every endpoint is a CachedReportView. After authentication, permission
+and throttling checks, it builds an ETag from the report name, the
+validated query and the versions of the sources the report reads.
+Last-Modified is the newest of those versions. A conditional GET that
+still matches gets 304 Not Modified without a database query, and so
+does a repeat request, served from the cache for API_CACHE_TIMEOUT
+seconds. Saving or deleting a source row moves its version on, so
+neither survives a change (see analytics.reports). Renamed students or
+diagnosis codes show up once the entry expires.
+
+Requests are throttled per user under the 'analytics' scope
+(REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']).
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.permissions import BasePermission, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
+from rest_framework.views import APIView
+
+from . import reports
+from .serializers import DateRangeSerializer, TopDiagnosesQuerySerializer, VisitsQuerySerializer
+
+API_CACHE_TIMEOUT = 300
+
+
+class IsStaffMember(BasePermission):
+    message = 'Analytics are only available to clinic staff.'
+
+    def has_permission(self, request, view):
+        return request.user.is_staff_member()
+
+
+class CachedReportView(APIView):
+    permission_classes = [IsAuthenticated, IsStaffMember]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'analytics'
+    query_serializer = DateRangeSerializer
+    report = None  # key of reports.REPORTS
+
+    def get(self, request):
+        query = self.query_serializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = {name: str(value) for name, value in query.validated_data.items()}
+
+        function, sources = reports.REPORTS[self.report]
+        versions = reports.versions(sources)
+        signature = json.dumps([self.report, params, sorted(versions.items())], sort_keys=True)
+        etag = quote_etag(hashlib.sha1(signature.encode()).hexdigest())
+        last_modified = max(modified for _, modified in versions.values())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            key = f'{reports.CACHE_PREFIX}:response:{etag.strip(chr(34))}'
+            data = cache.get(key)
+            if data is None:
+                data = {'report': self.report, 'params': params,
+                        'results': function(**query.validated_data)}
+                cache.set(key, data, API_CACHE_TIMEOUT)
+            response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # Let clients keep the body but revalidate every time
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class VisitsView(CachedReportView):
+    """Visits and distinct students per ?period= (day/week/month/year) and ?by= student group"""
+    report = 'visits'
+    query_serializer = VisitsQuerySerializer
+
+
+class TopDiagnosesView(CachedReportView):
+    """The ?limit= most frequent coded diagnoses"""
+    report = 'top_diagnoses'
+    query_serializer = TopDiagnosesQuerySerializer
+
+
+class LabPositivityView(CachedReportView):
+    """Positivity rate per lab test type"""
+    report = 'lab_positivity'
+
+
+class RevenueView(CachedReportView):
+    """Billed and paid amounts per service"""
+    report = 'revenue'
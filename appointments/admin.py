@@ -1,9 +1,27 @@
 from django.contrib import admin
+from .forms import AppointmentAdminForm
 from .models import Appointment
+from . import slots
+from accounts.directory import StaffDirectoryAdminMixin
+from medical.search import FullTextSearchAdminMixin
 
 @admin.register(Appointment)
-class AppointmentAdmin(admin.ModelAdmin):
+class AppointmentAdmin(FullTextSearchAdminMixin, StaffDirectoryAdminMixin, admin.ModelAdmin):
+    form = AppointmentAdminForm
+    staff_fields = {'doctor': 'doctor'}
     list_display = ['id', 'student', 'doctor', 'date', 'time', 'status', 'created_at']
     list_filter = ['status', 'date', 'doctor']
-    search_fields = ['student__user__username', 'doctor__username', 'reason']
+    # Shows the search box; the full-text index answers it (see medical.search)
+    search_fields = ['reason']
+    search_index = 'appointments'
+    search_doctor_field = 'doctor'
     date_hierarchy = 'date'
+    # Newest first, in index order (see Appointment.Meta.indexes)
+    ordering = ['-date', '-time', '-id']
+
+    def save_model(self, request, obj, form, change):
+        # Edits move the slot through slots.move_slot; new appointments claim one like any booking
+        if change or obj.status == 'Cancelled':
+            super().save_model(request, obj, form, change)
+        else:
+            slots.book(obj)
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class AppointmentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'appointments'
+
+    def ready(self):
+        from django.db.models.signals import post_save, pre_save
+        from . import events, slots
+        from .models import Appointment
+        from .signals import appointment_status_changed
+
+        pre_save.connect(slots.remember_old_slot, sender=Appointment, dispatch_uid='appointment_slots')
+        post_save.connect(slots.move_slot, sender=Appointment, dispatch_uid='appointment_slots')
+        post_save.connect(events.on_appointment_saved, sender=Appointment, dispatch_uid='appointment_events')
+        appointment_status_changed.connect(events.on_status_changed, dispatch_uid='appointment_events')
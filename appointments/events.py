@@ -0,0 +1,217 @@
+"""
+Live appointment events for the manage page (server-sent events)
+
+Appointment bookings and status changes are published, after commit, to
+a broker topic per doctor plus one topic for all other staff. Each open
+manage page holds one subscription and is streamed its topic's events by
+the async appointment_events view, so it no longer has to reload.
+
+The broker is chosen with settings.APPOINTMENT_EVENTS_BROKER (a dotted
+path). InProcessBroker only reaches clients connected to the same process;
+PostgresNotifyBroker relays events between processes through LISTEN /
+NOTIFY, for deployments running several workers.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROKER = 'appointments.events.InProcessBroker'
+
+STAFF_TOPIC = 'staff'
+
+# Events a slow client may fall behind by before it is told to reload instead
+SUBSCRIPTION_QUEUE_SIZE = 100
+
+
+def doctor_topic(doctor_id):
+    return f'doctor:{doctor_id}'
+
+
+def topics_for(user):
+    """Doctors follow their own queue; every other staff role follows all appointments"""
+    if user.role == 'doctor':
+        return [doctor_topic(user.pk)]
+    return [STAFF_TOPIC]
+
+
+class Subscription:
+    """
+    A queue of events for one connected client, bound to the event loop it
+    was created on. deliver() may be called from any thread.
+    """
+
+    def __init__(self, topics, maxsize=SUBSCRIPTION_QUEUE_SIZE):
+        self.topics = tuple(topics)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def deliver(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout):
+        """Next event, or None if none arrives within timeout seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class InProcessBroker:
+    """Fans events out to the subscriptions of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, topics):
+        subscription = Subscription(topics)
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscriptions[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscriptions[topic].discard(subscription)
+                if not self._subscriptions[topic]:
+                    del self._subscriptions[topic]
+
+    def publish(self, topic, event):
+        self._dispatch(topic, event)
+
+    def _dispatch(self, topic, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(topic, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.deliver(event)
+            except RuntimeError:
+                # Its event loop has closed; the stream's cleanup never ran
+                self.unsubscribe(subscription)
+
+
+class PostgresNotifyBroker(InProcessBroker):
+    """
+    Publishes with pg_notify() so every process sees every event; each
+    process runs one listener thread, started with its first subscription,
+    that hands notifications to its local subscriptions.
+    """
+
+    channel = 'appointment_events'
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def publish(self, topic, event):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, json.dumps({'topic': topic, 'event': event})])
+
+    def subscribe(self, topics):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='appointment-events', daemon=True)
+                self._listener.start()
+        return super().subscribe(topics)
+
+    def _listen(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        params = connections['default'].get_connection_params()
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**params)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        message = json.loads(conn.notifies.pop(0).payload)
+                        self._dispatch(message['topic'], message['event'])
+            except Exception:
+                logger.exception('Appointment event listener failed; reconnecting')
+                if conn is not None:
+                    conn.close()
+                time.sleep(1)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'APPOINTMENT_EVENTS_BROKER', DEFAULT_BROKER))()
+        return _broker
+
+
+def appointment_event(kind, appointment_id, doctor_id, status, date=None, time=None):
+    return {
+        'type': kind,
+        'id': appointment_id,
+        'doctor': doctor_id,
+        'status': status,
+        'date': date.isoformat() if date else None,
+        'time': time.strftime('%H:%M') if time else None,
+    }
+
+
+def publish(event):
+    broker = get_broker()
+    for topic in (doctor_topic(event['doctor']), STAFF_TOPIC):
+        try:
+            broker.publish(topic, event)
+        except Exception:
+            # Live updates are best effort; the page still shows the truth on reload
+            logger.exception('Could not publish appointment event')
+
+
+def on_appointment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        event = appointment_event(
+            'created', instance.pk, instance.doctor_id, instance.status, instance.date, instance.time
+        )
+    elif instance.status != getattr(instance, '_status_old', None):
+        # A save() that changed the status (admin edits); set by slots.remember_old_slot
+        event = appointment_event('status', instance.pk, instance.doctor_id, instance.status)
+    else:
+        return
+    transaction.on_commit(lambda: publish(event))
+
+
+def on_status_changed(sender, pks, status, **kwargs):
+    # Sent on commit already; one query to learn whose queues the rows are in
+    from .models import Appointment
+    for pk, doctor_id in Appointment.objects.filter(pk__in=pks).values_list('pk', 'doctor_id'):
+        publish(appointment_event('status', pk, doctor_id, status))
+
+
+def format_sse(event, name='appointment'):
+    return f"event: {name}\ndata: {json.dumps(event)}\n\n"
@@ -1,9 +1,9 @@
+import datetime
 from django import forms
 from .models import Appointment
+from .slots import SLOT_TIMES, booked_times, is_slot_time, is_taken, slot_key
 from students.models import StudentProfile
-from django.contrib.auth import get_user_model
-
-User = get_user_model()
+from accounts.directory import StaffChoiceField
 
 class AppointmentBookingForm(forms.ModelForm):
     class Meta:
@@ -11,12 +11,94 @@ class AppointmentBookingForm(forms.ModelForm):
         fields = ['doctor', 'date', 'time', 'reason']
         widgets = {
             'date': forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
-            'time': forms.TimeInput(attrs={'type': 'time', 'class': 'form-control'}),
+            'time': forms.Select(
+                choices=[('', '---------')] + [(t.strftime('%H:%M:%S'), t.strftime('%I:%M %p')) for t in SLOT_TIMES],
+                attrs={'class': 'form-control'}
+            ),
             'reason': forms.Textarea(attrs={'rows': 3, 'class': 'form-control'}),
-            'doctor': forms.Select(attrs={'class': 'form-control'}),
         }
-    
-    def __init__(self, *args, **kwargs):
+
+    doctor = StaffChoiceField('doctor', label_format='Dr. {name}', widget=forms.Select(attrs={'class': 'form-control'}))
+
+    def clean_date(self):
+        date = self.cleaned_data['date']
+        if date < datetime.date.today():
+            raise forms.ValidationError('Appointments cannot be booked in the past.')
+        return date
+
+    def clean_time(self):
+        time = self.cleaned_data['time']
+        if not is_slot_time(time):
+            raise forms.ValidationError('Choose a half-hour slot between 08:00 and 16:30.')
+        return time
+
+    def clean(self):
+        cleaned_data = super().clean()
+        doctor = cleaned_data.get('doctor')
+        date = cleaned_data.get('date')
+        time = cleaned_data.get('time')
+        # Friendly early check; the slot's unique constraint is what actually prevents double booking
+        if doctor and date and time and time in booked_times(doctor, date):
+            self.add_error('time', 'The doctor is already booked at this time. Please choose another slot.')
+        return cleaned_data
+
+class AppointmentAdminForm(forms.ModelForm):
+    """Admin edits may move an appointment; check the slot it moves to is free"""
+
+    class Meta:
+        model = Appointment
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        fields = [cleaned_data.get(name) for name in ('doctor', 'date', 'time', 'status')]
+        if None in fields:
+            return cleaned_data
+        new = slot_key(fields[0].pk, *fields[1:])
+        old = None
+        if self.instance.pk:
+            # Not yet updated from the form, so these are the saved values
+            old = slot_key(self.instance.doctor_id, self.instance.date, self.instance.time, self.instance.status)
+        if new is not None and new != old and is_taken(*new, exclude_appointment=self.instance.pk):
+            self.add_error('time', 'The doctor is already booked at this time.')
+        return cleaned_data
+
+class AppointmentFilterForm(forms.Form):
+    status = forms.ChoiceField(
+        choices=[('', 'All statuses')] + list(Appointment.STATUS_CHOICES), required=False,
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+    doctor = StaffChoiceField(
+        'doctor', label_format='Dr. {name}', required=False, empty_label='All doctors',
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+    date_from = forms.DateField(
+        required=False, widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control form-control-sm'})
+    )
+    date_to = forms.DateField(
+        required=False, widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control form-control-sm'})
+    )
+    student_id = forms.CharField(
+        required=False, max_length=20,
+        widget=forms.TextInput(attrs={'class': 'form-control form-control-sm', 'placeholder': 'Student ID'})
+    )
+
+    def __init__(self, *args, show_doctor=True, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['doctor'].queryset = User.objects.filter(role='doctor')
-        self.fields['doctor'].label_from_instance = lambda obj: f"Dr. {obj.first_name} {obj.last_name}"
+        if not show_doctor:
+            del self.fields['doctor']
+
+    def filter(self, queryset):
+        """Apply the valid filters to an Appointment queryset"""
+        data = self.cleaned_data if self.is_valid() else {}
+        if data.get('status'):
+            queryset = queryset.filter(status=data['status'])
+        if data.get('doctor'):
+            queryset = queryset.filter(doctor=data['doctor'])
+        if data.get('date_from'):
+            queryset = queryset.filter(date__gte=data['date_from'])
+        if data.get('date_to'):
+            queryset = queryset.filter(date__lte=data['date_to'])
+        if data.get('student_id'):
+            queryset = queryset.filter(student__student_id=data['student_id'].strip())
+        return queryset
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def backfill_slots(apps, schema_editor):
+    # Earliest booking wins; later double bookings keep their appointment but no slot
+    Appointment = apps.get_model('appointments', 'Appointment')
+    AppointmentSlot = apps.get_model('appointments', 'AppointmentSlot')
+    active = (
+        Appointment.objects.exclude(status='Cancelled')
+        .order_by('created_at', 'id')
+        .values_list('id', 'doctor_id', 'date', 'time')
+    )
+    batch = []
+    for pk, doctor_id, date, time in active.iterator(chunk_size=BACKFILL_BATCH_SIZE):
+        batch.append(AppointmentSlot(appointment_id=pk, doctor_id=doctor_id, date=date, time=time))
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            AppointmentSlot.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    AppointmentSlot.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('appointments', '0002_external_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('time', models.TimeField()),
+                ('appointment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='slot', to='appointments.appointment')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='booked_slots', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='appointmentslot',
+            constraint=models.UniqueConstraint(fields=('doctor', 'date', 'time'), name='unique_doctor_slot'),
+        ),
+        migrations.RunPython(backfill_slots, migrations.RunPython.noop),
+    ]
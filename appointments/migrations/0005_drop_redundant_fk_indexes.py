@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('students', '0001_initial'),
+        ('appointments', '0004_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='doctor',
+            field=models.ForeignKey(db_index=False, limit_choices_to={'role': 'doctor'}, on_delete=django.db.models.deletion.CASCADE, related_name='doctor_appointments', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='student',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='appointments', to='students.studentprofile'),
+        ),
+    ]
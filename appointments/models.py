@@ -10,13 +10,44 @@ class Appointment(models.Model):
         ('Cancelled', 'Cancelled'),
     )
 
-    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='appointments')
-    doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='doctor_appointments', limit_choices_to={'role': 'doctor'})
+    external_id = models.CharField(max_length=20, unique=True, null=True, blank=True, help_text="Natural key of imported records, e.g. APT-10000")
+    # Both indexed through the composite indexes below, which lead with them
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, db_index=False, related_name='appointments')
+    doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False, related_name='doctor_appointments', limit_choices_to={'role': 'doctor'})
     date = models.DateField()
     time = models.TimeField()
     reason = models.TextField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Every list is newest first on (date, time, id): manage_appointments pages by it,
+        # optionally per doctor, per status (filters, admin) or per student (my_appointments)
+        indexes = [
+            models.Index(fields=['date', 'time', 'id'], name='appt_date_time_idx'),
+            models.Index(fields=['doctor', 'date', 'time', 'id'], name='appt_doctor_date_time_idx'),
+            models.Index(fields=['status', 'date', 'time', 'id'], name='appt_status_date_time_idx'),
+            models.Index(fields=['student', 'date', 'time', 'id'], name='appt_student_date_time_idx'),
+        ]
+
     def __str__(self):
         return f"APT-{self.id} : {self.student.user.username} with {self.doctor.username}"
+
+class AppointmentSlot(models.Model):
+    """
+    The doctor/date/time an active appointment occupies. The unique
+    constraint is what stops two bookings taking the same slot; cancelling
+    an appointment deletes its slot. See appointments.slots.
+    """
+    doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='booked_slots')
+    date = models.DateField()
+    time = models.TimeField()
+    appointment = models.OneToOneField(Appointment, on_delete=models.CASCADE, related_name='slot')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'date', 'time'], name='unique_doctor_slot'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor.username} {self.date} {self.time:%H:%M}"
@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+# Sent after commit whenever appointments change status in bulk or one at a
+# time through appointments.transitions, with:
+#   pks    - ids of the appointments that changed
+#   status - their new status
+appointment_status_changed = Signal()
@@ -0,0 +1,136 @@
+"""
+Doctor availability on the clinic's half-hour grid (08:00 - 16:30)
+
+Every active appointment holds an AppointmentSlot row; the unique
+(doctor, date, time) constraint on that table makes the database, not the
+form, the final word on double booking. Free slots for a doctor and day
+come from one index-only lookup on the same constraint.
+
+New bookings claim their slot through book(). Later saves that change an
+appointment's doctor, date, time or cancel it (admin edits) move or free
+the slot through the remember_old_slot / move_slot receivers connected in
+AppointmentsConfig.ready.
+"""
+from datetime import time
+
+from django.db import DatabaseError, IntegrityError, transaction
+
+from .models import Appointment, AppointmentSlot
+
+SLOT_TIMES = tuple(time(hour, minute) for hour in range(8, 17) for minute in (0, 30))
+
+
+class SlotUnavailable(Exception):
+    """The doctor already has an appointment at that date and time"""
+
+
+def is_slot_time(value):
+    return value in SLOT_TIMES
+
+
+def booked_times(doctor, day):
+    return set(
+        AppointmentSlot.objects.filter(doctor=doctor, date=day).values_list('time', flat=True)
+    )
+
+
+def free_slots(doctor, day):
+    """Grid times the doctor is still free on day, in order"""
+    taken = booked_times(doctor, day)
+    return [slot for slot in SLOT_TIMES if slot not in taken]
+
+
+def book(appointment):
+    """
+    Save an appointment and claim its slot in one transaction. Raises
+    SlotUnavailable, leaving nothing saved, if another booking got there first.
+    """
+    try:
+        with transaction.atomic():
+            appointment.save()
+            AppointmentSlot.objects.create(
+                doctor_id=appointment.doctor_id,
+                date=appointment.date,
+                time=appointment.time,
+                appointment=appointment
+            )
+    except IntegrityError:
+        _unsave(appointment)
+        raise SlotUnavailable(
+            f"The doctor is already booked on {appointment.date} at {appointment.time:%H:%M}."
+        )
+    except DatabaseError:
+        # Rolled back too (e.g. lock contention); a retry must insert again, not update
+        _unsave(appointment)
+        raise
+    return appointment
+
+
+def _unsave(appointment):
+    appointment.pk = None
+    appointment._state.adding = True
+
+
+def release(appointments):
+    """Free the slots held by an Appointment queryset (e.g. on cancellation)"""
+    return AppointmentSlot.objects.filter(appointment__in=appointments).delete()[0]
+
+
+def claim_existing(appointments):
+    """
+    Give slots to already-saved appointments that are not cancelled, first
+    come first served; ones whose slot is taken keep no slot. Used by bulk
+    imports, which is why historical double bookings can still exist.
+    """
+    AppointmentSlot.objects.bulk_create([
+        AppointmentSlot(doctor_id=a.doctor_id, date=a.date, time=a.time, appointment_id=a.pk)
+        for a in appointments
+        if a.status != 'Cancelled'
+    ], ignore_conflicts=True)
+
+
+def slot_key(doctor_id, day, at, status):
+    """The slot an appointment in this state holds, or None if it holds none"""
+    return None if status == 'Cancelled' else (doctor_id, day, at)
+
+
+def is_taken(doctor_id, day, at, exclude_appointment=None):
+    return AppointmentSlot.objects.filter(doctor_id=doctor_id, date=day, time=at).exclude(
+        appointment_id=exclude_appointment
+    ).exists()
+
+
+# Signal receivers
+
+def remember_old_slot(sender, instance, raw=False, **kwargs):
+    """pre_save: the slot (and status) the appointment held before this save"""
+    instance._slot_old = instance._status_old = None
+    if instance.pk and not raw:
+        old = (Appointment.objects.filter(pk=instance.pk)
+               .values_list('doctor_id', 'date', 'time', 'status').first())
+        if old:
+            instance._slot_old = slot_key(*old)
+            instance._status_old = old[3]
+
+
+def move_slot(sender, instance, created, raw=False, **kwargs):
+    """
+    post_save: follow a change of doctor, date, time or cancellation.
+    Raises SlotUnavailable if the new slot is taken; save inside a
+    transaction (as the admin does) so the appointment change rolls back too.
+    """
+    if created or raw:
+        return
+    old = getattr(instance, '_slot_old', None)
+    new = slot_key(instance.doctor_id, instance.date, instance.time, instance.status)
+    if new == old:
+        return
+    try:
+        with transaction.atomic():
+            AppointmentSlot.objects.filter(appointment=instance).delete()
+            if new is not None:
+                AppointmentSlot.objects.create(doctor_id=new[0], date=new[1], time=new[2], appointment=instance)
+    except IntegrityError:
+        raise SlotUnavailable(
+            f"The doctor is already booked on {instance.date} at {instance.time:%H:%M}."
+        )
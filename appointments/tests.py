@@ -1,3 +1,456 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time as time_module
+from datetime import date, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from analytics import reports
+from students.models import StudentProfile
+from . import events, slots
+from .models import Appointment, AppointmentSlot
+from .signals import appointment_status_changed
+from .transitions import transition
+from .views import APPOINTMENTS_PER_PAGE
+
+User = get_user_model()
+
+
+# The manifest storage needs collectstatic, which tests do not run
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ManageAppointmentsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.receptionist = User.objects.create_user('reception', password='pw', role='receptionist')
+        cls.doctors = [
+            User.objects.create_user(f'dr_{i}', password='pw', role='doctor', first_name=f'Doc{i}')
+            for i in range(2)
+        ]
+        cls.students = []
+        for i in range(3):
+            user = User.objects.create_user(f'student_{i}', role='student', first_name=f'Student{i}')
+            cls.students.append(StudentProfile.objects.create(
+                user=user, student_id=f'HU-UGR-2023-{10000 + i}', college='CNCS',
+                department='Computer Science', gender='F', year=2
+            ))
+
+    def make_appointments(self, count, start=date(2024, 1, 1)):
+        # Several appointments share each date and time so the id tie-breaker matters
+        Appointment.objects.bulk_create([
+            Appointment(
+                student=self.students[i % 3],
+                doctor=self.doctors[i % 2],
+                date=start + timedelta(days=i // 6),
+                time=time(8 + i % 3, 0),
+                reason='Check-up',
+                status='Completed' if i % 4 == 0 else 'Pending'
+            )
+            for i in range(count)
+        ])
+
+    def get(self, **params):
+        return self.client.get(reverse('manage_appointments'), params)
+
+    def walk(self, **params):
+        """Follow 'Older' links from the first page, returning every page's ids"""
+        pages = []
+        while True:
+            response = self.get(**params)
+            page = response.context['page']
+            pages.append([a.id for a in page])
+            if not page.has_next:
+                return pages
+            params['after'] = page.next_cursor
+
+    def test_query_count_does_not_grow_with_table_size(self):
+        self.client.force_login(self.receptionist)
+        self.make_appointments(5)
+        self.get()  # warm the staff directory cache behind the doctor filter
+        with CaptureQueriesContext(connection) as small:
+            self.get()
+        self.make_appointments(APPOINTMENTS_PER_PAGE * 3)
+        with self.assertNumQueries(len(small)):
+            response = self.get()
+        self.assertEqual(len(response.context['page']), APPOINTMENTS_PER_PAGE)
+
+    def test_keyset_pages_cover_every_row_once_in_order(self):
+        self.client.force_login(self.receptionist)
+        self.make_appointments(APPOINTMENTS_PER_PAGE * 2 + 7)
+        pages = self.walk()
+
+        ids = [i for page in pages for i in page]
+        expected = list(
+            Appointment.objects.order_by('-date', '-time', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+        self.assertEqual([len(p) for p in pages], [APPOINTMENTS_PER_PAGE, APPOINTMENTS_PER_PAGE, 7])
+
+        # 'Newer' from the second page returns exactly the first page
+        second = self.get(after=self.get().context['page'].next_cursor).context['page']
+        self.assertEqual([a.id for a in second], pages[1])
+        first = self.get(before=second.previous_cursor).context['page']
+        self.assertEqual([a.id for a in first], pages[0])
+        self.assertFalse(first.has_previous)
+        self.assertTrue(first.has_next)
+
+    def test_filters_and_doctor_scope(self):
+        self.make_appointments(24)
+        self.client.force_login(self.receptionist)
+        response = self.get(
+            status='Pending', doctor=self.doctors[1].pk,
+            date_from='2024-01-02', date_to='2024-01-03',
+            student_id=self.students[1].student_id
+        )
+        expected = set(Appointment.objects.filter(
+            status='Pending', doctor=self.doctors[1], date__range=(date(2024, 1, 2), date(2024, 1, 3)),
+            student=self.students[1]
+        ).values_list('id', flat=True))
+        self.assertTrue(expected)
+        self.assertEqual({a.id for a in response.context['page']}, expected)
+
+        # Doctors only ever see their own appointments, with no doctor filter offered
+        self.client.force_login(self.doctors[0])
+        response = self.get(doctor=self.doctors[1].pk)
+        self.assertNotIn('doctor', response.context['filter_form'].fields)
+        self.assertEqual({a.doctor_id for a in response.context['page']}, {self.doctors[0].pk})
+
+    def test_malformed_cursor_starts_from_the_first_page(self):
+        self.client.force_login(self.receptionist)
+        self.make_appointments(3)
+        response = self.get(after='not-a-cursor')
+        self.assertEqual(len(response.context['page']), 3)
+
+
+def make_student(index):
+    user = User.objects.create_user(f'student_{index}', role='student', first_name=f'Student{index}')
+    return StudentProfile.objects.create(
+        user=user, student_id=f'HU-UGR-2023-{10000 + index}', college='CNCS',
+        department='Computer Science', gender='F', year=2
+    )
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class SlotBookingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user('dr_lensa', role='doctor', first_name='Lensa')
+        cls.students = [make_student(i) for i in range(2)]
+        cls.day = date.today() + timedelta(days=7)
+
+    def book(self, student, slot_time):
+        self.client.force_login(student.user)
+        return self.client.post(reverse('book_appointment'), {
+            'doctor': self.doctor.pk, 'date': self.day.isoformat(),
+            'time': slot_time, 'reason': 'Check-up'
+        })
+
+    def test_free_slots_excludes_booked_and_cancelled_frees_them(self):
+        self.assertEqual(len(slots.free_slots(self.doctor, self.day)), 18)
+        self.assertRedirects(self.book(self.students[0], '09:30:00'), reverse('my_appointments'),
+                             fetch_redirect_response=False)
+
+        with self.assertNumQueries(1):
+            free = slots.free_slots(self.doctor, self.day)
+        self.assertNotIn(time(9, 30), free)
+        self.assertEqual((free[0], free[-1]), (time(8, 0), time(16, 30)))
+
+        response = self.book(self.students[1], '09:30:00')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('time', response.context['form'].errors)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+        receptionist = User.objects.create_user('reception', role='receptionist')
+        self.client.force_login(receptionist)
+        self.client.post(reverse('update_appointment_status', args=[Appointment.objects.get().pk]),
+                         {'status': 'Cancelled'})
+        self.assertIn(time(9, 30), slots.free_slots(self.doctor, self.day))
+
+    def test_off_grid_times_are_rejected(self):
+        response = self.book(self.students[0], '09:15:00')
+        self.assertIn('time', response.context['form'].errors)
+
+    def test_available_slots_endpoint(self):
+        self.book(self.students[0], '08:00:00')
+        response = self.client.get(reverse('available_slots'),
+                                    {'doctor': self.doctor.pk, 'date': self.day.isoformat()})
+        self.assertEqual(response.json()['slots'][0], '08:30:00')
+        self.assertEqual(self.client.get(reverse('available_slots'), {'date': 'x'}).status_code, 400)
+
+    def test_admin_edits_move_and_free_slots(self):
+        first, second = (
+            slots.book(Appointment(student=student, doctor=self.doctor, date=self.day, time=at, reason='Check-up'))
+            for student, at in zip(self.students, (time(8, 0), time(9, 0)))
+        )
+        admin = User.objects.create_superuser('clinic_admin', password='pw', role='admin')
+        self.client.force_login(admin)
+
+        def edit(appointment, **changes):
+            data = {'external_id': '', 'student': appointment.student_id, 'doctor': self.doctor.pk,
+                    'date': self.day.isoformat(), 'time': appointment.time.strftime('%H:%M:%S'),
+                    'reason': 'Check-up', 'status': appointment.status, **changes}
+            url = (reverse('admin:appointments_appointment_change', args=[appointment.pk]) if appointment.pk
+                   else reverse('admin:appointments_appointment_add'))
+            return self.client.post(url, data)
+
+        def held():
+            return dict(AppointmentSlot.objects.values_list('appointment_id', 'time'))
+
+        edit(first, time='10:00:00')
+        self.assertEqual(held(), {first.pk: time(10, 0), second.pk: time(9, 0)})
+
+        response = edit(first, time='09:00:00')
+        self.assertIn('time', response.context['adminform'].form.errors)
+        self.assertEqual(held(), {first.pk: time(10, 0), second.pk: time(9, 0)})
+
+        edit(second, status='Cancelled')
+        self.assertEqual(held(), {first.pk: time(10, 0)})
+
+        edit(Appointment(student=self.students[1], time=time(9, 0), status='Approved'))
+        added = Appointment.objects.latest('pk')
+        self.assertEqual(held(), {first.pk: time(10, 0), added.pk: time(9, 0)})
+
+        # Outside the admin, a save onto a taken slot fails too
+        first.time = time(9, 0)
+        with self.assertRaises(slots.SlotUnavailable):
+            first.save()
+
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BulkTransitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.receptionist = User.objects.create_user('reception', role='receptionist')
+        cls.doctor = User.objects.create_user('dr_abera', role='doctor')
+        cls.other_doctor = User.objects.create_user('dr_bekele', role='doctor')
+        cls.student = make_student(0)
+
+    def make(self, status, doctor=None, hour=8):
+        appointment = Appointment(
+            student=self.student, doctor=doctor or self.doctor, date=date(2030, 1, 7),
+            time=time(hour, 0), reason='Check-up', status=status
+        )
+        return slots.book(appointment)
+
+    def bulk(self, appointments, status, **headers):
+        return self.client.post(reverse('bulk_update_appointments'), {
+            'appointment_ids': [a.pk for a in appointments], 'status': status
+        }, **headers)
+
+    def test_only_allowed_transitions_change_in_one_update(self):
+        pending = [self.make('Pending', hour=8 + i) for i in range(3)]
+        completed = self.make('Completed', hour=12)
+        self.client.force_login(self.receptionist)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.bulk(pending + [completed], 'Approved', HTTP_ACCEPT='application/json')
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn("'Pending'", updates[0])
+        self.assertEqual(response.json(), {'status': 'Approved', 'updated': 3})
+        self.assertEqual(Appointment.objects.filter(status='Approved').count(), 3)
+
+        # Pending -> Completed skips a step and is refused
+        other = self.make('Pending', hour=13)
+        response = self.bulk([other], 'Completed', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['updated'], 0)
+
+        response = self.bulk(pending, 'Completed')
+        self.assertRedirects(response, reverse('manage_appointments'), fetch_redirect_response=False)
+        self.assertEqual(Appointment.objects.filter(status='Completed').count(), 4)
+
+    def test_cancel_releases_slots_and_signals_after_commit(self):
+        appointments = [self.make('Pending', hour=8), self.make('Approved', hour=9)]
+        received = []
+
+        def receiver(sender, pks, status, **kwargs):
+            received.append((sorted(pks), status))
+
+        appointment_status_changed.connect(receiver)
+        self.addCleanup(appointment_status_changed.disconnect, receiver)
+        self.client.force_login(self.receptionist)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bulk(appointments, 'Cancelled')
+
+        self.assertEqual(received, [(sorted(a.pk for a in appointments), 'Cancelled')])
+        self.assertFalse(AppointmentSlot.objects.exists())
+        self.assertEqual(len(slots.free_slots(self.doctor, date(2030, 1, 7))), len(slots.SLOT_TIMES))
+
+    def test_failing_receiver_neither_fails_the_request_nor_skips_the_others(self):
+        appointment = self.make('Pending', hour=8)
+
+        def broken(sender, **kwargs):
+            raise RuntimeError('rollup refresh failed')
+
+        appointment_status_changed.connect(broken)
+        self.addCleanup(appointment_status_changed.disconnect, broken)
+        self.client.force_login(self.receptionist)
+        before = reports.versions(['appointments'])
+        with self.assertLogs('django.dispatch', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = self.bulk([appointment], 'Approved', HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertNotEqual(reports.versions(['appointments']), before)
+
+    def test_doctors_only_change_their_own_appointments(self):
+        mine = self.make('Pending', hour=8)
+        theirs = self.make('Pending', doctor=self.other_doctor, hour=8)
+        self.client.force_login(self.doctor)
+        response = self.bulk([mine, theirs], 'Approved', HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.json()['updated'], 1)
+        theirs.refresh_from_db()
+        self.assertEqual(theirs.status, 'Pending')
+
+    def test_students_cannot_bulk_update(self):
+        appointment = self.make('Pending')
+        self.client.force_login(self.student.user)
+        self.bulk([appointment], 'Approved')
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.status, 'Pending')
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    """Many simultaneous bookings of one slot: exactly one may win"""
+
+    BOOKINGS = 8
+
+    def test_only_one_concurrent_booking_takes_a_slot(self):
+        doctor = User.objects.create_user('dr_roba', role='doctor')
+        students = [make_student(i) for i in range(self.BOOKINGS)]
+        day = date.today() + timedelta(days=1)
+        barrier = threading.Barrier(self.BOOKINGS)
+        results = []
+
+        def attempt(student):
+            barrier.wait()
+            try:
+                # SQLite's in-memory test database reports lock contention instead of
+                # waiting for the other writer; retry, the constraint still decides
+                for _ in range(200):
+                    try:
+                        slots.book(Appointment(
+                            student=student, doctor=doctor, date=day, time=time(10, 0), reason='Rush'
+                        ))
+                        results.append('booked')
+                        return
+                    except slots.SlotUnavailable:
+                        results.append('taken')
+                        return
+                    except OperationalError:
+                        time_module.sleep(0.005)
+                results.append('gave up')
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=attempt, args=(s,)) for s in students]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), ['booked'] + ['taken'] * (self.BOOKINGS - 1))
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertEqual(AppointmentSlot.objects.get().appointment, Appointment.objects.get())
+
+
+
+class RecordingBroker:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, event):
+        self.published.append((topic, event))
+
+
+class AppointmentEventTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user('dr_gemechu', role='doctor')
+        cls.other_doctor = User.objects.create_user('dr_tadesse', role='doctor')
+        cls.receptionist = User.objects.create_user('reception', role='receptionist')
+        cls.student = make_student(0)
+
+    def test_bookings_and_transitions_publish_to_doctor_and_staff_topics(self):
+        broker = RecordingBroker()
+        with mock.patch.object(events, 'get_broker', return_value=broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                appointment = slots.book(Appointment(
+                    student=self.student, doctor=self.doctor, date=date(2030, 1, 7),
+                    time=time(9, 0), reason='Check-up'
+                ))
+            with self.captureOnCommitCallbacks(execute=True):
+                transition(Appointment.objects.filter(pk=appointment.pk), 'Approved')
+
+        topics = [topic for topic, _ in broker.published]
+        self.assertEqual(topics, [events.doctor_topic(self.doctor.pk), events.STAFF_TOPIC] * 2)
+        self.assertEqual(broker.published[0][1]['type'], 'created')
+        self.assertEqual(broker.published[0][1]['time'], '09:00')
+        self.assertEqual(broker.published[2][1], events.appointment_event(
+            'status', appointment.pk, self.doctor.pk, 'Approved'
+        ))
+
+    def test_status_changes_saved_directly_are_published(self):
+        appointment = slots.book(Appointment(
+            student=self.student, doctor=self.doctor, date=date(2030, 1, 8),
+            time=time(9, 0), reason='Check-up'
+        ))
+        broker = RecordingBroker()
+        with mock.patch.object(events, 'get_broker', return_value=broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                appointment.reason = 'Follow-up'
+                appointment.save()
+            self.assertEqual(broker.published, [])
+            with self.captureOnCommitCallbacks(execute=True):
+                appointment.status = 'Approved'
+                appointment.save()
+
+        self.assertEqual(broker.published, [
+            (topic, events.appointment_event('status', appointment.pk, self.doctor.pk, 'Approved'))
+            for topic in (events.doctor_topic(self.doctor.pk), events.STAFF_TOPIC)
+        ])
+
+    async def test_doctors_only_receive_their_own_queue(self):
+        broker = events.InProcessBroker()
+        mine = broker.subscribe(events.topics_for(self.doctor))
+        staff = broker.subscribe(events.topics_for(self.receptionist))
+        with mock.patch.object(events, 'get_broker', return_value=broker):
+            events.publish(events.appointment_event('status', 1, self.other_doctor.pk, 'Approved'))
+            events.publish(events.appointment_event('status', 2, self.doctor.pk, 'Approved'))
+
+        self.assertEqual((await mine.get(1))['id'], 2)
+        self.assertIsNone(await mine.get(0.01))
+        self.assertEqual([(await staff.get(1))['id'] for _ in range(2)], [1, 2])
+
+    async def test_event_stream(self):
+        broker = events.InProcessBroker()
+        await sync_to_async(self.async_client.force_login)(self.doctor)
+        with mock.patch.object(events, 'get_broker', return_value=broker), \
+                mock.patch('appointments.views.EVENTS_STREAM_SECONDS', 0.5):
+            response = await self.async_client.get(reverse('appointment_events'))
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            chunks = aiter(response.streaming_content)
+            self.assertEqual(await anext(chunks), b'retry: 5000\n\n')
+
+            events.publish(events.appointment_event('created', 7, self.doctor.pk, 'Pending'))
+            chunk = (await asyncio.wait_for(anext(chunks), 1)).decode()
+            self.assertTrue(chunk.startswith('event: appointment\ndata: '))
+            self.assertEqual(json.loads(chunk.split('data: ', 1)[1])['id'], 7)
+
+            # The stream ends at its deadline, after a keep-alive, and unsubscribes
+            rest = [chunk async for chunk in chunks]
+        self.assertEqual(rest, [b': keep-alive\n\n'])
+        self.assertFalse(broker._subscriptions)
+
+    async def test_event_stream_requires_staff(self):
+        await sync_to_async(self.async_client.force_login)(self.student.user)
+        response = await self.async_client.get(reverse('appointment_events'))
+        self.assertEqual(response.status_code, 403)
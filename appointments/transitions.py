@@ -0,0 +1,49 @@
+"""
+Appointment status transitions
+
+Pending -> Approved -> Completed, and Pending/Approved -> Cancelled. The
+allowed source states are part of the UPDATE's WHERE clause, so a row that
+moved on in the meantime (or was never eligible) is simply not changed.
+
+appointment_status_changed is sent once the UPDATE commits, with
+send_robust(): a failing receiver is logged and the others still run,
+since the change has been saved either way.
+"""
+from django.db import transaction
+
+from .models import Appointment
+from .signals import appointment_status_changed
+from . import slots
+
+ALLOWED_FROM = {
+    'Approved': ('Pending',),
+    'Completed': ('Approved',),
+    'Cancelled': ('Pending', 'Approved'),
+}
+
+# Most appointments one bulk request may touch
+MAX_BULK_UPDATE = 500
+
+
+def transition(queryset, status):
+    """
+    Move every appointment in queryset that may go to status there, with
+    one set-based UPDATE. Returns the number of appointments changed.
+    """
+    if status not in ALLOWED_FROM:
+        raise ValueError(f"Unknown target status: {status}")
+    allowed = ALLOWED_FROM[status]
+
+    with transaction.atomic():
+        pks = list(
+            queryset.filter(status__in=allowed).select_for_update().values_list('pk', flat=True)
+        )
+        changed = Appointment.objects.filter(pk__in=pks, status__in=allowed).update(status=status)
+        if status == 'Cancelled':
+            slots.release(Appointment.objects.filter(pk__in=pks))
+        if changed:
+            transaction.on_commit(
+                lambda: appointment_status_changed.send_robust(sender=Appointment, pks=pks, status=status),
+                robust=True,
+            )
+    return changed
@@ -3,7 +3,10 @@ from . import views
 
 urlpatterns = [
     path('book/', views.book_appointment, name='book_appointment'),
+    path('slots/', views.available_slots, name='available_slots'),
     path('my-appointments/', views.my_appointments, name='my_appointments'),
     path('manage/', views.manage_appointments, name='manage_appointments'),
+    path('events/', views.appointment_events, name='appointment_events'),
+    path('bulk-update/', views.bulk_update_appointments, name='bulk_update_appointments'),
     path('update/<int:appointment_id>/', views.update_appointment_status, name='update_appointment_status'),
 ]
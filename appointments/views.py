@@ -1,10 +1,31 @@
+import asyncio
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.contrib.auth import get_user_model
+from django.utils.dateparse import parse_date
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import require_POST
+from django.template.defaultfilters import pluralize
+from core.pagination import KeysetPage
 from .models import Appointment
-from .forms import AppointmentBookingForm
+from .forms import AppointmentBookingForm, AppointmentFilterForm
+from . import events, slots
+from .transitions import MAX_BULK_UPDATE, transition
 from students.models import StudentProfile
 
+User = get_user_model()
+
+APPOINTMENTS_PER_PAGE = 50
+
+# Comment lines keep idle event streams from being closed by proxies
+EVENTS_HEARTBEAT_SECONDS = 15
+# Streams end after this long and the browser reconnects; Django 4.2 cannot
+# tell a streaming view that its client went away, so this bounds the leak
+EVENTS_STREAM_SECONDS = 300
+
 @login_required
 def book_appointment(request):
     """Student books an appointment"""
@@ -17,14 +38,36 @@ def book_appointment(request):
         if form.is_valid():
             appointment = form.save(commit=False)
             appointment.student = request.user.student_profile
-            appointment.save()
-            messages.success(request, 'Appointment booked successfully!')
-            return redirect('my_appointments')
+            try:
+                slots.book(appointment)
+            except slots.SlotUnavailable as e:
+                form.add_error('time', str(e))
+            else:
+                messages.success(request, 'Appointment booked successfully!')
+                return redirect('my_appointments')
     else:
         form = AppointmentBookingForm()
     
     return render(request, 'appointments/book.html', {'form': form})
 
+@login_required
+def available_slots(request):
+    """Free half-hour slots for ?doctor=<id>&date=YYYY-MM-DD, as JSON"""
+    try:
+        day = parse_date(request.GET.get('date', ''))
+    except ValueError:
+        day = None
+    doctor_id = request.GET.get('doctor', '')
+    if day is None or not doctor_id.isdigit():
+        return JsonResponse({'error': 'doctor and date are required'}, status=400)
+    doctor = get_object_or_404(User, pk=doctor_id, role='doctor')
+    
+    return JsonResponse({
+        'doctor': doctor.pk,
+        'date': day.isoformat(),
+        'slots': [slot.strftime('%H:%M:%S') for slot in slots.free_slots(doctor, day)]
+    })
+
 @login_required
 def my_appointments(request):
     """View student's appointments"""
@@ -40,34 +83,137 @@ def my_appointments(request):
         'appointments': appointments
     })
 
+def staff_appointments(user):
+    """Appointments a staff member may manage: doctors only their own"""
+    if user.role == 'doctor':
+        return Appointment.objects.filter(doctor=user)
+    return Appointment.objects.all()
+
 @login_required
 def manage_appointments(request):
-    """Doctor/Receptionist manages appointments"""
+    """Doctor/Receptionist manages appointments, newest first, one keyset page at a time"""
     if not request.user.is_staff_member():
         messages.error(request, 'Access denied.')
         return redirect('dashboard')
     
-    if request.user.role == 'doctor':
-        appointments = Appointment.objects.filter(doctor=request.user)
-    else:
-        appointments = Appointment.objects.all()
+    is_doctor = request.user.role == 'doctor'
+    appointments = staff_appointments(request.user)
     
-    appointments = appointments.order_by('-date', '-time')
+    filter_form = AppointmentFilterForm(request.GET or None, show_doctor=not is_doctor)
+    appointments = filter_form.filter(appointments).select_related('student__user', 'doctor')
+    
+    page = KeysetPage(
+        appointments, ('date', 'time', 'id'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        per_page=APPOINTMENTS_PER_PAGE
+    )
+    
+    # Pager links keep the filters but not the current cursor
+    filters = request.GET.copy()
+    filters.pop('after', None)
+    filters.pop('before', None)
     
     return render(request, 'appointments/manage.html', {
-        'appointments': appointments
+        'appointments': page,
+        'page': page,
+        'filter_form': filter_form,
+        'filters': filters.urlencode()
     })
 
+def redirect_back(request):
+    """Back to the page the action was posted from (keeping its filters and cursor)"""
+    next_url = request.POST.get('next', '')
+    if url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
+    return redirect('manage_appointments')
+
+def apply_transition(request, appointments, status):
+    """Run a status transition and report it as a message, or as JSON to fetch() callers"""
+    try:
+        changed = transition(appointments, status)
+    except ValueError:
+        changed = None
+    
+    if 'application/json' in request.headers.get('Accept', ''):
+        if changed is None:
+            return JsonResponse({'error': f'Unknown status: {status}'}, status=400)
+        return JsonResponse({'status': status, 'updated': changed})
+    
+    if changed is None:
+        messages.error(request, 'Unknown status.')
+    elif changed:
+        messages.success(request, f'{changed} appointment{pluralize(changed)} {status.lower()} successfully!')
+    else:
+        messages.warning(request, f'No appointments could be {status.lower()}; check their current status.')
+    return redirect_back(request)
+
 @login_required
+@require_POST
 def update_appointment_status(request, appointment_id):
     """Update appointment status"""
-    appointment = get_object_or_404(Appointment, id=appointment_id)
+    if not request.user.is_staff_member():
+        messages.error(request, 'Access denied.')
+        return redirect('dashboard')
     
-    if request.method == 'POST':
-        status = request.POST.get('status')
-        if status in ['Approved', 'Completed', 'Cancelled']:
-            appointment.status = status
-            appointment.save()
-            messages.success(request, f'Appointment {status.lower()} successfully!')
+    get_object_or_404(staff_appointments(request.user), id=appointment_id)
+    return apply_transition(request, Appointment.objects.filter(id=appointment_id), request.POST.get('status'))
+
+@login_required
+@require_POST
+def bulk_update_appointments(request):
+    """Approve / complete / cancel the selected appointments with one UPDATE"""
+    if not request.user.is_staff_member():
+        messages.error(request, 'Access denied.')
+        return redirect('dashboard')
     
-    return redirect('manage_appointments')
+    ids = [i for i in request.POST.getlist('appointment_ids') if i.isdigit()]
+    if not ids:
+        messages.warning(request, 'Select at least one appointment.')
+        return redirect_back(request)
+    if len(ids) > MAX_BULK_UPDATE:
+        messages.error(request, f'Select at most {MAX_BULK_UPDATE} appointments at a time.')
+        return redirect_back(request)
+    
+    appointments = staff_appointments(request.user).filter(id__in=ids)
+    return apply_transition(request, appointments, request.POST.get('status'))
+
+@sync_to_async
+def staff_user(request):
+    """The logged-in staff user, or None (login_required cannot wrap async views on Django 4.2)"""
+    user = request.user
+    if user.is_authenticated and user.is_staff_member():
+        return user
+    return None
+
+async def appointment_events(request):
+    """Server-sent events: appointment bookings and status changes for this user's queue"""
+    user = await staff_user(request)
+    if user is None:
+        return HttpResponseForbidden('Staff login required.')
+    
+    broker = events.get_broker()
+    subscription = broker.subscribe(events.topics_for(user))
+    
+    async def stream():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + EVENTS_STREAM_SECONDS
+        try:
+            yield 'retry: 5000\n\n'
+            while (remaining := deadline - loop.time()) > 0:
+                event = await subscription.get(min(EVENTS_HEARTBEAT_SECONDS, remaining))
+                if subscription.overflowed:
+                    # Too far behind to patch the page; let it reload once
+                    yield events.format_sse({}, name='resync')
+                    return
+                if event is None:
+                    yield ': keep-alive\n\n'
+                else:
+                    yield events.format_sse(event)
+        finally:
+            broker.unsubscribe(subscription)
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
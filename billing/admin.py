@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Bill
+from .models import Bill, LedgerEntry, StudentBalance
 
 @admin.register(Bill)
 class BillAdmin(admin.ModelAdmin):
@@ -7,3 +7,51 @@ class BillAdmin(admin.ModelAdmin):
     list_filter = ['status', 'date']
     search_fields = ['student__user__username', 'service']
     date_hierarchy = 'date'
+    ordering = ['-date', '-id']
+
+class OwingFilter(admin.SimpleListFilter):
+    title = 'balance'
+    parameter_name = 'owing'
+
+    def lookups(self, request, model_admin):
+        return [('yes', 'Owes money'), ('no', 'Settled')]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(balance__gt=0)
+        if self.value() == 'no':
+            return queryset.filter(balance__lte=0)
+        return queryset
+
+@admin.register(StudentBalance)
+class StudentBalanceAdmin(admin.ModelAdmin):
+    """The clearance list; balances only change through bills and reconcile_ledger"""
+    list_display = ['student', 'balance', 'pending_bills', 'updated_at']
+    list_filter = [OwingFilter]
+    search_fields = ['student__student_id', 'student__user__username']
+    ordering = ['-balance', 'student']
+    list_select_related = ['student__user']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    """Append-only: entries are written by billing.ledger and never edited"""
+    list_display = ['id', 'student', 'kind', 'amount', 'bill', 'note', 'created_at']
+    list_filter = ['kind']
+    search_fields = ['student__student_id', 'note']
+    ordering = ['-id']
+    list_select_related = ['student__user', 'bill__student__user']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
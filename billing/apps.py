@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class BillingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'billing'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save, pre_save
+        from . import ledger
+        from .models import Bill
+
+        pre_save.connect(ledger.remember_old_bill, sender=Bill, dispatch_uid='billing_ledger')
+        post_save.connect(ledger.on_bill_saved, sender=Bill, dispatch_uid='billing_ledger')
+        post_delete.connect(ledger.on_bill_deleted, sender=Bill, dispatch_uid='billing_ledger')
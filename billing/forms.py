@@ -0,0 +1,8 @@
+from django import forms
+
+class PaymentImportForm(forms.Form):
+    file = forms.FileField(
+        label='Payment file',
+        help_text='CSV (or .csv.gz) with bill_id and amount columns, and optionally reference.',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.gz'}),
+    )
@@ -0,0 +1,222 @@
+"""
+Per-student billing ledger
+
+Every change to what a student owes is appended as a LedgerEntry, and
+StudentBalance keeps the running total. A student owes the sum of their
+Pending bills. Receivers connected in BillingConfig.ready turn each Bill
+save or delete into entries and apply their sum to the balance with a
+single UPDATE ... SET balance = balance + delta. Bill.save() and
+Bill.delete() run in a transaction, so the bill, its entries and the
+balance commit or roll back together. Looking up one student's balance
+is then a primary-key read, and the clearance list is one query on the
+balance_owing_idx partial index.
+
+Writes that bypass signals (bulk_create / COPY imports, queryset.update())
+must call reconcile() for the students they touched, or, for bills marked
+Paid in bulk, record_payments(). reconcile() also
+backs the reconcile_ledger command, which checks every balance against
+the bills in chunks and books any difference as an adjustment.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When
+
+from .models import Bill, LedgerEntry, StudentBalance
+
+RECONCILE_CHUNK_SIZE = 2000
+PAYMENT_BATCH_SIZE = 200
+ZERO = Decimal('0.00')
+
+
+def balance(student_id):
+    """What a student owes (one primary-key lookup)"""
+    return (StudentBalance.objects.filter(pk=student_id).values_list('balance', flat=True).first()) or ZERO
+
+
+def debtors(min_balance=Decimal('0.01')):
+    """StudentBalance of everyone who owes at least min_balance, largest first: the clearance list"""
+    return (StudentBalance.objects.filter(balance__gt=0, balance__gte=min_balance)
+            .select_related('student__user').order_by('-balance', 'student'))
+
+
+def _owed(amount, status):
+    return amount if status == 'Pending' else ZERO
+
+
+def entries_for_change(bill, old):
+    """
+    LedgerEntry objects (unsaved) for bill going from old, an
+    (amount, status) pair or None for a new bill, to its current state
+    """
+    amount = Decimal(str(bill.amount))  # A str until the bill is read back, if set from one
+    note = bill.service[:200]
+
+    def entry(kind, value, text=note):
+        return LedgerEntry(student_id=bill.student_id, bill=bill, kind=kind, amount=value, note=text)
+
+    if old is None:
+        entries = [entry('charge', amount)]
+        if bill.status == 'Paid':
+            entries.append(entry('payment', -amount))
+        return entries
+
+    old_amount, old_status = old
+    entries = []
+    if amount != old_amount:
+        entries.append(entry('adjustment', amount - old_amount, f'{note}: amount changed'))
+    paid_before = old_amount if old_status == 'Paid' else ZERO
+    paid_now = amount if bill.status == 'Paid' else ZERO
+    if paid_now != paid_before:
+        entries.append(entry('payment' if paid_now > paid_before else 'reversal', paid_before - paid_now))
+    return entries
+
+
+def apply(student_id, entries, pending_delta):
+    """Append entries and move the student's balance by their sum (call inside a transaction)"""
+    if not entries and not pending_delta:
+        return
+    LedgerEntry.objects.bulk_create(entries)
+    delta = sum((entry.amount for entry in entries), ZERO)
+    changes = {'balance': F('balance') + delta, 'pending_bills': F('pending_bills') + pending_delta}
+    if not StudentBalance.objects.filter(pk=student_id).update(**changes):
+        StudentBalance.objects.get_or_create(student_id=student_id)
+        StudentBalance.objects.filter(pk=student_id).update(**changes)
+
+
+def _case(student_ids, values, output_field):
+    """CASE giving each of student_ids its entry in values"""
+    groups = {}
+    for pk in student_ids:
+        groups.setdefault(values[pk], []).append(pk)
+    return Case(*[When(pk__in=pks, then=Value(value)) for value, pks in groups.items()], output_field=output_field)
+
+
+def record_payments(bills):
+    """
+    Book bills just switched from Pending to Paid by queryset.update():
+    bills is a list of (bill_id, student_id, amount, note). One payment entry per
+    bill, and the balances moved by one UPDATE per PAYMENT_BATCH_SIZE
+    students (call inside the transaction that updated the bills).
+    """
+    if not bills:
+        return
+    LedgerEntry.objects.bulk_create(
+        [LedgerEntry(student_id=student_id, bill_id=bill_id, kind='payment', amount=-amount, note=note[:200])
+         for bill_id, student_id, amount, note in bills],
+        batch_size=2000,
+    )
+    paid, count = {}, {}
+    for _, student_id, amount, _ in bills:
+        paid[student_id] = paid.get(student_id, ZERO) + amount
+        count[student_id] = count.get(student_id, 0) + 1
+    # One UPDATE per batch (kept within SQLite's parameter limit), with a WHEN
+    # per distinct amount rather than per student: far fewer expressions to build
+    students = list(paid)
+    updated = 0
+    for i in range(0, len(students), PAYMENT_BATCH_SIZE):
+        batch = students[i:i + PAYMENT_BATCH_SIZE]
+        updated += StudentBalance.objects.filter(pk__in=batch).update(
+            balance=F('balance') - _case(batch, paid, DecimalField(max_digits=12, decimal_places=2)),
+            pending_bills=F('pending_bills') - _case(batch, count, IntegerField()),
+        )
+    if updated < len(students):
+        # Bills written without a balance row (e.g. by a raw import): rebuild those from the bills
+        missing = set(students) - set(StudentBalance.objects.filter(pk__in=students).values_list('pk', flat=True))
+        reconcile(missing)
+
+
+# Signal receivers
+
+def remember_old_bill(sender, instance, raw=False, **kwargs):
+    """pre_save: the amount and status before this save, to book only the difference"""
+    instance._ledger_old = None
+    if instance.pk and not raw:
+        # Locked until Bill.save() commits, so a concurrent edit cannot book the same difference
+        instance._ledger_old = (Bill.objects.select_for_update().filter(pk=instance.pk)
+                                .values_list('amount', 'status', 'student_id').first())
+
+
+def on_bill_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_ledger_old', None)
+    if old is not None and old[2] != instance.student_id:
+        # Moved to another student: cancel it on the old account, charge it on the new one
+        apply(old[2], [LedgerEntry(student_id=old[2], kind='adjustment', amount=-_owed(old[0], old[1]),
+                                   note=f'Bill #{instance.pk} moved to another student')],
+              -(old[1] == 'Pending'))
+        old = None
+    elif old is not None:
+        old = old[:2]
+    entries = entries_for_change(instance, old)
+    was_pending = old is not None and old[1] == 'Pending'
+    apply(instance.student_id, entries, (instance.status == 'Pending') - was_pending)
+
+
+def on_bill_deleted(sender, instance, **kwargs):
+    owed = _owed(Decimal(str(instance.amount)), instance.status)
+    entry = LedgerEntry(student_id=instance.student_id, kind='adjustment', amount=-owed,
+                        note=f'Bill #{instance.pk} deleted')
+    apply(instance.student_id, [entry] if owed else [], -(instance.status == 'Pending'))
+
+
+# Reconciliation
+
+def _chunks(student_ids, chunk_size):
+    if student_ids is not None:
+        student_ids = sorted(set(student_ids))
+        for i in range(0, len(student_ids), chunk_size):
+            yield student_ids[i:i + chunk_size]
+        return
+    from students.models import StudentProfile
+    last_pk = 0
+    while True:
+        chunk = list(StudentProfile.objects.filter(pk__gt=last_pk).order_by('pk')
+                     .values_list('pk', flat=True)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1]
+
+
+def reconcile(student_ids=None, chunk_size=RECONCILE_CHUNK_SIZE, fix=True, on_chunk=None):
+    """
+    Compare the balances of student_ids (default: every student) with their
+    Pending bills, chunk_size students per transaction. With fix, each
+    difference is booked as an adjustment entry and the balance corrected.
+    Returns [(student_id, recorded, actual)] for every mismatch.
+    """
+    mismatches = []
+    for chunk_no, chunk in enumerate(_chunks(student_ids, chunk_size), 1):
+        with transaction.atomic():
+            # Lock first, so a bill saved meanwhile either is in the totals below or waits for us
+            recorded = {
+                pk: (amount, pending) for pk, amount, pending in
+                StudentBalance.objects.select_for_update().filter(pk__in=chunk)
+                .values_list('pk', 'balance', 'pending_bills')
+            }
+            actual = {
+                row['student_id']: (row['owed'] or ZERO, row['pending'])
+                for row in Bill.objects.filter(student_id__in=chunk).values('student_id').order_by()
+                .annotate(owed=Sum('amount', filter=Q(status='Pending')), pending=Count('pk', filter=Q(status='Pending')))
+            }
+            wrong = [
+                (pk, recorded.get(pk), actual.get(pk, (ZERO, 0)))
+                for pk in chunk
+                if recorded.get(pk, (ZERO, 0)) != actual.get(pk, (ZERO, 0)) or (pk in actual and pk not in recorded)
+            ]
+            mismatches.extend((pk, was[0] if was else None, now[0]) for pk, was, now in wrong)
+            if fix and wrong:
+                LedgerEntry.objects.bulk_create([
+                    LedgerEntry(student_id=pk, kind='adjustment', amount=now[0] - (was[0] if was else ZERO),
+                                note='Reconciled with bills')
+                    for pk, was, now in wrong if now[0] != (was[0] if was else ZERO)
+                ])
+                StudentBalance.objects.bulk_create(
+                    [StudentBalance(student_id=pk, balance=now[0], pending_bills=now[1]) for pk, _, now in wrong],
+                    update_conflicts=True, unique_fields=['student'], update_fields=['balance', 'pending_bills', 'updated_at'],
+                )
+        if on_chunk:
+            on_chunk(chunk_no, len(chunk), len(mismatches))
+    return mismatches
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='external_id',
+            field=models.CharField(blank=True, help_text='Natural key of imported records, e.g. BILL-10000', max_length=20, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0003_imported_dates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['date', 'id'], name='bill_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['status', 'date', 'id'], name='bill_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['student', 'date', 'id'], name='bill_student_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(condition=models.Q(('status', 'Pending')), fields=['student', 'date'], name='bill_outstanding_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_balances(apps, schema_editor):
+    Bill = apps.get_model('billing', 'Bill')
+    LedgerEntry = apps.get_model('billing', 'LedgerEntry')
+    StudentBalance = apps.get_model('billing', 'StudentBalance')
+    owed = (Bill.objects.filter(status='Pending').values('student_id').order_by('student_id')
+            .annotate(balance=models.Sum('amount'), pending=models.Count('pk')))
+    balances, entries = [], []
+    for row in owed.iterator(5000):
+        balances.append(StudentBalance(student_id=row['student_id'], balance=row['balance'], pending_bills=row['pending']))
+        entries.append(LedgerEntry(student_id=row['student_id'], kind='adjustment', amount=row['balance'], note='Opening balance'))
+    StudentBalance.objects.bulk_create(balances, batch_size=5000)
+    LedgerEntry.objects.bulk_create(entries, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0001_initial'),
+        ('billing', '0004_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentBalance',
+            fields=[
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='students.studentprofile')),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('pending_bills', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('balance__gt', 0)), fields=['-balance', 'student'], name='balance_owing_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('charge', 'Charge'), ('payment', 'Payment'), ('reversal', 'Payment reversed'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('bill', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='billing.bill')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='students.studentprofile')),
+            ],
+            options={
+                'verbose_name_plural': 'ledger entries',
+                'indexes': [models.Index(fields=['student', 'id'], name='ledger_student_idx')],
+            },
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
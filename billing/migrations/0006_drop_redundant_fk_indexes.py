@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0001_initial'),
+        ('billing', '0005_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bill',
+            name='student',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='bills', to='students.studentprofile'),
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+import datetime
+from django.db import models, transaction
 from students.models import StudentProfile
 
 class Bill(models.Model):
@@ -7,11 +8,82 @@ class Bill(models.Model):
         ('Paid', 'Paid'),
     )
 
-    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='bills')
+    external_id = models.CharField(max_length=20, unique=True, null=True, blank=True, help_text="Natural key of imported records, e.g. BILL-10000")
+    # Indexed through bill_student_date_idx
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, db_index=False, related_name='bills')
     service = models.CharField(max_length=200)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    date = models.DateField(auto_now_add=True)
+    date = models.DateField(default=datetime.date.today, editable=False)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
 
+    class Meta:
+        # Admin filters by status and date; outstanding bills are looked up per student
+        indexes = [
+            models.Index(fields=['date', 'id'], name='bill_date_idx'),
+            models.Index(fields=['status', 'date', 'id'], name='bill_status_date_idx'),
+            models.Index(fields=['student', 'date', 'id'], name='bill_student_date_idx'),
+            models.Index(fields=['student', 'date'], condition=models.Q(status='Pending'), name='bill_outstanding_idx'),
+        ]
+
     def __str__(self):
         return f"Bill #{self.id} - {self.student.user.username} - {self.amount}"
+
+    # The ledger receivers (billing.ledger) run inside these transactions, so a
+    # bill, its ledger entries and the student's balance always commit together
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+class LedgerEntry(models.Model):
+    """
+    One change to what a student owes; append-only. Charges and reopened
+    bills are positive, payments and cancelled charges negative, so a
+    student's entries always sum to their StudentBalance.
+    """
+    KINDS = (
+        ('charge', 'Charge'),
+        ('payment', 'Payment'),
+        ('reversal', 'Payment reversed'),
+        ('adjustment', 'Adjustment'),
+    )
+
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='ledger_entries')
+    bill = models.ForeignKey(Bill, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    kind = models.CharField(max_length=20, choices=KINDS)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    note = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = 'ledger entries'
+        # Statements list a student's entries in order
+        indexes = [
+            models.Index(fields=['student', 'id'], name='ledger_student_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.amount} for student #{self.student_id}"
+
+class StudentBalance(models.Model):
+    """
+    What a student owes: the sum of their Pending bills, kept up to date by
+    billing.ledger in the same transaction as the bill. Students who never
+    had a bill have no row.
+    """
+    student = models.OneToOneField(StudentProfile, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    pending_bills = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # The clearance list: everyone who owes, largest balance first
+        indexes = [
+            models.Index(fields=['-balance', 'student'], condition=models.Q(balance__gt=0), name='balance_owing_idx'),
+        ]
+
+    def __str__(self):
+        return f"Student #{self.student_id} owes {self.balance}"
@@ -0,0 +1,144 @@
+"""
+Payment files from the finance office
+
+A payment file is a CSV with a bill_id and an amount column (and an
+optional reference column). bill_id is a bill's external_id (e.g.
+BILL-10000) or, for bills created in the app, its number. The file is
+read as a stream, CHUNK_SIZE rows at a time. Each chunk is looked up in
+one query on the bill's unique indexes and settled in one transaction:
+matching Pending bills are marked Paid with a single UPDATE, and the
+ledger is booked through ledger.record_payments(). The UPDATE sends no
+signals, so once each chunk commits, the paid students' timelines and the
+bill rollups of the days concerned are refreshed here.
+
+Rows that cannot be applied are written to an exceptions CSV with the
+reason, and with the bill's own amount and status when there is one.
+"""
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q
+
+from analytics import reports, rollups
+from medical import timeline
+from . import ledger
+from .models import Bill
+
+CHUNK_SIZE = 5000
+COLUMNS = ('bill_id', 'amount')
+EXCEPTION_COLUMNS = ['line', 'bill_id', 'amount', 'reference', 'reason', 'bill_amount', 'bill_status']
+
+PAID = 'paid'
+UNKNOWN = 'unknown bill'
+MISMATCH = 'amount mismatch'
+ALREADY_PAID = 'already paid'
+DUPLICATE = 'duplicate in file'
+INVALID = 'invalid amount'
+OUTCOMES = (PAID, UNKNOWN, MISMATCH, ALREADY_PAID, DUPLICATE, INVALID)
+
+
+def read(fileobj):
+    """(line number, bill_id, amount, reference) rows of a binary CSV stream"""
+    reader = csv.DictReader(io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline=''))
+    missing = sorted(set(COLUMNS) - set(reader.fieldnames or ()))
+    if missing:
+        raise ValueError(f"Payment file is missing columns: {', '.join(missing)}")
+    for row in reader:
+        yield (reader.line_num, (row['bill_id'] or '').strip(), (row['amount'] or '').strip(),
+               (row.get('reference') or '').strip())
+
+
+def _chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _apply_chunk(chunk, write_exception):
+    counts = dict.fromkeys(OUTCOMES, 0)
+    parsed, seen = [], set()
+    for line, bill_id, raw_amount, reference in chunk:
+        try:
+            amount = Decimal(raw_amount)
+            if not amount.is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            counts[INVALID] += 1
+            write_exception([line, bill_id, raw_amount, reference, INVALID, '', ''])
+            continue
+        if bill_id in seen:
+            counts[DUPLICATE] += 1
+            write_exception([line, bill_id, raw_amount, reference, DUPLICATE, '', ''])
+            continue
+        seen.add(bill_id)
+        parsed.append((line, bill_id, amount, raw_amount, reference))
+
+    external_ids = [bill_id for bill_id in seen if not bill_id.isdigit()]
+    pks = [int(bill_id) for bill_id in seen if bill_id.isdigit()]
+    with transaction.atomic():
+        # Locked, so a bill paid or edited meanwhile cannot be booked twice
+        found = {}
+        for pk, external_id, student_id, bill_amount, status, day in (
+            Bill.objects.select_for_update().filter(Q(external_id__in=external_ids) | Q(pk__in=pks))
+            .values_list('pk', 'external_id', 'student_id', 'amount', 'status', 'date')
+        ):
+            found[str(pk)] = found[external_id] = (pk, student_id, bill_amount, status, day)
+
+        payments, paid, students, days = [], set(), set(), set()
+        for line, bill_id, amount, raw_amount, reference in parsed:
+            bill = found.get(bill_id)
+            if bill is None:
+                outcome = UNKNOWN
+            elif bill[0] in paid:  # Listed both by number and by external_id
+                outcome = DUPLICATE
+            elif bill[3] == 'Paid':
+                outcome = ALREADY_PAID
+            elif bill[2] != amount:
+                outcome = MISMATCH
+            else:
+                payments.append((bill[0], bill[1], bill[2], f'Payment {reference}'.strip()))
+                paid.add(bill[0])
+                students.add(bill[1])
+                days.add(bill[4])
+                counts[PAID] += 1
+                continue
+            counts[outcome] += 1
+            write_exception([line, bill_id, raw_amount, reference, outcome,
+                             bill[2] if bill else '', bill[3] if bill else ''])
+
+        if payments:
+            Bill.objects.filter(pk__in=paid).update(status='Paid')
+            ledger.record_payments(payments)
+            transaction.on_commit(lambda: _refresh(students, days))
+    return counts
+
+
+def _refresh(students, days):
+    for student_id in students:
+        timeline.invalidate(student_id)
+    rollups.refresh_days('bills', days)
+
+
+def apply(fileobj, exceptions, chunk_size=CHUNK_SIZE, on_chunk=None):
+    """
+    Settle the bills paid in the CSV stream fileobj, writing rows that could
+    not be applied to the text stream exceptions. Returns a count per outcome.
+    """
+    writer = csv.writer(exceptions)
+    writer.writerow(EXCEPTION_COLUMNS)
+    counts = dict.fromkeys(OUTCOMES, 0)
+    for chunk_no, chunk in enumerate(_chunks(read(fileobj), chunk_size), 1):
+        for outcome, n in _apply_chunk(chunk, writer.writerow).items():
+            counts[outcome] += n
+        if on_chunk:
+            on_chunk(chunk_no, counts)
+    if counts[PAID]:
+        reports.invalidate('bills')
+    return counts
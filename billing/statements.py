@@ -0,0 +1,215 @@
+"""
+PDF billing statements, one per student, rendered with reportlab
+
+A statement lists every bill of a student with what was paid and what is
+still owed. load() reads the students and their bills in two queries into
+plain dicts. render() turns one of those dicts into PDF bytes without
+touching the database, so it can run in a process pool.
+
+Rendered PDFs are kept in default_storage under STORAGE_PREFIX, named by
+content_hash(): a SHA-256 of the statement data and TEMPLATE_VERSION. The
+data includes the issue date printed on the PDF, so a statement whose bills
+have not changed is rendered at most once a day, whether it was last
+produced by a batch run or by a single download. Any change to a bill, or
+to the layout (bump TEMPLATE_VERSION), gives a new hash and so a fresh
+render.
+
+build_archive() writes many statements into a ZIP as they finish,
+working through the students chunk by chunk, so memory does not grow
+with the number of students.
+"""
+import datetime
+import hashlib
+import io
+import json
+import multiprocessing
+import zipfile
+from xml.sax.saxutils import escape
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from decimal import Decimal
+
+import django
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .models import Bill
+
+# Bump whenever render() changes what a statement looks like
+TEMPLATE_VERSION = 1
+STORAGE_PREFIX = 'statements'
+ARCHIVE_CHUNK_SIZE = 500
+CLINIC_NAME = 'Haramaya University Health Center'
+
+
+def load(student_ids, today=None):
+    """{student pk: statement data} for student_ids, issued today, in two queries"""
+    from students.models import StudentProfile
+    issued = (today or datetime.date.today()).isoformat()
+    statements = {}
+    students = (StudentProfile.objects.filter(pk__in=student_ids)
+                .values_list('pk', 'student_id', 'user__first_name', 'user__last_name', 'college', 'department'))
+    for pk, student_id, first_name, last_name, college, department in students:
+        statements[pk] = {
+            'student_id': student_id,
+            'name': f'{first_name} {last_name}'.strip(),
+            'college': college,
+            'department': department,
+            'issued': issued,
+            'bills': [],
+        }
+    bills = (Bill.objects.filter(student_id__in=statements).order_by('student_id', 'date', 'id')
+             .values_list('student_id', 'id', 'date', 'service', 'amount', 'status'))
+    for student_pk, bill_id, date, service, amount, status in bills:
+        statements[student_pk]['bills'].append({
+            'id': bill_id, 'date': date.isoformat(), 'service': service,
+            'amount': str(amount), 'status': status,
+        })
+    return statements
+
+
+def content_hash(statement):
+    payload = json.dumps([TEMPLATE_VERSION, statement], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _path(digest):
+    return f'{STORAGE_PREFIX}/{digest[:2]}/{digest}.pdf'
+
+
+def filename(statement):
+    return f"statement-{statement['student_id']}.pdf"
+
+
+def render(statement):
+    """PDF bytes of one statement; needs no database, so it runs in worker processes"""
+    try:
+        from reportlab.lib import colors
+    except ImportError:
+        raise ValueError("Rendering statements needs reportlab (pip install reportlab).")
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    styles = getSampleStyleSheet()
+    buffer = io.BytesIO()
+    # invariant=True leaves out timestamps, so the same statement gives the same bytes
+    document = SimpleDocTemplate(buffer, pagesize=A4, title=f"Statement {statement['student_id']}",
+                                 author=CLINIC_NAME, invariant=True,
+                                 leftMargin=18 * mm, rightMargin=18 * mm, topMargin=18 * mm, bottomMargin=18 * mm)
+
+    billed = sum((Decimal(bill['amount']) for bill in statement['bills']), Decimal('0.00'))
+    owed = sum((Decimal(bill['amount']) for bill in statement['bills'] if bill['status'] == 'Pending'),
+               Decimal('0.00'))
+    rows = [['Date', 'Bill', 'Service', 'Status', 'Amount (ETB)']]
+    rows += [
+        [bill['date'], f"#{bill['id']}", Paragraph(escape(bill['service']), styles['BodyText']), bill['status'], bill['amount']]
+        for bill in statement['bills']
+    ]
+    rows += [
+        ['', '', 'Total billed', '', f'{billed:.2f}'],
+        ['', '', 'Paid', '', f'{billed - owed:.2f}'],
+        ['', '', 'Outstanding', '', f'{owed:.2f}'],
+    ]
+    table = Table(rows, colWidths=[25 * mm, 20 * mm, 70 * mm, 25 * mm, 30 * mm], repeatRows=1)
+    table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0d6efd')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('ALIGN', (-1, 0), (-1, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('LINEBELOW', (0, 0), (-1, -4), 0.25, colors.lightgrey),
+        ('LINEABOVE', (2, -3), (-1, -3), 0.75, colors.black),
+        ('FONTNAME', (2, -1), (-1, -1), 'Helvetica-Bold'),
+    ]))
+
+    # Paragraph parses its text as markup, so stored text must be escaped
+    name = escape(statement['name'] or statement['student_id'])
+    story = [
+        Paragraph(CLINIC_NAME, styles['Title']),
+        Paragraph('Billing statement', styles['Heading2']),
+        Paragraph(f"{name} &middot; {escape(statement['student_id'])}", styles['Normal']),
+        Paragraph(escape(f"{statement['college']}, {statement['department']}"), styles['Normal']),
+        Paragraph(f"Issued {statement['issued']}", styles['Normal']),
+        Spacer(1, 8 * mm),
+        table if statement['bills'] else Paragraph('No bills on record.', styles['Normal']),
+    ]
+    document.build(story)
+    return buffer.getvalue()
+
+
+def cached(digest):
+    """The stored PDF for digest, or None"""
+    path = _path(digest)
+    if not default_storage.exists(path):
+        return None
+    with default_storage.open(path, 'rb') as f:
+        return f.read()
+
+
+def store(digest, pdf):
+    path = _path(digest)
+    if not default_storage.exists(path):
+        default_storage.save(path, ContentFile(pdf))
+
+
+def get_pdf(student_pk):
+    """(filename, PDF bytes) of one student's statement, rendered only if its bills changed; None if no such student"""
+    statement = load([student_pk]).get(student_pk)
+    if statement is None:
+        return None
+    digest = content_hash(statement)
+    pdf = cached(digest)
+    if pdf is None:
+        pdf = render(statement)
+        store(digest, pdf)
+    return filename(statement), pdf
+
+
+def _render_job(statement):
+    return render(statement)
+
+
+def build_archive(student_ids, fileobj, workers=None, chunk_size=ARCHIVE_CHUNK_SIZE, on_chunk=None):
+    """
+    Write the statements of student_ids into a ZIP on fileobj, each added as
+    soon as it is ready. Uncached statements are rendered by `workers`
+    processes (1 renders in this process). Returns (statements, rendered).
+    """
+    student_ids = list(student_ids)
+    total = rendered = 0
+    pool = None
+    if workers != 1:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=django.setup)
+    try:
+        with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for chunk_no, start in enumerate(range(0, len(student_ids), chunk_size), 1):
+                statements = load(student_ids[start:start + chunk_size])
+                pending = {}
+                for statement in statements.values():
+                    digest = content_hash(statement)
+                    pdf = cached(digest)
+                    if pdf is not None:
+                        archive.writestr(filename(statement), pdf)
+                    else:
+                        pending[digest] = statement
+
+                if pool is None:
+                    finished = ((digest, statement, render(statement)) for digest, statement in pending.items())
+                else:
+                    futures = {pool.submit(_render_job, statement): (digest, statement)
+                               for digest, statement in pending.items()}
+                    finished = ((*futures[future], future.result()) for future in as_completed(futures))
+                for digest, statement, pdf in finished:
+                    store(digest, pdf)
+                    archive.writestr(filename(statement), pdf)
+
+                total += len(statements)
+                rendered += len(pending)
+                if on_chunk:
+                    on_chunk(chunk_no, len(statements), len(pending))
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return total, rendered
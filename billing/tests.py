@@ -1,3 +1,330 @@
-from django.test import TestCase
+import csv
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from analytics import rollups
+from medical import timeline
+from students.models import StudentProfile
+from . import ledger, payments, statements
+from .models import Bill, LedgerEntry, StudentBalance
+
+User = get_user_model()
+
+
+class LedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.students = [
+            StudentProfile.objects.create(
+                user=User.objects.create_user(f'st_ledger{i}', role='student'),
+                student_id=f'HU-UGR-2023-8000{i}', college='CBE', department='Economics', gender='M', year=4
+            )
+            for i in range(3)
+        ]
+
+    def assertBalance(self, student, amount, pending_bills):
+        row = StudentBalance.objects.get(pk=student.pk)
+        self.assertEqual((row.balance, row.pending_bills), (Decimal(amount), pending_bills))
+        # The entries always add up to the balance
+        self.assertEqual(LedgerEntry.objects.filter(student=student).aggregate(total=Sum('amount'))['total'],
+                         Decimal(amount))
+
+    def test_bill_lifecycle(self):
+        student = self.students[0]
+        bill = Bill.objects.create(student=student, service='X-Ray', amount='75.00')
+        Bill.objects.create(student=student, service='ECG', amount=Decimal('40.00'))
+        self.assertBalance(student, '115.00', 2)
+
+        bill.status = 'Paid'
+        bill.save()
+        self.assertBalance(student, '40.00', 1)
+
+        # Reopened with a corrected amount: adjustment plus reversal of the payment
+        bill.status = 'Pending'
+        bill.amount = Decimal('60.00')
+        bill.save()
+        self.assertBalance(student, '100.00', 2)
+        self.assertEqual(list(bill.ledger_entries.order_by('id').values_list('kind', 'amount')), [
+            ('charge', Decimal('75.00')), ('payment', Decimal('-75.00')),
+            ('adjustment', Decimal('-15.00')), ('reversal', Decimal('75.00')),
+        ])
+
+        bill.delete()
+        self.assertBalance(student, '40.00', 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(ledger.balance(student.pk), Decimal('40.00'))
+        self.assertEqual(ledger.balance(self.students[2].pk), Decimal('0.00'))
+
+    def test_bill_moved_to_another_student(self):
+        first, second = self.students[:2]
+        bill = Bill.objects.create(student=first, service='Dental', amount=Decimal('30.00'))
+        bill.student = second
+        bill.save()
+        self.assertBalance(first, '0.00', 0)
+        self.assertBalance(second, '30.00', 1)
+
+    @unittest.skipUnless(connection.features.has_select_for_update, 'needs SELECT ... FOR UPDATE')
+    def test_edit_locks_the_old_row(self):
+        bill = Bill.objects.create(student=self.students[0], service='X-Ray', amount=Decimal('75.00'))
+        bill.status = 'Paid'
+        with CaptureQueriesContext(connection) as queries:
+            bill.save()
+        self.assertTrue(any(q['sql'].startswith('SELECT') and 'FOR UPDATE' in q['sql'] for q in queries))
+
+    def test_rolled_back_bill_leaves_no_trace(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Bill.objects.create(student=self.students[0], service='X-Ray', amount=Decimal('75.00'))
+            raise RuntimeError
+        self.assertFalse(LedgerEntry.objects.exists())
+        self.assertEqual(ledger.balance(self.students[0].pk), Decimal('0.00'))
+
+    def test_clearance_list_is_one_query(self):
+        for student, amount in zip(self.students, ['10.00', '90.00', '50.00']):
+            Bill.objects.create(student=student, service='Consultation Fee', amount=Decimal(amount))
+        Bill.objects.filter(student=self.students[0]).get().delete()
+        with self.assertNumQueries(1):
+            rows = [(row.student.user.username, row.balance) for row in ledger.debtors()]
+        self.assertEqual(rows, [('st_ledger1', Decimal('90.00')), ('st_ledger2', Decimal('50.00'))])
+        self.assertEqual(len(ledger.debtors(min_balance=Decimal('60'))), 1)
+
+    def test_reconcile_repairs_writes_that_bypass_signals(self):
+        student = self.students[0]
+        Bill.objects.create(student=student, service='X-Ray', amount=Decimal('75.00'))
+        Bill.objects.bulk_create([
+            Bill(student=student, service='ECG', amount=Decimal('40.00')),
+            Bill(student=self.students[1], service='ECG', amount=Decimal('40.00'), status='Paid'),
+        ])
+        Bill.objects.filter(service='X-Ray').update(status='Paid')
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile_ledger', '--check', stdout=StringIO())
+        out = StringIO()
+        call_command('reconcile_ledger', '--chunk-size', '2', stdout=out)
+        self.assertIn('Balances corrected: 2', out.getvalue())
+        self.assertBalance(student, '40.00', 1)
+        self.assertEqual(StudentBalance.objects.get(pk=self.students[1].pk).balance, Decimal('0.00'))
+        self.assertEqual(ledger.reconcile(fix=False), [])
+
+
+class StatementTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.students = [
+            StudentProfile.objects.create(
+                user=User.objects.create_user(f'st_statement{i}', password='pass', role='student', first_name='Abebe'),
+                student_id=f'HU-UGR-2023-8100{i}', college='CBE', department='Economics', gender='M', year=4
+            )
+            for i in range(3)
+        ]
+        cls.bill = Bill.objects.create(student=cls.students[0], service='X-Ray', amount=Decimal('75.00'))
+        Bill.objects.create(student=cls.students[0], service='ECG', amount=Decimal('40.00'), status='Paid')
+        Bill.objects.create(student=cls.students[1], service='Consultation', amount=Decimal('20.00'))
+        User.objects.create_user('st_statement_staff', password='pass', role='receptionist')
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_cached_until_bills_change(self):
+        student = self.students[0]
+        with mock.patch.object(statements, 'render', wraps=statements.render) as render:
+            name, pdf = statements.get_pdf(student.pk)
+            self.assertEqual(name, 'statement-HU-UGR-2023-81000.pdf')
+            self.assertTrue(pdf.startswith(b'%PDF'))
+            self.assertEqual(statements.get_pdf(student.pk), (name, pdf))
+            self.assertEqual(render.call_count, 1)
+
+            self.bill.status = 'Paid'
+            self.bill.save()
+            self.assertNotEqual(statements.get_pdf(student.pk)[1], pdf)
+            self.assertEqual(render.call_count, 2)
+        self.assertIsNone(statements.get_pdf(0))
+
+    def test_issue_date_is_part_of_the_hash(self):
+        pk = self.students[0].pk
+        today, tomorrow = datetime.date(2030, 1, 7), datetime.date(2030, 1, 8)
+        digest = {day: statements.content_hash(statements.load([pk], today=day)[pk]) for day in (today, tomorrow)}
+        self.assertEqual(statements.load([pk], today=today)[pk]['issued'], '2030-01-07')
+        self.assertEqual(statements.content_hash(statements.load([pk], today=today)[pk]), digest[today])
+        self.assertNotEqual(digest[today], digest[tomorrow])
+
+    def test_markup_characters_in_text_are_escaped(self):
+        student = self.students[2]
+        student.user.first_name, student.user.last_name = 'Abebe <i>', '& Sons'
+        student.user.save()
+        Bill.objects.create(student=student, service='X-ray <b> & scan', amount=Decimal('10.00'))
+        _, pdf = statements.get_pdf(student.pk)
+        self.assertTrue(pdf.startswith(b'%PDF'))
+
+    def test_archive_reuses_cache(self):
+        statements.get_pdf(self.students[0].pk)
+        ids = [student.pk for student in self.students]
+        buffer = BytesIO()
+        self.assertEqual(statements.build_archive(ids, buffer, workers=1, chunk_size=2), (3, 2))
+        with zipfile.ZipFile(buffer) as archive:
+            self.assertEqual(sorted(archive.namelist()), [f'statement-HU-UGR-2023-8100{i}.pdf' for i in range(3)])
+            self.assertEqual(archive.read('statement-HU-UGR-2023-81000.pdf'),
+                             statements.get_pdf(self.students[0].pk)[1])
+        self.assertEqual(statements.build_archive(ids, BytesIO(), workers=1), (3, 0))
+
+    def test_command_renders_in_pool(self):
+        output = os.path.join(tempfile.mkdtemp(), 'statements.zip')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        out = StringIO()
+        call_command('generate_statements', output=output, owing=True, workers=2, stdout=out)
+        self.assertIn('Statements: 2 (2 rendered, 0 from cache)', out.getvalue())
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(sorted(archive.namelist()),
+                             ['statement-HU-UGR-2023-81000.pdf', 'statement-HU-UGR-2023-81001.pdf'])
+
+        with self.assertRaisesMessage(CommandError, 'Unknown student IDs: NOPE'):
+            call_command('generate_statements', output=output, student=['NOPE'], stdout=StringIO())
+
+    def test_statement_views(self):
+        self.client.login(username='st_statement1', password='pass')
+        response = self.client.get(reverse('my_statement'))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('statement-HU-UGR-2023-81001.pdf', response['Content-Disposition'])
+        # Students cannot fetch someone else's statement
+        self.assertRedirects(self.client.get(reverse('student_statement', args=[self.students[0].pk])),
+                             reverse('dashboard'), fetch_redirect_response=False)
+
+        self.client.login(username='st_statement_staff', password='pass')
+        response = self.client.get(reverse('student_statement', args=[self.students[0].pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(reverse('student_statement', args=[0])).status_code, 404)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PaymentImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.students = [
+            StudentProfile.objects.create(
+                user=User.objects.create_user(f'st_payment{i}', role='student'),
+                student_id=f'HU-UGR-2023-8200{i}', college='CBE', department='Economics', gender='F', year=2
+            )
+            for i in range(2)
+        ]
+        cls.bills = [
+            Bill.objects.create(student=cls.students[i % 2], service='Consultation', amount=Decimal('20.00'),
+                                external_id=f'BILL-9900{i}')
+            for i in range(4)
+        ]
+        cls.bills[3].status = 'Paid'
+        cls.bills[3].save()
+        User.objects.create_user('st_payment_admin', password='pass', role='admin', is_staff=True)
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def payment_file(self):
+        return BytesIO('\n'.join([
+            'bill_id,amount,reference',
+            'BILL-99000,20.00,TX-1',
+            f'{self.bills[1].pk},20,TX-2',
+            'BILL-99002,25.00,TX-3',   # Wrong amount
+            'BILL-99003,20.00,TX-4',   # Paid already
+            'BILL-00000,20.00,TX-5',   # No such bill
+            'BILL-99000,20.00,TX-6',   # Listed twice (already paid if in a later chunk)
+            'BILL-99002,twenty,TX-7',
+        ]).encode())
+
+    def test_apply(self):
+        exceptions = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            counts = payments.apply(self.payment_file(), exceptions, chunk_size=3)
+        self.assertEqual(counts, {
+            payments.PAID: 2, payments.UNKNOWN: 1, payments.MISMATCH: 1, payments.ALREADY_PAID: 2,
+            payments.DUPLICATE: 0, payments.INVALID: 1,
+        })
+        self.assertEqual(list(Bill.objects.filter(pk__in=[b.pk for b in self.bills]).order_by('pk')
+                              .values_list('status', flat=True)), ['Paid', 'Paid', 'Pending', 'Paid'])
+
+        # Both payments went through the ledger, per bill
+        self.assertEqual(ledger.balance(self.students[0].pk), Decimal('20.00'))
+        self.assertEqual(ledger.balance(self.students[1].pk), Decimal('0.00'))
+        self.assertEqual(self.bills[1].ledger_entries.get(kind='payment').note, 'Payment TX-2')
+        self.assertEqual(ledger.reconcile(fix=False), [])
+
+        rows = list(csv.reader(StringIO(exceptions.getvalue())))
+        self.assertEqual(rows[0], payments.EXCEPTION_COLUMNS)
+        self.assertEqual([(row[1], row[4]) for row in rows[1:]], [
+            ('BILL-99002', 'amount mismatch'), ('BILL-99003', 'already paid'), ('BILL-00000', 'unknown bill'),
+            ('BILL-99000', 'already paid'), ('BILL-99002', 'invalid amount'),
+        ])
+        self.assertEqual(rows[1][5:], ['20.00', 'Pending'])
+
+        with self.assertRaisesMessage(ValueError, 'missing columns: amount'):
+            payments.apply(BytesIO(b'bill_id\nBILL-99002\n'), StringIO())
+
+    def test_timelines_and_rollups_follow_each_chunk(self):
+        day = self.bills[0].date
+        rollups.rebuild(day, day, ['bills'])
+        outstanding = lambda: [timeline.get_summary(student.pk)['outstanding'] for student in self.students]
+        self.assertEqual(outstanding(), [Decimal('40.00'), Decimal('20.00')])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            payments.apply(self.payment_file(), StringIO(), chunk_size=3)
+        self.assertEqual({status: count for status, count, _ in rollups.totals('bills_by_status', day, day)},
+                         {'Pending': 1, 'Paid': 3})
+        self.assertEqual(outstanding(), [Decimal('20.00'), Decimal('0.00')])
+
+    def test_chunk_is_set_based(self):
+        # Lookup, bill UPDATE, ledger entries, balance UPDATE, plus the savepoint
+        with self.assertNumQueries(6):
+            payments.apply(self.payment_file(), StringIO())
+
+    def test_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'payments.csv')
+        with open(path, 'wb') as f:
+            f.write(self.payment_file().getvalue())
+        out = StringIO()
+        call_command('import_payments', path, exceptions=os.path.join(directory, 'out.csv'), stdout=out)
+        self.assertIn('Paid: 2', out.getvalue())
+        self.assertIn('Duplicate in file: 1', out.getvalue())
+        with open(os.path.join(directory, 'out.csv')) as f:
+            self.assertEqual(len(f.readlines()), 6)
+
+    def test_upload(self):
+        self.client.login(username='st_payment_admin', password='pass')
+        self.assertEqual(self.client.get(reverse('import_payments')).status_code, 200)
+        upload = SimpleUploadedFile('payments.csv', self.payment_file().getvalue(), content_type='text/csv')
+        response = self.client.post(reverse('import_payments'), {'file': upload})
+        self.assertContains(response, 'Download exceptions')
+        self.assertIn(('amount mismatch', 1), response.context['counts'])
+
+        download = self.client.get(reverse('payment_exceptions', args=[response.context['exceptions']]))
+        self.assertIn(b'BILL-00000', b''.join(download.streaming_content))
+        self.assertEqual(self.client.get(reverse('payment_exceptions', args=['nope.csv'])).status_code, 404)
+
+        # Not for clinic staff outside the admin site
+        self.client.force_login(User.objects.create_user('st_payment_nurse', role='nurse'))
+        self.assertRedirects(self.client.get(reverse('import_payments')), reverse('dashboard'),
+                             fetch_redirect_response=False)
@@ -0,0 +1,9 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('statement/', views.my_statement, name='my_statement'),
+    path('statement/<int:student_pk>/', views.student_statement, name='student_statement'),
+    path('payments/import/', views.import_payments, name='import_payments'),
+    path('payments/exceptions/<str:name>/', views.payment_exceptions, name='payment_exceptions'),
+]
@@ -1,3 +1,86 @@
-from django.shortcuts import render
+import gzip
+import tempfile
+import uuid
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
+from django.shortcuts import redirect, render
+from django.utils import timezone
+from . import payments, statements
+from .forms import PaymentImportForm
 
-# Create your views here.
+EXCEPTIONS_PREFIX = 'payments'
+
+@login_required
+def my_statement(request):
+    """Student downloads their own billing statement"""
+    if not request.user.is_student():
+        messages.error(request, 'Access denied.')
+        return redirect('dashboard')
+    return _statement_response(request.user.student_profile.pk)
+
+@login_required
+def student_statement(request, student_pk):
+    """Staff download a student's billing statement"""
+    if not request.user.is_staff_member():
+        messages.error(request, 'Access denied.')
+        return redirect('dashboard')
+    return _statement_response(student_pk)
+
+def _statement_response(student_pk):
+    # Served from the same content-addressed cache as generate_statements
+    result = statements.get_pdf(student_pk)
+    if result is None:
+        raise Http404('No such student')
+    filename, pdf = result
+    response = HttpResponse(pdf, content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@login_required
+def import_payments(request):
+    """Admin staff upload a finance office payment file and mark the matching bills Paid"""
+    # Bills are otherwise only settled in the admin site, so this is for the same staff
+    if not request.user.is_staff:
+        messages.error(request, 'Access denied.')
+        return redirect('dashboard')
+
+    counts = exceptions = None
+    if request.method == 'POST':
+        form = PaymentImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            source = gzip.GzipFile(fileobj=upload) if upload.name.endswith('.gz') else upload
+            with tempfile.TemporaryFile('w+', newline='') as report:
+                try:
+                    counts = payments.apply(source, report)
+                except (ValueError, OSError) as e:
+                    form.add_error('file', str(e))
+                else:
+                    if sum(counts.values()) > counts[payments.PAID]:
+                        report.seek(0)
+                        name = f"exceptions-{timezone.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}.csv"
+                        exceptions = default_storage.save(f'{EXCEPTIONS_PREFIX}/{name}', File(report)).rsplit('/', 1)[-1]
+                    messages.success(request, f"{counts[payments.PAID]} bill(s) marked Paid.")
+    else:
+        form = PaymentImportForm()
+
+    return render(request, 'billing/import_payments.html', {
+        'form': form,
+        'counts': [(outcome, counts[outcome]) for outcome in payments.OUTCOMES] if counts else None,
+        'exceptions': exceptions,
+    })
+
+@login_required
+def payment_exceptions(request, name):
+    """Download the exceptions file of an earlier payment import"""
+    if not request.user.is_staff:
+        messages.error(request, 'Access denied.')
+        return redirect('dashboard')
+    path = f'{EXCEPTIONS_PREFIX}/{name}'
+    if not name.endswith('.csv') or not default_storage.exists(path):
+        raise Http404('No such exceptions file')
+    return FileResponse(default_storage.open(path, 'rb'), as_attachment=True, filename=f'payment-{name}',
+                        content_type='text/csv')
@@ -6,6 +6,8 @@ pip install -r requirements.txt
 
 python manage.py collectstatic --no-input
 python manage.py migrate
+# Shared cache table for CACHE_TABLE (does nothing if it is unset or exists)
+python manage.py createcachetable
 
 # Automatically create admin user
 python create_admin.py
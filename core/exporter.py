@@ -0,0 +1,222 @@
+"""
+Streaming export of clinical tables for offline analysis
+Used by the export_table management command and the staff export view
+
+Each table is read with one query joined to the student's demographics
+(student_id, college, department, gender, year; never names or phone
+numbers). Rows are fetched chunk_size at a time through iterator(), which
+uses a server-side cursor on PostgreSQL. Every chunk is encoded and handed
+on as bytes before the next one is read, so memory stays flat however
+large the table is:
+
+* csv      gzip-compressed CSV, one compressor shared by all chunks
+* parquet  one row group per chunk (needs pyarrow)
+* arrow    Arrow IPC file, one record batch per chunk (needs pyarrow)
+"""
+import csv
+import io
+import zlib
+from typing import NamedTuple
+
+from appointments.models import Appointment
+from billing.models import Bill
+from lab.models import LabTest
+from medical.models import Consultation
+from pharmacy.models import DispenseRecord
+
+EXPORT_CHUNK_SIZE = 20000
+CSV_COMPRESSION_LEVEL = 6
+PARQUET_COMPRESSION = 'zstd'
+
+
+class Column(NamedTuple):
+    name: str
+    lookup: str
+    kind: str  # int, str, date, time, decimal or bool
+
+
+DEMOGRAPHICS = [
+    Column('student_id', 'student__student_id', 'str'),
+    Column('college', 'student__college', 'str'),
+    Column('department', 'student__department', 'str'),
+    Column('gender', 'student__gender', 'str'),
+    Column('year', 'student__year', 'int'),
+]
+
+TABLES = {
+    'appointments': (Appointment, [
+        Column('id', 'id', 'int'),
+        Column('external_id', 'external_id', 'str'),
+        Column('date', 'date', 'date'),
+        Column('time', 'time', 'time'),
+        Column('status', 'status', 'str'),
+        Column('doctor', 'doctor__username', 'str'),
+        Column('reason', 'reason', 'str'),
+    ]),
+    'consultations': (Consultation, [
+        Column('id', 'id', 'int'),
+        Column('external_id', 'external_id', 'str'),
+        Column('appointment_id', 'appointment_id', 'int'),
+        Column('date', 'date', 'date'),
+        Column('doctor', 'doctor__username', 'str'),
+        Column('symptoms', 'symptoms', 'str'),
+        Column('diagnosis', 'diagnosis', 'str'),
+        Column('diagnosis_code', 'diagnosis_code__code', 'str'),
+        Column('notes', 'notes', 'str'),
+    ]),
+    'lab_tests': (LabTest, [
+        Column('id', 'id', 'int'),
+        Column('external_id', 'external_id', 'str'),
+        Column('date', 'date', 'date'),
+        Column('test_type', 'test_type', 'str'),
+        Column('result', 'result', 'str'),
+        Column('is_completed', 'is_completed', 'bool'),
+        Column('technician', 'technician__username', 'str'),
+    ]),
+    'bills': (Bill, [
+        Column('id', 'id', 'int'),
+        Column('external_id', 'external_id', 'str'),
+        Column('date', 'date', 'date'),
+        Column('service', 'service', 'str'),
+        Column('amount', 'amount', 'decimal'),
+        Column('status', 'status', 'str'),
+    ]),
+    'dispenses': (DispenseRecord, [
+        Column('id', 'id', 'int'),
+        Column('external_id', 'external_id', 'str'),
+        Column('date', 'date', 'date'),
+        Column('drug', 'drug__name', 'str'),
+        Column('quantity', 'quantity', 'int'),
+        Column('pharmacist', 'pharmacist__username', 'str'),
+    ]),
+}
+
+# format -> (file extension, content type)
+FORMATS = {
+    'csv': ('.csv.gz', 'application/gzip'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file'),
+}
+
+
+class Spool:
+    """Write-only file object for pyarrow writers; drain() takes out what was written so far"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+class TableExport:
+    """
+    Iterating yields the encoded bytes of table, chunk by chunk. rows counts
+    the rows exported so far. Raises ValueError up front for an unknown
+    table or format, or when the format needs pyarrow and it is missing.
+    """
+
+    def __init__(self, table, fmt='csv', start=None, end=None, chunk_size=EXPORT_CHUNK_SIZE):
+        if table not in TABLES:
+            raise ValueError(f"Unknown table '{table}'. Choose from: {', '.join(TABLES)}")
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format '{fmt}'. Choose from: {', '.join(FORMATS)}")
+        if fmt != 'csv':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ValueError(f"Exporting {fmt} files needs pyarrow (pip install pyarrow).")
+
+        self.table = table
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        model, columns = TABLES[table]
+        self.columns = columns + DEMOGRAPHICS
+        queryset = model.objects.order_by('pk')
+        if start:
+            queryset = queryset.filter(date__gte=start)
+        if end:
+            queryset = queryset.filter(date__lte=end)
+        self.queryset = queryset.values_list(*[column.lookup for column in self.columns])
+        self.rows = 0
+
+    @property
+    def filename(self):
+        return self.table + FORMATS[self.fmt][0]
+
+    @property
+    def content_type(self):
+        return FORMATS[self.fmt][1]
+
+    def chunks(self):
+        chunk = []
+        for row in self.queryset.iterator(self.chunk_size):
+            chunk.append(row)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def __iter__(self):
+        return self._csv() if self.fmt == 'csv' else self._arrow()
+
+    def _csv(self):
+        compressor = zlib.compressobj(CSV_COMPRESSION_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip container
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow([column.name for column in self.columns])
+        for chunk in self.chunks():
+            writer.writerows(chunk)
+            self.rows += len(chunk)
+            data = compressor.compress(text.getvalue().encode())
+            text.seek(0)
+            text.truncate()
+            if data:
+                yield data
+        yield compressor.compress(text.getvalue().encode()) + compressor.flush()
+
+    def _arrow(self):
+        import pyarrow as pa
+        import pyarrow.ipc as pa_ipc
+        import pyarrow.parquet as pq
+
+        types = {
+            'int': pa.int64(), 'str': pa.string(), 'date': pa.date32(), 'time': pa.time64('us'),
+            'decimal': pa.decimal128(12, 2), 'bool': pa.bool_(),
+        }
+        schema = pa.schema([(column.name, types[column.kind]) for column in self.columns])
+        spool = Spool()
+        sink = pa.PythonFile(spool, mode='w')
+        if self.fmt == 'parquet':
+            writer = pq.ParquetWriter(sink, schema, compression=PARQUET_COMPRESSION)
+        else:
+            writer = pa_ipc.new_file(sink, schema)
+
+        for chunk in self.chunks():
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            self.rows += len(chunk)
+            data = spool.drain()
+            if data:
+                yield data
+        writer.close()
+        yield spool.drain()
@@ -0,0 +1,1123 @@
+"""
+Bulk import engines for health record CSV files
+Used by the import_csv management command
+
+Rows are upserted on the CSV's natural keys (appointment_id,
+consultation_id, lab_test_id, bill_id), so re-running an import, or
+resuming one from a checkpoint, never duplicates records.
+
+PharmacyImporter loads the drugs, prescriptions and dispenses files that
+generate_large_dataset.py --mode visits writes next to the visits CSV.
+"""
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+import zlib
+from datetime import datetime
+from decimal import Decimal
+from functools import cached_property, lru_cache
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, connection, transaction
+
+from accounts import directory
+from analytics import reports
+
+from students.models import StudentProfile
+from appointments.models import Appointment, AppointmentSlot
+from appointments import slots
+from medical.models import Consultation
+from lab.models import LabTest
+from billing.models import Bill
+from billing import ledger
+from pharmacy.models import Drug, DispenseRecord
+from pharmacy.catalog import catalog
+from medical.models import Prescription
+from medical import timeline
+from medical.diagnoses import DiagnosisMatcher
+
+User = get_user_model()
+
+DEFAULT_BATCH_SIZE = 1000
+
+APPOINTMENT_ORDER_FILE = 'appointment_order.txt'
+
+# CSV test names -> LabTest.TEST_TYPES keys
+TEST_TYPE_MAP = {
+    'Malaria': 'Malaria',
+    'Urine Test': 'Urine',
+    'Blood Test': 'Blood',
+    'TB Test': 'TB',
+    'CBC': 'CBC'
+}
+
+COUNTERS = ('students', 'appointments', 'consultations', 'lab_tests', 'bills', 'updated')
+
+# What a bad row can raise; anything else is the database failing, not the data
+DATA_ERRORS = (IntegrityError, DataError, ValueError, ValidationError)
+
+CSV_COLUMNS = [
+    'student_id', 'full_name', 'college', 'department', 'phone', 'gender', 'year',
+    'appointment_id', 'appointment_doctor', 'appointment_date', 'appointment_time',
+    'appointment_reason', 'appointment_status',
+    'consultation_id', 'symptoms', 'diagnosis', 'consultation_doctor', 'consultation_date',
+    'lab_test_id', 'test_type', 'test_result', 'lab_technician', 'lab_date',
+    'bill_id', 'service', 'amount', 'bill_status', 'bill_date'
+]
+
+REQUIRED_KEYS = ('student_id', 'appointment_id', 'lab_test_id', 'bill_id')
+
+DRUG_COLUMNS = ['name', 'unit', 'stock', 'expiry_date']
+PRESCRIPTION_COLUMNS = ['prescription_id', 'consultation_id', 'drug_name', 'dosage', 'instructions']
+DISPENSE_COLUMNS = ['dispense_id', 'student_id', 'drug_name', 'quantity', 'pharmacist', 'date']
+
+PHARMACY_COUNTERS = ('drugs', 'prescriptions', 'dispenses', 'updated', 'skipped')
+
+COPY_BUFFER_SIZE = 1024 * 1024
+# (text, code) pairs per UPDATE, well under PostgreSQL's 65535 bind parameters
+DIAGNOSIS_CHUNK_SIZE = 10000
+
+COLUMNAR_EXTENSIONS = ('.parquet', '.arrow')
+COLUMNAR_BATCH_SIZE = 10000
+
+# Extra leading column in shard files so rejects report the original row number
+SOURCE_ROW_COLUMN = 'source_row'
+
+
+def student_username(student_id):
+    return student_id.lower().replace('-', '_')
+
+
+def doctor_username(name):
+    return name.lower().replace(' ', '_').replace('.', '')
+
+
+def technician_username(name):
+    return name.lower().replace(' ', '_')
+
+
+def pharmacist_username(name):
+    return name.lower().replace(' ', '_')
+
+
+# Dates and times repeat heavily across rows (a year of days, a half-hour grid)
+@lru_cache(maxsize=4096)
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+@lru_cache(maxsize=256)
+def parse_time(value):
+    return datetime.strptime(value, '%H:%M').time()
+
+
+def parse_row(row):
+    """Convert one CSV row into the plain values needed for insertion"""
+    for key in REQUIRED_KEYS:
+        if not row.get(key):
+            raise ValueError(f"missing {key}")
+
+    full_name = row['full_name']
+    name_parts = full_name.split(' ', 1)
+    has_consultation = bool(row['consultation_id'])
+    visit_date = parse_date(row['appointment_date'])
+
+    return {
+        'student_id': row['student_id'],
+        'first_name': name_parts[0],
+        'last_name': name_parts[1] if len(name_parts) > 1 else '',
+        'college': row['college'],
+        'department': row['department'],
+        'gender': row['gender'],
+        'year': int(row['year']),
+        'appointment_id': row['appointment_id'],
+        'doctor': row['appointment_doctor'],
+        'date': visit_date,
+        'time': parse_time(row['appointment_time']),
+        'reason': row['appointment_reason'],
+        'status': row['appointment_status'],
+        'consultation_id': row['consultation_id'] or None,
+        'consultation_doctor': row['consultation_doctor'] if has_consultation else None,
+        'symptoms': row['symptoms'],
+        'diagnosis': row['diagnosis'],
+        'consultation_date': parse_date(row['consultation_date']) if row['consultation_date'] else visit_date,
+        'lab_test_id': row['lab_test_id'],
+        'technician': row['lab_technician'],
+        'test_type': TEST_TYPE_MAP.get(row['test_type'], 'Other'),
+        'test_result': row['test_result'],
+        'lab_date': parse_date(row['lab_date']) if row['lab_date'] else visit_date,
+        'bill_id': row['bill_id'],
+        'service': row['service'],
+        'amount': Decimal(row['amount']),
+        'bill_status': row['bill_status'],
+        'bill_date': parse_date(row['bill_date']) if row['bill_date'] else visit_date,
+    }
+
+
+class CsvSource:
+    """
+    Streams CSV rows from a path, a gzip file (*.gz) or stdin ('-').
+
+    `offset` is the byte position just past the last row read (in the
+    decompressed stream for gzip input), which is what checkpoints store.
+    """
+
+    def __init__(self, path, offset=0):
+        self.path = path
+        if path == '-':
+            self.file = sys.stdin.buffer
+        elif path.endswith('.gz'):
+            self.file = gzip.open(path, 'rb')
+        else:
+            self.file = open(path, 'rb')
+
+        header_line = self.file.readline()
+        self.header = next(csv.reader([header_line.decode('utf-8-sig')]), [])
+        self.offset = len(header_line)
+
+        if offset > self.offset:
+            if not self.resumable:
+                raise ValueError("Cannot resume an import read from stdin.")
+            self.file.seek(offset)
+            self.offset = offset
+
+    @property
+    def resumable(self):
+        return self.path != '-'
+
+    def missing_columns(self, columns=CSV_COLUMNS):
+        return sorted(set(columns) - set(self.header))
+
+    def _lines(self):
+        for line in self.file:
+            self.offset += len(line)
+            yield line.decode('utf-8')
+
+    def __iter__(self):
+        for values in csv.reader(self._lines()):
+            yield dict(zip(self.header, values))
+
+    def close(self):
+        if self.file is not sys.stdin.buffer:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ColumnarSource:
+    """
+    Streams rows from a Parquet (*.parquet) or Arrow IPC (*.arrow) file, as
+    written by generate_large_dataset.py --mode numpy. Needs pyarrow.
+
+    Values are converted to strings so rows look exactly like CSV rows.
+    `offset` counts rows, so checkpoints resume by skipping that many.
+    """
+
+    resumable = True
+
+    def __init__(self, path, offset=0):
+        try:
+            import pyarrow.ipc as pa_ipc
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Reading Parquet / Arrow files needs pyarrow (pip install pyarrow).")
+
+        self.path = path
+        if path.endswith('.parquet'):
+            self.file = pq.ParquetFile(path)
+            self.header = self.file.schema_arrow.names
+            self._batches = self.file.iter_batches(batch_size=COLUMNAR_BATCH_SIZE)
+        else:
+            self.file = pa_ipc.open_file(path)
+            self.header = self.file.schema.names
+            self._batches = (self.file.get_batch(i) for i in range(self.file.num_record_batches))
+        self.offset = 0
+        self.skip = offset
+
+    def missing_columns(self, columns=CSV_COLUMNS):
+        return sorted(set(columns) - set(self.header))
+
+    def __iter__(self):
+        for batch in self._batches:
+            if self.offset + batch.num_rows <= self.skip:
+                self.offset += batch.num_rows
+                continue
+            columns = [
+                ['' if value is None else str(value) for value in column.to_pylist()]
+                for column in batch.columns
+            ]
+            for values in zip(*columns):
+                self.offset += 1
+                if self.offset <= self.skip:
+                    continue
+                yield dict(zip(self.header, values))
+
+    def close(self):
+        if hasattr(self.file, 'close'):
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_source(path, offset=0):
+    """Pick the row source for a path: Parquet / Arrow IPC by extension, otherwise CSV"""
+    if path.endswith(COLUMNAR_EXTENSIONS):
+        return ColumnarSource(path, offset)
+    return CsvSource(path, offset)
+
+
+class Checkpoint:
+    """JSON file recording how far an import has committed"""
+
+    def __init__(self, path, source_path):
+        self.path = path
+        self.source = os.path.abspath(source_path)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state['source'] != self.source:
+            raise ValueError(f"Checkpoint {self.path} belongs to {state['source']}, not {self.source}.")
+        return state
+
+    def save(self, offset, rows, counts):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'source': self.source, 'offset': offset, 'rows': rows, 'counts': counts}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class RejectWriter:
+    """Appends rejected rows, with their row number and error, to a CSV file"""
+
+    def __init__(self, path, header, append=False):
+        exists = append and os.path.exists(path)
+        self.file = open(path, 'a' if exists else 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.header = header
+        self.count = 0
+        if not exists:
+            self.writer.writerow(['row', 'error', *header])
+
+    def write(self, row_no, row, error):
+        self.writer.writerow([row_no, error, *(row.get(c, '') for c in self.header)])
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class BulkImporter:
+    """
+    Loads CSV rows in chunks, one transaction per chunk.
+
+    Each chunk resolves its students, doctors and technicians with a few
+    set-based lookups, then upserts every entity type with a single
+    bulk_create keyed on external_id. Only compact key -> pk maps are
+    kept between chunks. Each chunk re-claims its appointments' slots
+    unless claim_slots is False, in which case the caller runs
+    reclaim_slots() itself. If a chunk fails on bad data it is retried row
+    by row so only the offending rows are rejected. Any other error (a
+    lost connection, a lock timeout, a full disk) is raised before the
+    checkpoint moves, so --resume picks the chunk up again.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, on_batch=None, on_reject=None,
+                 checkpoint=None, rejects=None, staff_pks=None, claim_slots=True):
+        if not connection.features.supports_update_conflicts_with_target:
+            raise RuntimeError(
+                f"Bulk import needs a database that supports keyed upserts; "
+                f"'{connection.vendor}' does not."
+            )
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.on_reject = on_reject
+        self.checkpoint = checkpoint
+        self.rejects = rejects
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.rows_read = 0
+        self.student_pks = {}
+        self.staff_pks = dict(staff_pks or {})
+        self.known_staff = dict(self.staff_pks)
+        self.claim_slots = claim_slots
+
+    @cached_property
+    def diagnoses(self):
+        return DiagnosisMatcher()
+
+    def run(self, source, start_row=0, counts=None):
+        """Import every row of a CsvSource, returning the per-entity counters"""
+        missing = source.missing_columns()
+        if missing:
+            raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+        if counts:
+            self.counts.update(counts)
+
+        batch = []
+        batch_no = 0
+        row_no = start_row
+
+        for row_no, row in enumerate(source, start_row + 1):
+            try:
+                batch.append((row_no, row, parse_row(row)))
+            except Exception as e:
+                self._reject(row_no, row, e)
+                continue
+
+            if len(batch) >= self.batch_size:
+                batch_no += 1
+                self._flush(batch, batch_no, source.offset, row_no)
+                batch = []
+
+        batch_no += 1
+        self._flush(batch, batch_no, source.offset, row_no)
+        self.rows_read = row_no - start_row
+        # bulk_create sends no post_save, so cached patient timelines and reports are stale
+        timeline.invalidate_all()
+        reports.invalidate()
+        return self.counts
+
+    def _reject(self, row_no, row, error):
+        row_no = int(row.get(SOURCE_ROW_COLUMN, row_no))
+        if self.rejects:
+            self.rejects.write(row_no, row, str(error))
+        if self.on_reject:
+            self.on_reject(row_no, error)
+
+    def _flush(self, batch, batch_no, offset, last_row):
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                counts = self._write([parsed for _, _, parsed in batch])
+        except DATA_ERRORS:
+            self._reset_caches()
+            counts = self._write_row_by_row(batch)
+
+        for key, value in counts.items():
+            self.counts[key] += value
+
+        if self.rejects:
+            self.rejects.flush()
+        if self.checkpoint:
+            self.checkpoint.save(offset, last_row, self.counts)
+        if self.on_batch and batch:
+            self.on_batch(batch_no, len(batch), time.perf_counter() - started)
+
+    def _write_row_by_row(self, batch):
+        counts = dict.fromkeys(COUNTERS, 0)
+        for row_no, row, parsed in batch:
+            try:
+                with transaction.atomic():
+                    row_counts = self._write([parsed])
+            except DATA_ERRORS as e:
+                self._reset_caches()
+                self._reject(row_no, row, e)
+                continue
+            for key, value in row_counts.items():
+                counts[key] += value
+        return counts
+
+    def _reset_caches(self):
+        # A rolled-back write may have cached pks of rows that no longer exist
+        self.student_pks.clear()
+        self.staff_pks = dict(self.known_staff)
+
+    def _write(self, batch):
+        counts = dict.fromkeys(COUNTERS, 0)
+        if not batch:
+            return counts
+        counts['students'] = self._resolve_students(batch)
+
+        doctors = {r['doctor'] for r in batch}
+        doctors.update(r['consultation_doctor'] for r in batch if r['consultation_doctor'])
+        for name in doctors:
+            self._staff_pk(name, 'doctor')
+        for name in {r['technician'] for r in batch}:
+            self._staff_pk(name, 'lab_tech')
+
+        counts['appointments'], updated = self._upsert(Appointment, [
+            Appointment(
+                external_id=r['appointment_id'],
+                student_id=self.student_pks[r['student_id']],
+                doctor_id=self.staff_pks[('doctor', r['doctor'])],
+                date=r['date'],
+                time=r['time'],
+                reason=r['reason'],
+                status=r['status']
+            )
+            for r in batch
+        ], ['student', 'doctor', 'date', 'time', 'reason', 'status'])
+        counts['updated'] += updated
+
+        if self.claim_slots:
+            appointment_pks = reclaim_slots([r['appointment_id'] for r in batch])
+        else:
+            appointment_pks = dict(Appointment.objects.filter(
+                external_id__in=[r['appointment_id'] for r in batch]
+            ).values_list('external_id', 'pk'))
+
+        # Consultations attach to their appointment through its natural key
+        with_consultation = [r for r in batch if r['consultation_id']]
+
+        counts['consultations'], updated = self._upsert(Consultation, [
+            Consultation(
+                external_id=r['consultation_id'],
+                appointment_id=appointment_pks[r['appointment_id']],
+                student_id=self.student_pks[r['student_id']],
+                doctor_id=self.staff_pks[('doctor', r['consultation_doctor'])],
+                symptoms=r['symptoms'],
+                diagnosis=r['diagnosis'],
+                diagnosis_code_id=self.diagnoses.match(r['diagnosis']),
+                date=r['consultation_date']
+            )
+            for r in with_consultation
+        ], ['appointment', 'student', 'doctor', 'symptoms', 'diagnosis', 'diagnosis_code', 'date'])
+        counts['updated'] += updated
+
+        counts['lab_tests'], updated = self._upsert(LabTest, [
+            LabTest(
+                external_id=r['lab_test_id'],
+                student_id=self.student_pks[r['student_id']],
+                test_type=r['test_type'],
+                result=r['test_result'],
+                technician_id=self.staff_pks[('lab_tech', r['technician'])],
+                date=r['lab_date'],
+                is_completed=True
+            )
+            for r in batch
+        ], ['student', 'test_type', 'result', 'technician', 'date', 'is_completed'])
+        counts['updated'] += updated
+
+        counts['bills'], updated = self._upsert(Bill, [
+            Bill(
+                external_id=r['bill_id'],
+                student_id=self.student_pks[r['student_id']],
+                service=r['service'],
+                amount=r['amount'],
+                date=r['bill_date'],
+                status=r['bill_status']
+            )
+            for r in batch
+        ], ['student', 'service', 'amount', 'date', 'status'])
+        counts['updated'] += updated
+        # bulk_create bypasses the ledger receivers; recompute these students' balances
+        ledger.reconcile({self.student_pks[r['student_id']] for r in batch})
+
+        return counts
+
+    @staticmethod
+    def _upsert(model, objects, update_fields):
+        """Insert or update objects on external_id, returning (created, updated)"""
+        if not objects:
+            return 0, 0
+        # The last occurrence of a key within one chunk wins
+        objects = list({obj.external_id: obj for obj in objects}.values())
+        existing = model.objects.filter(
+            external_id__in=[obj.external_id for obj in objects]
+        ).count()
+        model.objects.bulk_create(
+            objects,
+            update_conflicts=True,
+            unique_fields=['external_id'],
+            update_fields=update_fields
+        )
+        return len(objects) - existing, existing
+
+    def _resolve_students(self, batch):
+        """Fill student_pks for every student in the batch, returning how many profiles were created"""
+        pending = {}
+        for r in batch:
+            if r['student_id'] not in self.student_pks:
+                pending.setdefault(r['student_id'], r)
+        if not pending:
+            return 0
+
+        self.student_pks.update(
+            StudentProfile.objects.filter(student_id__in=pending).values_list('student_id', 'pk')
+        )
+        missing = [r for sid, r in pending.items() if sid not in self.student_pks]
+        if not missing:
+            return 0
+
+        usernames = {student_username(r['student_id']): r for r in missing}
+        existing_users = set(
+            User.objects.filter(username__in=usernames).values_list('username', flat=True)
+        )
+        User.objects.bulk_create([
+            User(
+                username=username,
+                first_name=r['first_name'],
+                last_name=r['last_name'],
+                role='student'
+            )
+            for username, r in usernames.items()
+            if username not in existing_users
+        ])
+        user_pks = dict(
+            User.objects.filter(username__in=usernames).values_list('username', 'pk')
+        )
+
+        StudentProfile.objects.bulk_create([
+            StudentProfile(
+                user_id=user_pks[student_username(r['student_id'])],
+                student_id=r['student_id'],
+                college=r['college'],
+                department=r['department'],
+                gender=r['gender'],
+                year=r['year']
+            )
+            for r in missing
+        ])
+        self.student_pks.update(
+            StudentProfile.objects.filter(
+                student_id__in=[r['student_id'] for r in missing]
+            ).values_list('student_id', 'pk')
+        )
+        return len(missing)
+
+    def _staff_pk(self, name, role):
+        key = (role, name)
+        if key not in self.staff_pks:
+            username = doctor_username(name) if role == 'doctor' else technician_username(name)
+            user, _ = User.objects.get_or_create(
+                username=username,
+                defaults={
+                    'first_name': name,
+                    'role': role
+                }
+            )
+            self.staff_pks[key] = user.pk
+        return self.staff_pks[key]
+
+
+def batched(rows, size):
+    """Yield lists of up to size rows"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class PharmacyImporter:
+    """
+    Loads drugs, prescriptions and dispense records in chunks.
+
+    Prescriptions attach to consultations, and dispenses to students, through
+    the natural keys of an earlier import_csv run; rows whose consultation or
+    student is unknown are counted as skipped. Drugs are matched on name.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.counts = dict.fromkeys(PHARMACY_COUNTERS, 0)
+        self.drug_pks = {}
+        self.pharmacist_pks = {}
+
+    def _run(self, name, source, columns, write):
+        """Call write(batch) for each chunk of source, one transaction per chunk"""
+        missing = source.missing_columns(columns)
+        if missing:
+            raise ValueError(f"{source.path} is missing columns: {', '.join(missing)}")
+        for batch_no, batch in enumerate(batched(source, self.batch_size), 1):
+            started = time.perf_counter()
+            with transaction.atomic():
+                write(batch)
+            if self.on_batch:
+                self.on_batch(name, batch_no, len(batch), time.perf_counter() - started)
+        timeline.invalidate_all()
+        return self.counts
+
+    def import_drugs(self, source):
+        counts = self._run('Drugs', source, DRUG_COLUMNS, self._write_drugs)
+        # bulk_update sends no post_save for the drug catalog to follow
+        catalog.reload()
+        return counts
+
+    def import_prescriptions(self, source):
+        self.drug_pks = dict(Drug.objects.values_list('name', 'pk'))
+        return self._run('Prescriptions', source, PRESCRIPTION_COLUMNS, self._write_prescriptions)
+
+    def import_dispenses(self, source):
+        self.drug_pks = dict(Drug.objects.values_list('name', 'pk'))
+        return self._run('Dispenses', source, DISPENSE_COLUMNS, self._write_dispenses)
+
+    def _write_drugs(self, batch):
+        rows = {row['name']: row for row in batch}
+        existing = {
+            drug.name: drug for drug in Drug.objects.filter(name__in=rows)
+        }
+        for name, drug in existing.items():
+            drug.unit = rows[name]['unit']
+            drug.stock = int(rows[name]['stock'])
+            drug.expiry_date = parse_date(rows[name]['expiry_date'])
+        Drug.objects.bulk_update(existing.values(), ['unit', 'stock', 'expiry_date'])
+        Drug.objects.bulk_create([
+            Drug(
+                name=name,
+                unit=row['unit'],
+                stock=int(row['stock']),
+                expiry_date=parse_date(row['expiry_date'])
+            )
+            for name, row in rows.items()
+            if name not in existing
+        ])
+        self.counts['drugs'] += len(rows) - len(existing)
+        self.counts['updated'] += len(existing)
+
+    def _write_prescriptions(self, batch):
+        consultation_pks = dict(
+            Consultation.objects.filter(
+                external_id__in={row['consultation_id'] for row in batch}
+            ).values_list('external_id', 'pk')
+        )
+        objects = [
+            Prescription(
+                external_id=row['prescription_id'],
+                consultation_id=consultation_pks[row['consultation_id']],
+                drug_id=self.drug_pks.get(row['drug_name']),
+                drug_name=row['drug_name'],
+                dosage=row['dosage'],
+                instructions=row['instructions'] or None
+            )
+            for row in batch
+            if row['prescription_id'] and row['consultation_id'] in consultation_pks
+        ]
+        self.counts['skipped'] += len(batch) - len(objects)
+        created, updated = BulkImporter._upsert(
+            Prescription, objects, ['consultation', 'drug', 'drug_name', 'dosage', 'instructions']
+        )
+        self.counts['prescriptions'] += created
+        self.counts['updated'] += updated
+
+    def _write_dispenses(self, batch):
+        student_pks = dict(
+            StudentProfile.objects.filter(
+                student_id__in={row['student_id'] for row in batch}
+            ).values_list('student_id', 'pk')
+        )
+        objects = [
+            DispenseRecord(
+                external_id=row['dispense_id'],
+                student_id=student_pks[row['student_id']],
+                drug_id=self.drug_pks[row['drug_name']],
+                quantity=int(row['quantity']),
+                pharmacist_id=self._pharmacist_pk(row['pharmacist']),
+                date=parse_date(row['date'])
+            )
+            for row in batch
+            if row['dispense_id'] and row['student_id'] in student_pks
+            and row['drug_name'] in self.drug_pks
+        ]
+        self.counts['skipped'] += len(batch) - len(objects)
+        created, updated = BulkImporter._upsert(
+            DispenseRecord, objects, ['student', 'drug', 'quantity', 'pharmacist', 'date']
+        )
+        self.counts['dispenses'] += created
+        self.counts['updated'] += updated
+
+    def _pharmacist_pk(self, name):
+        if not name:
+            return None
+        if name not in self.pharmacist_pks:
+            user, _ = User.objects.get_or_create(
+                username=pharmacist_username(name),
+                defaults={
+                    'first_name': name,
+                    'role': 'pharmacist'
+                }
+            )
+            self.pharmacist_pks[name] = user.pk
+        return self.pharmacist_pks[name]
+
+
+def shard_for(student_id, shards):
+    """Stable shard number for a student, so all of their rows land together"""
+    return zlib.crc32(student_id.encode('utf-8')) % shards
+
+
+def reclaim_slots(appointment_ids):
+    """
+    Give the appointments with these external ids their slots again, in
+    the order given; double bookings keep no slot. Returns the external id
+    -> pk map of the appointments found.
+    """
+    appointments = {
+        a.external_id: a for a in Appointment.objects.filter(
+            external_id__in=appointment_ids
+        ).only('pk', 'external_id', 'doctor_id', 'date', 'time', 'status')
+    }
+    AppointmentSlot.objects.filter(appointment__in=appointments.values()).delete()
+    slots.claim_existing(appointments[key] for key in appointment_ids if key in appointments)
+    return {key: a.pk for key, a in appointments.items()}
+
+
+def reclaim_slots_in_order(path, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Re-claim slots from the appointment order file partition() writes, one
+    transaction per batch_size ids, exactly as a single BulkImporter would.
+    Doctors see patients from every shard, so this runs once, after the
+    shards, to keep "first in the file wins" independent of worker timing.
+    """
+    with open(path, encoding='utf-8') as f:
+        while True:
+            batch = [line.rstrip('\n') for _, line in zip(range(batch_size), f)]
+            if not batch:
+                return
+            with transaction.atomic():
+                reclaim_slots(batch)
+
+
+def partition(source, directory, shards):
+    """
+    Split a CsvSource into per-shard CSV files under directory by hash of
+    student_id. Returns the shard paths and the doctor and technician names
+    seen, so staff can be created once before any worker starts. The
+    appointment ids are also written, in file order, to APPOINTMENT_ORDER_FILE
+    for reclaim_slots_in_order().
+    """
+    paths = [os.path.join(directory, f'shard_{i:03d}.csv') for i in range(shards)]
+    files = [open(path, 'w', newline='', encoding='utf-8') for path in paths]
+    writers = [csv.writer(f) for f in files]
+    order = open(os.path.join(directory, APPOINTMENT_ORDER_FILE), 'w', encoding='utf-8')
+    files.append(order)
+    for writer in writers:
+        writer.writerow([SOURCE_ROW_COLUMN, *source.header])
+
+    doctors, technicians = set(), set()
+    try:
+        for row_no, row in enumerate(source, 1):
+            doctors.add(row.get('appointment_doctor', ''))
+            if row.get('consultation_id'):
+                doctors.add(row.get('consultation_doctor', ''))
+            technicians.add(row.get('lab_technician', ''))
+            shard = shard_for(row.get('student_id', ''), shards)
+            writers[shard].writerow([row_no, *(row.get(c, '') for c in source.header)])
+            order.write(f"{row.get('appointment_id', '')}\n")
+    finally:
+        for f in files:
+            f.close()
+
+    doctors.discard('')
+    technicians.discard('')
+    return paths, doctors, technicians
+
+
+def create_staff(doctors, technicians):
+    """Create (or find) every doctor and technician up front, returning their pk map"""
+    staff_pks = {}
+    for role, names, to_username in (
+        ('doctor', doctors, doctor_username),
+        ('lab_tech', technicians, technician_username),
+    ):
+        for name in sorted(names):
+            user, _ = User.objects.get_or_create(
+                username=to_username(name),
+                defaults={
+                    'first_name': name,
+                    'role': role
+                }
+            )
+            staff_pks[(role, name)] = user.pk
+    return staff_pks
+
+
+def import_shard(path, batch_size, staff_pks, reject_path=None):
+    """
+    Process pool entry point: import one shard file on this process's own
+    database connection. Returns (counts, rows, elapsed seconds).
+    """
+    started = time.perf_counter()
+    rejects = None
+    with CsvSource(path) as source:
+        if reject_path:
+            rejects = RejectWriter(reject_path, source.header[1:])
+        try:
+            # Slots are claimed afterwards by reclaim_slots_in_order(), in one process
+            importer = BulkImporter(batch_size=batch_size, rejects=rejects, staff_pks=staff_pks, claim_slots=False)
+            counts = importer.run(source)
+            rows = importer.rows_read
+        finally:
+            if rejects:
+                rejects.close()
+    connection.close()
+    return counts, rows, time.perf_counter() - started
+
+
+class PostgresCopyImporter:
+    """
+    Loads a whole CSV file through PostgreSQL's bulk loader.
+
+    The file is streamed into an unlogged staging table with COPY FROM STDIN
+    and then fanned out with one INSERT ... SELECT ... ON CONFLICT per target
+    table. The load runs in a single transaction, so a malformed value aborts
+    the whole file and there is nothing to resume; use BulkImporter for files
+    that need checkpoints or row-level rejects. Rows without natural keys
+    are skipped.
+    """
+
+    def __init__(self, on_step=None):
+        if connection.vendor != 'postgresql':
+            raise RuntimeError(f"COPY import needs PostgreSQL, not '{connection.vendor}'.")
+        self.on_step = on_step
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.staging = connection.ops.quote_name(f'import_staging_{os.getpid()}')
+
+    def run(self, source):
+        """Import every row of a CsvSource, returning the per-entity counters"""
+        missing = source.missing_columns()
+        if missing:
+            raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            self._step('Staging', self._stage, cursor, source)
+            self._step('Diagnoses', self._code_diagnoses, cursor)
+            self._step('Users', self._insert_users, cursor)
+            self.counts['students'] = self._step('Students', self._insert_students, cursor)
+            for key, name, func in (
+                ('appointments', 'Appointments', self._upsert_appointments),
+                ('consultations', 'Consultations', self._upsert_consultations),
+                ('lab_tests', 'Lab tests', self._upsert_lab_tests),
+                ('bills', 'Bills', self._upsert_bills),
+            ):
+                self.counts[key], updated = self._step(name, func, cursor)
+                self.counts['updated'] += updated
+            self._step('Slots', self._claim_slots, cursor)
+            self._step('Balances', self._reconcile_balances, cursor)
+            cursor.execute(f'DROP TABLE {self.staging}')
+            # Raw INSERTs send no post_save, so the cached pickers, timelines and reports are stale
+            transaction.on_commit(directory.invalidate)
+            transaction.on_commit(timeline.invalidate_all)
+            transaction.on_commit(reports.invalidate)
+
+        return self.counts
+
+    def _step(self, name, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        if self.on_step:
+            rows = sum(result) if isinstance(result, tuple) else result
+            self.on_step(name, rows, time.perf_counter() - started)
+        return result
+
+    def _stage(self, cursor, source):
+        columns = ', '.join(connection.ops.quote_name(c) for c in source.header)
+        # row_no keeps file order so the last occurrence of a duplicate key wins
+        cursor.execute(
+            f'CREATE UNLOGGED TABLE {self.staging} (row_no bigserial, '
+            f'{", ".join(f"{connection.ops.quote_name(c)} text" for c in source.header)})'
+        )
+        copy_sql = (
+            f'COPY {self.staging} ({columns}) FROM STDIN '
+            f'WITH (FORMAT csv, FORCE_NOT_NULL ({columns}))'
+        )
+        raw = cursor.cursor
+        if hasattr(raw, 'copy_expert'):
+            # psycopg2
+            raw.copy_expert(copy_sql, source.file, size=COPY_BUFFER_SIZE)
+        else:
+            # psycopg 3
+            with raw.copy(copy_sql) as copy:
+                while data := source.file.read(COPY_BUFFER_SIZE):
+                    copy.write(data)
+        staged = cursor.rowcount
+
+        cursor.execute(f'ANALYZE {self.staging}')
+        return staged
+
+    def _code_diagnoses(self, cursor):
+        # Resolve each distinct text with the same matcher BulkImporter uses, so
+        # codes and aliases count too and both backends code a file alike
+        cursor.execute(f'ALTER TABLE {self.staging} ADD COLUMN diagnosis_code_id bigint')
+        cursor.execute(f"SELECT DISTINCT diagnosis FROM {self.staging} WHERE consultation_id <> ''")
+        matcher = DiagnosisMatcher()
+        codes = [(text, matcher.match(text)) for text, in cursor.fetchall()]
+        codes = [(text, code) for text, code in codes if code is not None]
+
+        coded = 0
+        for start in range(0, len(codes), DIAGNOSIS_CHUNK_SIZE):
+            chunk = codes[start:start + DIAGNOSIS_CHUNK_SIZE]
+            cursor.execute(
+                f'UPDATE {self.staging} s SET diagnosis_code_id = v.code '
+                f'FROM (VALUES {", ".join(["(%s, %s)"] * len(chunk))}) v (diagnosis, code) '
+                f'WHERE s.diagnosis = v.diagnosis',
+                [value for pair in chunk for value in pair]
+            )
+            coded += cursor.rowcount
+        return coded
+
+    def _insert_users(self, cursor):
+        user_table = User._meta.db_table
+        cursor.execute(f"""
+            INSERT INTO {user_table}
+                (password, is_superuser, username, first_name, last_name, email,
+                 is_staff, is_active, date_joined, role)
+            SELECT '', false, username, first_name, last_name, '', false, true, now(), role
+            FROM (
+                SELECT DISTINCT ON (student_id)
+                    replace(lower(student_id), '-', '_') AS username,
+                    split_part(full_name, ' ', 1) AS first_name,
+                    CASE WHEN position(' ' IN full_name) > 0
+                         THEN substr(full_name, position(' ' IN full_name) + 1)
+                         ELSE '' END AS last_name,
+                    'student' AS role
+                FROM {self.staging}
+                WHERE student_id <> ''
+                UNION ALL
+                SELECT DISTINCT {self._doctor_username('name')}, name, '', 'doctor'
+                FROM (
+                    SELECT appointment_doctor AS name FROM {self.staging}
+                    UNION
+                    SELECT consultation_doctor FROM {self.staging} WHERE consultation_id <> ''
+                ) doctors
+                UNION ALL
+                SELECT DISTINCT replace(lower(lab_technician), ' ', '_'), lab_technician, '', 'lab_tech'
+                FROM {self.staging}
+            ) new_users
+            ON CONFLICT (username) DO NOTHING
+        """)
+        return cursor.rowcount
+
+    def _insert_students(self, cursor):
+        cursor.execute(f"""
+            INSERT INTO {StudentProfile._meta.db_table}
+                (user_id, student_id, college, department, gender, year)
+            SELECT DISTINCT ON (s.student_id)
+                u.id, s.student_id, s.college, s.department, s.gender, s.year::integer
+            FROM {self.staging} s
+            JOIN {User._meta.db_table} u ON u.username = replace(lower(s.student_id), '-', '_')
+            WHERE s.student_id <> ''
+            ORDER BY s.student_id
+            ON CONFLICT DO NOTHING
+        """)
+        return cursor.rowcount
+
+    def _upsert(self, cursor, model, key, columns, select_sql, insert_only=()):
+        """Run INSERT ... SELECT ... ON CONFLICT (external_id), returning (created, updated)"""
+        updates = ', '.join(f'{c} = EXCLUDED.{c}' for c in columns if c not in insert_only)
+        cursor.execute(f"""
+            WITH upserted AS (
+                INSERT INTO {model._meta.db_table} (external_id, {', '.join(columns)})
+                SELECT DISTINCT ON (s.{key}) s.{key}, {select_sql}
+                    AND s.{key} <> ''
+                ORDER BY s.{key}, s.row_no DESC
+                ON CONFLICT (external_id) DO UPDATE SET {updates}
+                RETURNING (xmax = 0) AS inserted
+            )
+            SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+            FROM upserted
+        """)
+        return cursor.fetchone()
+
+    def _upsert_appointments(self, cursor):
+        return self._upsert(
+            cursor, Appointment, 'appointment_id',
+            ['student_id', 'doctor_id', 'date', 'time', 'reason', 'status', 'created_at'],
+            f"""p.id, d.id, s.appointment_date::date, s.appointment_time::time,
+                s.appointment_reason, s.appointment_status, now()
+            FROM {self.staging} s
+            JOIN {StudentProfile._meta.db_table} p ON p.student_id = s.student_id
+            JOIN {User._meta.db_table} d ON d.username = {self._doctor_username('s.appointment_doctor')}
+            WHERE s.lab_test_id <> '' AND s.bill_id <> ''""",
+            insert_only=['created_at']
+        )
+
+    def _reconcile_balances(self, cursor):
+        # The raw upserts bypass the ledger receivers; recompute the balances of every student in the file
+        cursor.execute(f"""
+            SELECT DISTINCT p.id FROM {self.staging} s
+            JOIN {StudentProfile._meta.db_table} p ON p.student_id = s.student_id
+        """)
+        return len(ledger.reconcile([pk for pk, in cursor.fetchall()]))
+
+    def _claim_slots(self, cursor):
+        # Same rule as slots.claim_existing: first active booking in file order wins
+        appointments = Appointment._meta.db_table
+        slot_table = AppointmentSlot._meta.db_table
+        cursor.execute(f"""
+            DELETE FROM {slot_table} WHERE appointment_id IN (
+                SELECT a.id FROM {appointments} a
+                JOIN {self.staging} s ON s.appointment_id = a.external_id
+            )
+        """)
+        cursor.execute(f"""
+            INSERT INTO {slot_table} (doctor_id, date, time, appointment_id)
+            SELECT a.doctor_id, a.date, a.time, a.id
+            FROM {appointments} a
+            JOIN {self.staging} s ON s.appointment_id = a.external_id
+            WHERE a.status <> 'Cancelled'
+            ORDER BY s.row_no
+            ON CONFLICT DO NOTHING
+        """)
+        return cursor.rowcount
+
+    def _upsert_consultations(self, cursor):
+        return self._upsert(
+            cursor, Consultation, 'consultation_id',
+            ['appointment_id', 'student_id', 'doctor_id', 'symptoms', 'diagnosis', 'diagnosis_code_id', 'date'],
+            f"""a.id, p.id, d.id, s.symptoms, s.diagnosis, s.diagnosis_code_id, {self._visit_date('s.consultation_date')}
+            FROM {self.staging} s
+            JOIN {Appointment._meta.db_table} a ON a.external_id = s.appointment_id
+            JOIN {StudentProfile._meta.db_table} p ON p.student_id = s.student_id
+            JOIN {User._meta.db_table} d ON d.username = {self._doctor_username('s.consultation_doctor')}
+            WHERE true"""
+        )
+
+    def _upsert_lab_tests(self, cursor):
+        test_type = ' '.join(
+            f"WHEN '{csv_name}' THEN '{test_type}'" for csv_name, test_type in TEST_TYPE_MAP.items()
+        )
+        return self._upsert(
+            cursor, LabTest, 'lab_test_id',
+            ['student_id', 'test_type', 'result', 'technician_id', 'date', 'is_completed'],
+            f"""p.id, CASE s.test_type {test_type} ELSE 'Other' END,
+                s.test_result, t.id, {self._visit_date('s.lab_date')}, true
+            FROM {self.staging} s
+            JOIN {StudentProfile._meta.db_table} p ON p.student_id = s.student_id
+            JOIN {User._meta.db_table} t ON t.username = replace(lower(s.lab_technician), ' ', '_')
+            WHERE s.appointment_id <> '' AND s.bill_id <> ''"""
+        )
+
+    def _upsert_bills(self, cursor):
+        return self._upsert(
+            cursor, Bill, 'bill_id',
+            ['student_id', 'service', 'amount', 'date', 'status'],
+            f"""p.id, s.service, s.amount::numeric, {self._visit_date('s.bill_date')}, s.bill_status
+            FROM {self.staging} s
+            JOIN {StudentProfile._meta.db_table} p ON p.student_id = s.student_id
+            WHERE s.appointment_id <> '' AND s.lab_test_id <> ''"""
+        )
+
+    @staticmethod
+    def _doctor_username(column):
+        return f"replace(replace(lower({column}), ' ', '_'), '.', '')"
+
+    @staticmethod
+    def _visit_date(column):
+        # Blank record dates fall back to the appointment date, as in parse_row
+        return f"COALESCE(NULLIF({column}, ''), s.appointment_date)::date"
@@ -0,0 +1,51 @@
+"""
+Django management command to code free-text consultation diagnoses
+Usage: python manage.py backfill_diagnosis_codes [--batch-size N] [--recode] [--show-uncoded N]
+
+Walks the consultations in primary-key chunks and sets diagnosis_code
+wherever the text matches a DiagnosisCode name, code or alias. Safe to
+re-run: by default only uncoded rows are read. The most common unmatched
+texts are listed so they can be added as codes or aliases.
+"""
+import time
+from django.core.management.base import BaseCommand, CommandError
+from analytics import reports
+from medical.diagnoses import DEFAULT_BATCH_SIZE, backfill
+
+
+class Command(BaseCommand):
+    help = 'Map free-text consultation diagnoses to diagnosis codes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help=f'Consultations per chunk (default {DEFAULT_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--recode', action='store_true',
+            help='Also re-match consultations that already have a code'
+        )
+        parser.add_argument(
+            '--show-uncoded', type=int, default=10,
+            help='How many of the most common unmatched diagnoses to list (default 10)'
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        def on_batch(batch_no, rows, coded):
+            self.stdout.write(f"Chunk {batch_no:,}: {rows:,} consultations read, {coded:,} coded so far")
+
+        started = time.perf_counter()
+        coded, uncoded = backfill(kwargs['batch_size'], kwargs['recode'], on_batch)
+        if coded:
+            # queryset.update() sends no signals; the rollups catch up on the next refresh_rollups --days
+            reports.invalidate('consultations')
+
+        self.stdout.write(self.style.SUCCESS(f"\n✅ Backfill completed!"))
+        self.stdout.write(f"Consultations coded: {coded:,}")
+        self.stdout.write(f"Consultations left uncoded: {sum(uncoded.values()):,}")
+        for text, count in uncoded.most_common(kwargs['show_uncoded']):
+            self.stdout.write(f"  {count:>8,}  {text or '(blank)'}")
+        self.stdout.write(f"Elapsed: {time.perf_counter() - started:.2f}s")
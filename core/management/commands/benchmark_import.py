@@ -0,0 +1,83 @@
+"""
+Django management command to benchmark the import_csv backends
+Usage: python manage.py benchmark_import [csv_file] [--backends bulk,copy] [--repeat N]
+
+Every run happens inside a transaction that is rolled back afterwards,
+so the database is left exactly as it was.
+"""
+import time
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from core.importer import DEFAULT_BATCH_SIZE
+
+# 'row' commits every row on its own, like the original per-row importer
+BACKENDS = {
+    'row': ['--batch-size', '1'],
+    'bulk': [],
+    'copy': ['--copy'],
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare import_csv backends on the same CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'csv_file', nargs='?', default='data/complete_health_records.csv',
+            help='Path to the health records CSV (e.g. from generate_large_dataset.py)'
+        )
+        parser.add_argument(
+            '--backends', default='bulk,copy',
+            help=f"Comma-separated backends to run: {', '.join(BACKENDS)} (default bulk,copy)"
+        )
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--repeat', type=int, default=1, help='Runs per backend; the best is reported')
+
+    def handle(self, *args, **kwargs):
+        backends = [b.strip() for b in kwargs['backends'].split(',') if b.strip()]
+        unknown = set(backends) - set(BACKENDS)
+        if unknown:
+            raise CommandError(f"Unknown backends: {', '.join(sorted(unknown))}")
+
+        if 'copy' in backends and connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING(
+                f"Skipping copy: not available on {connection.vendor}."
+            ))
+            backends.remove('copy')
+
+        with open(kwargs['csv_file'], 'rb') as f:
+            rows = sum(1 for _ in f) - 1
+
+        self.stdout.write(f"Benchmarking {rows:,} rows on {connection.vendor}...\n")
+
+        results = []
+        for backend in backends:
+            timings = [self.run_once(kwargs['csv_file'], backend, kwargs['batch_size'])
+                       for _ in range(kwargs['repeat'])]
+            best = min(timings)
+            results.append((backend, best))
+            self.stdout.write(f"{backend:<6} {best:8.2f}s  {rows / best:10,.0f} rows/s")
+
+        if len(results) > 1:
+            baseline = results[0][1]
+            self.stdout.write('')
+            for backend, best in results[1:]:
+                self.stdout.write(f"{backend} vs {results[0][0]}: {baseline / best:.1f}x")
+
+    def run_once(self, csv_file, backend, batch_size):
+        args = [csv_file, '--batch-size', str(batch_size), *BACKENDS[backend]]
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                call_command('import_csv', *args, stdout=StringIO())
+                elapsed = time.perf_counter() - started
+                raise Rollback
+        except Rollback:
+            pass
+        return elapsed
@@ -0,0 +1,63 @@
+"""
+Django management command to write billing statements as PDFs into a ZIP
+Usage: python manage.py generate_statements [--output statements.zip] [--student ID ...] [--owing] [--workers N]
+
+Statements are rendered by a pool of worker processes and added to the
+ZIP as each one finishes. PDFs already rendered for the same bills (by an
+earlier run or a download) are copied from the statement cache instead
+of being rendered again.
+"""
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from billing import statements
+from billing.models import StudentBalance
+from students.models import StudentProfile
+
+
+class Command(BaseCommand):
+    help = 'Render per-student billing statements into a ZIP archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='statements.zip', help='ZIP file to write (default statements.zip)')
+        parser.add_argument('--student', action='append', help='Student ID to include (repeatable; default all)')
+        parser.add_argument('--owing', action='store_true', help='Only students with an outstanding balance')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Rendering processes (default: CPU count; 1 renders in this process)'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=statements.ARCHIVE_CHUNK_SIZE,
+            help=f'Students loaded at a time (default {statements.ARCHIVE_CHUNK_SIZE})'
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['workers'] < 1 or kwargs['chunk_size'] < 1:
+            raise CommandError('--workers and --chunk-size must be at least 1')
+
+        students = StudentProfile.objects.order_by('pk')
+        if kwargs['student']:
+            students = students.filter(student_id__in=kwargs['student'])
+            missing = set(kwargs['student']) - set(students.values_list('student_id', flat=True))
+            if missing:
+                raise CommandError(f"Unknown student IDs: {', '.join(sorted(missing))}")
+        if kwargs['owing']:
+            students = students.filter(pk__in=StudentBalance.objects.filter(balance__gt=0).values('student'))
+        student_ids = list(students.values_list('pk', flat=True))
+
+        def on_chunk(chunk_no, count, rendered):
+            self.stdout.write(f"Chunk {chunk_no:,}: {count:,} statements, {rendered:,} rendered, {count - rendered:,} cached")
+
+        started = time.perf_counter()
+        try:
+            with open(kwargs['output'], 'wb') as f:
+                total, rendered = statements.build_archive(
+                    student_ids, f, workers=kwargs['workers'], chunk_size=kwargs['chunk_size'], on_chunk=on_chunk
+                )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f"\n✅ Statements completed!"))
+        self.stdout.write(f"Statements: {total:,} ({rendered:,} rendered, {total - rendered:,} from cache)")
+        self.stdout.write(f"Archive: {kwargs['output']}")
+        self.stdout.write(f"Elapsed: {time.perf_counter() - started:.2f}s")
@@ -1,189 +1,255 @@
 """
 Django management command to import CSV data into the database
-Usage: python manage.py import_csv
+Usage: python manage.py import_csv [csv_file | csv_file.gz | file.parquet | file.arrow | -]
+                                   [--copy] [--batch-size N]
+                                   [--resume] [--checkpoint PATH] [--reject-file PATH]
+                                   [--workers N]
+
+Records are upserted on their natural keys, so an interrupted import can be
+re-run or resumed from its checkpoint without creating duplicates.
 """
+import argparse
 import csv
-from django.core.management.base import BaseCommand
-from django.contrib.auth import get_user_model
-from students.models import StudentProfile
-from appointments.models import Appointment
-from medical.models import Consultation
-from lab.models import LabTest
-from billing.models import Bill
-from datetime import datetime
-
-User = get_user_model()
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from core.importer import (
+    BulkImporter, Checkpoint, CsvSource, PostgresCopyImporter, RejectWriter,
+    APPOINTMENT_ORDER_FILE, COLUMNAR_EXTENSIONS, COUNTERS, DEFAULT_BATCH_SIZE, create_staff, import_shard,
+    open_source, partition, reclaim_slots_in_order,
+)
+from core.workers import setup_worker
 
 
 class Command(BaseCommand):
     help = 'Import health records from CSV file'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'csv_file', nargs='?', default='data/complete_health_records.csv',
+            help="Path to the health records CSV; *.gz is decompressed, *.parquet / *.arrow "
+                 "are read with pyarrow and '-' reads stdin"
+        )
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='PostgreSQL only: load through COPY into a staging table, then INSERT ... SELECT '
+                 '(falls back to the batched ORM importer on other databases)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help=f'Rows per transaction (default {DEFAULT_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Continue from the checkpoint left by an interrupted import'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Checkpoint file (default: <csv_file>.checkpoint)'
+        )
+        parser.add_argument(
+            '--reject-file',
+            help='Write rejected rows, with the error for each, to this CSV'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Import with N processes, sharding rows by student_id (PostgreSQL only)'
+        )
+        # Batched upserts are now the only ORM path; kept so existing scripts keep working
+        parser.add_argument('--bulk', action='store_true', help=argparse.SUPPRESS)
+
     def handle(self, *args, **kwargs):
-        csv_file = 'data/complete_health_records.csv'
-        
+        csv_file = kwargs['csv_file']
+        if kwargs['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
         self.stdout.write("Starting CSV import...")
-        
-        # Track created objects
-        students_created = 0
-        appointments_created = 0
-        consultations_created = 0
-        lab_tests_created = 0
-        bills_created = 0
-        
-        # Cache for users and students
-        user_cache = {}
-        student_cache = {}
-        doctor_cache = {}
-        tech_cache = {}
-        
-        with open(csv_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            
-            for i, row in enumerate(reader, 1):
-                try:
-                    # Get or create student user
-                    student_id = row['student_id']
-                    
-                    if student_id not in student_cache:
-                        # Create user for student
-                        username = student_id.lower().replace('-', '_')
-                        full_name = row['full_name']
-                        name_parts = full_name.split(' ', 1)
-                        first_name = name_parts[0]
-                        last_name = name_parts[1] if len(name_parts) > 1 else ''
-                        
-                        user, created = User.objects.get_or_create(
-                            username=username,
-                            defaults={
-                                'first_name': first_name,
-                                'last_name': last_name,
-                                'role': 'student'
-                            }
-                        )
-                        
-                        # Create student profile
-                        student, created = StudentProfile.objects.get_or_create(
-                            student_id=student_id,
-                            defaults={
-                                'user': user,
-                                'college': row['college'],
-                                'department': row['department'],
-                                'gender': row['gender'],
-                                'year': int(row['year'])
-                            }
-                        )
-                        
-                        student_cache[student_id] = student
-                        if created:
-                            students_created += 1
-                    else:
-                        student = student_cache[student_id]
-                    
-                    # Get or create doctor
-                    doctor_name = row['appointment_doctor']
-                    if doctor_name not in doctor_cache:
-                        doctor_username = doctor_name.lower().replace(' ', '_').replace('.', '')
-                        doctor, _ = User.objects.get_or_create(
-                            username=doctor_username,
-                            defaults={
-                                'first_name': doctor_name,
-                                'role': 'doctor'
-                            }
-                        )
-                        doctor_cache[doctor_name] = doctor
-                    else:
-                        doctor = doctor_cache[doctor_name]
-                    
-                    # Create appointment
-                    appointment = Appointment.objects.create(
-                        student=student,
-                        doctor=doctor,
-                        date=datetime.strptime(row['appointment_date'], '%Y-%m-%d').date(),
-                        time=datetime.strptime(row['appointment_time'], '%H:%M').time(),
-                        reason=row['appointment_reason'],
-                        status=row['appointment_status']
-                    )
-                    appointments_created += 1
-                    
-                    # Create consultation if exists
-                    if row['consultation_id']:
-                        consultation_doctor_name = row['consultation_doctor']
-                        if consultation_doctor_name not in doctor_cache:
-                            cons_doc_username = consultation_doctor_name.lower().replace(' ', '_').replace('.', '')
-                            cons_doctor, _ = User.objects.get_or_create(
-                                username=cons_doc_username,
-                                defaults={
-                                    'first_name': consultation_doctor_name,
-                                    'role': 'doctor'
-                                }
-                            )
-                            doctor_cache[consultation_doctor_name] = cons_doctor
-                        else:
-                            cons_doctor = doctor_cache[consultation_doctor_name]
-                        
-                        Consultation.objects.create(
-                            appointment=appointment,
-                            student=student,
-                            doctor=cons_doctor,
-                            symptoms=row['symptoms'],
-                            diagnosis=row['diagnosis']
-                        )
-                        consultations_created += 1
-                    
-                    # Get or create lab technician
-                    tech_name = row['lab_technician']
-                    if tech_name not in tech_cache:
-                        tech_username = tech_name.lower().replace(' ', '_')
-                        tech, _ = User.objects.get_or_create(
-                            username=tech_username,
-                            defaults={
-                                'first_name': tech_name,
-                                'role': 'lab_tech'
-                            }
-                        )
-                        tech_cache[tech_name] = tech
-                    else:
-                        tech = tech_cache[tech_name]
-                    
-                    # Create lab test
-                    test_type_map = {
-                        'Malaria': 'Malaria',
-                        'Urine Test': 'Urine',
-                        'Blood Test': 'Blood',
-                        'TB Test': 'TB',
-                        'CBC': 'CBC'
-                    }
-                    test_type = test_type_map.get(row['test_type'], 'Other')
-                    
-                    LabTest.objects.create(
-                        student=student,
-                        test_type=test_type,
-                        result=row['test_result'],
-                        technician=tech,
-                        is_completed=True
-                    )
-                    lab_tests_created += 1
-                    
-                    # Create bill
-                    Bill.objects.create(
-                        student=student,
-                        service=row['service'],
-                        amount=float(row['amount']),
-                        status=row['bill_status']
+
+        if kwargs['copy']:
+            if csv_file.endswith(COLUMNAR_EXTENSIONS):
+                raise CommandError('--copy needs CSV input')
+            if connection.vendor == 'postgresql':
+                if kwargs['resume']:
+                    raise CommandError('--copy loads the file in one transaction and cannot --resume')
+                self.import_copy(csv_file)
+                return
+            self.stdout.write(self.style.WARNING(
+                f"COPY is not available on {connection.vendor}; using the batched ORM importer."
+            ))
+
+        if kwargs['workers'] > 1:
+            if connection.vendor == 'sqlite':
+                self.stdout.write(self.style.WARNING(
+                    "SQLite allows a single writer; importing with one process."
+                ))
+            elif kwargs['resume']:
+                raise CommandError('--workers cannot --resume; re-run the import, it is idempotent')
+            else:
+                self.import_parallel(csv_file, kwargs)
+                return
+
+        self.import_bulk(csv_file, kwargs)
+
+    def import_bulk(self, csv_file, options):
+        checkpoint = None
+        if csv_file != '-':
+            checkpoint = Checkpoint(options['checkpoint'] or f"{csv_file}.checkpoint", csv_file)
+        elif options['resume']:
+            raise CommandError('Cannot --resume an import read from stdin')
+
+        state = None
+        if options['resume']:
+            try:
+                state = checkpoint.load()
+            except ValueError as e:
+                raise CommandError(str(e))
+            if state is None:
+                raise CommandError(f"No checkpoint found at {checkpoint.path}")
+            self.stdout.write(f"Resuming after row {state['rows']:,}...")
+
+        def on_batch(batch_no, rows, elapsed):
+            rate = rows / elapsed if elapsed else 0
+            self.stdout.write(
+                f"Batch {batch_no:,}: {rows:,} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)"
+            )
+
+        def on_reject(row_no, error):
+            self.stdout.write(self.style.ERROR(f"Error at row {row_no}: {error}"))
+
+        started = time.perf_counter()
+        rejects = None
+        try:
+            source = open_source(csv_file, offset=state['offset'] if state else 0)
+        except ValueError as e:
+            raise CommandError(str(e))
+        with source:
+            if options['reject_file']:
+                rejects = RejectWriter(options['reject_file'], source.header, append=bool(state))
+            try:
+                importer = BulkImporter(
+                    batch_size=options['batch_size'],
+                    on_batch=on_batch,
+                    on_reject=on_reject,
+                    checkpoint=checkpoint,
+                    rejects=rejects
+                )
+                counts = importer.run(
+                    source,
+                    start_row=state['rows'] if state else 0,
+                    counts=state['counts'] if state else None
+                )
+            except (RuntimeError, ValueError) as e:
+                raise CommandError(str(e))
+            finally:
+                if rejects:
+                    rejects.close()
+        elapsed = time.perf_counter() - started
+
+        if checkpoint:
+            checkpoint.clear()
+        self.report(counts)
+        if rejects:
+            self.stdout.write(f"Rows rejected: {rejects.count:,} (written to {options['reject_file']})")
+        self.stdout.write(f"Elapsed: {elapsed:.2f}s")
+
+    def import_parallel(self, csv_file, options):
+        workers = options['workers']
+        started = time.perf_counter()
+        shard_dir = tempfile.mkdtemp(prefix='import_shards_')
+        try:
+            with open_source(csv_file) as source:
+                missing = source.missing_columns()
+                if missing:
+                    raise CommandError(f"CSV is missing columns: {', '.join(missing)}")
+                paths, doctors, technicians = partition(source, shard_dir, workers)
+                header = source.header
+            self.stdout.write(
+                f"Partitioned into {workers} shards in {time.perf_counter() - started:.2f}s"
+            )
+
+            # Staff exist before any worker starts, so workers never race on get_or_create
+            staff_pks = create_staff(doctors, technicians)
+            connections.close_all()
+
+            reject_paths = [
+                f"{path}.rejects" if options['reject_file'] else None for path in paths
+            ]
+            counts = dict.fromkeys(COUNTERS, 0)
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=setup_worker,
+                initargs=(connection.settings_dict['NAME'],)
+            ) as pool:
+                futures = {
+                    pool.submit(import_shard, path, options['batch_size'], staff_pks, reject_path): i
+                    for i, (path, reject_path) in enumerate(zip(paths, reject_paths), 1)
+                }
+                for future in as_completed(futures):
+                    shard_counts, rows, elapsed = future.result()
+                    for key, value in shard_counts.items():
+                        counts[key] += value
+                    rate = rows / elapsed if elapsed else 0
+                    self.stdout.write(
+                        f"Shard {futures[future]}/{workers}: {rows:,} rows in {elapsed:.2f}s "
+                        f"({rate:,.0f} rows/s)"
                     )
-                    bills_created += 1
-                    
-                    # Progress
-                    if i % 1000 == 0:
-                        self.stdout.write(f"Processed {i:,} records...")
-                
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Error at row {i}: {str(e)}"))
+
+            # One pass over the whole file, so the same appointment wins a contested slot every time
+            slots_started = time.perf_counter()
+            reclaim_slots_in_order(os.path.join(shard_dir, APPOINTMENT_ORDER_FILE), options['batch_size'])
+            self.stdout.write(f"Slots claimed in {time.perf_counter() - slots_started:.2f}s")
+
+            rejected = 0
+            if options['reject_file']:
+                rejected = self.merge_rejects(options['reject_file'], header, reject_paths)
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+
+        self.report(counts)
+        if options['reject_file']:
+            self.stdout.write(f"Rows rejected: {rejected:,} (written to {options['reject_file']})")
+        self.stdout.write(f"Elapsed: {time.perf_counter() - started:.2f}s")
+
+    def merge_rejects(self, reject_file, header, shard_paths):
+        rejected = 0
+        with open(reject_file, 'w', encoding='utf-8', newline='') as out:
+            csv.writer(out).writerow(['row', 'error', *header])
+            for path in shard_paths:
+                if not os.path.exists(path):
                     continue
-        
+                with open(path, encoding='utf-8', newline='') as f:
+                    next(f)
+                    for line in f:
+                        out.write(line)
+                        rejected += 1
+        return rejected
+
+    def import_copy(self, csv_file):
+        def on_step(name, rows, elapsed):
+            self.stdout.write(f"{name}: {rows:,} rows in {elapsed:.2f}s")
+
+        started = time.perf_counter()
+        with CsvSource(csv_file) as source:
+            try:
+                counts = PostgresCopyImporter(on_step=on_step).run(source)
+            except ValueError as e:
+                raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        self.report(counts)
+        self.stdout.write(f"Elapsed: {elapsed:.2f}s")
+
+    def report(self, counts):
         self.stdout.write(self.style.SUCCESS(f"\n✅ Import completed!"))
-        self.stdout.write(f"Students created: {students_created:,}")
-        self.stdout.write(f"Appointments created: {appointments_created:,}")
-        self.stdout.write(f"Consultations created: {consultations_created:,}")
-        self.stdout.write(f"Lab tests created: {lab_tests_created:,}")
-        self.stdout.write(f"Bills created: {bills_created:,}")
+        self.stdout.write(f"Students created: {counts['students']:,}")
+        self.stdout.write(f"Appointments created: {counts['appointments']:,}")
+        self.stdout.write(f"Consultations created: {counts['consultations']:,}")
+        self.stdout.write(f"Lab tests created: {counts['lab_tests']:,}")
+        self.stdout.write(f"Bills created: {counts['bills']:,}")
+        self.stdout.write(f"Records updated: {counts['updated']:,}")
@@ -0,0 +1,58 @@
+"""
+Django management command to settle bills from a finance office payment file
+Usage: python manage.py import_payments payments.csv[.gz] [--exceptions exceptions.csv] [--chunk-size N]
+
+The file needs bill_id and amount columns (reference is optional) and is
+streamed in chunks: each chunk is matched to the bills in one query and
+applied in one transaction. Unknown bills, amounts that differ from the
+bill, bills already paid and duplicate rows are left untouched and listed
+in the exceptions file.
+"""
+import gzip
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from billing import payments
+
+
+class Command(BaseCommand):
+    help = 'Mark bills Paid from a payment CSV and report the rows that do not match'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Payment CSV (.csv or .csv.gz, '-' for stdin)")
+        parser.add_argument(
+            '--exceptions', default='payment_exceptions.csv',
+            help='Where to write unmatched rows (default payment_exceptions.csv)'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=payments.CHUNK_SIZE,
+            help=f'Rows per transaction (default {payments.CHUNK_SIZE})'
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        path = kwargs['path']
+
+        def on_chunk(chunk_no, counts):
+            self.stdout.write(f"Chunk {chunk_no:,}: {sum(counts.values()):,} rows, {counts[payments.PAID]:,} paid")
+
+        started = time.perf_counter()
+        try:
+            if path == '-':
+                source = sys.stdin.buffer
+            else:
+                source = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+        try:
+            with source, open(kwargs['exceptions'], 'w', newline='') as exceptions:
+                counts = payments.apply(source, exceptions, chunk_size=kwargs['chunk_size'], on_chunk=on_chunk)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f"\n✅ Payment import completed!"))
+        for outcome in payments.OUTCOMES:
+            self.stdout.write(f"{outcome.capitalize()}: {counts[outcome]:,}")
+        self.stdout.write(f"Exceptions: {kwargs['exceptions']}")
+        self.stdout.write(f"Elapsed: {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,67 @@
+"""
+Django management command to import pharmacy data generated alongside the visits CSV
+Usage: python manage.py import_pharmacy [csv_file] [--batch-size N]
+
+Reads <csv_file root>_drugs.csv, _prescriptions.csv and _dispenses.csv, as
+written by generate_large_dataset.py --mode visits. Run import_csv on the
+visits file first: prescriptions and dispenses link to its consultations
+and students by natural key.
+"""
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from core.importer import DEFAULT_BATCH_SIZE, CsvSource, PharmacyImporter
+
+FILES = (
+    ('drugs', 'import_drugs'),
+    ('prescriptions', 'import_prescriptions'),
+    ('dispenses', 'import_dispenses'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Import drugs, prescriptions and dispense records from CSV files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'csv_file', nargs='?', default='data/complete_health_records.csv',
+            help='Path to the visits CSV the pharmacy files were generated next to'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help=f'Rows per transaction (default {DEFAULT_BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        root = os.path.splitext(kwargs['csv_file'])[0]
+        paths = [(f"{root}_{name}.csv", method) for name, method in FILES]
+        for path, _ in paths:
+            if not os.path.exists(path):
+                raise CommandError(f"File not found: {path}")
+
+        def on_batch(name, batch_no, rows, elapsed):
+            rate = rows / elapsed if elapsed else 0
+            self.stdout.write(
+                f"{name} batch {batch_no:,}: {rows:,} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)"
+            )
+
+        self.stdout.write("Starting pharmacy import...")
+        started = time.perf_counter()
+        importer = PharmacyImporter(batch_size=kwargs['batch_size'], on_batch=on_batch)
+        for path, method in paths:
+            with CsvSource(path) as source:
+                try:
+                    counts = getattr(importer, method)(source)
+                except ValueError as e:
+                    raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f"\n✅ Import completed!"))
+        self.stdout.write(f"Drugs created: {counts['drugs']:,}")
+        self.stdout.write(f"Prescriptions created: {counts['prescriptions']:,}")
+        self.stdout.write(f"Dispense records created: {counts['dispenses']:,}")
+        self.stdout.write(f"Records updated: {counts['updated']:,}")
+        self.stdout.write(f"Rows skipped (unknown consultation, student or drug): {counts['skipped']:,}")
+        self.stdout.write(f"Elapsed: {time.perf_counter() - started:.2f}s")
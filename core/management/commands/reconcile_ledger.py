@@ -0,0 +1,44 @@
+"""
+Django management command to check the billing ledger against the bills
+Usage: python manage.py reconcile_ledger [--check] [--chunk-size N] [--show N]
+
+Walks the students in primary-key chunks, one transaction per chunk,
+and compares each StudentBalance with the sum of the student's Pending
+bills. Differences are booked as adjustment entries and the balance is
+corrected, unless --check is given; --check exits with an error when
+anything is out of step, so it can run from cron as a monitor.
+"""
+import time
+from django.core.management.base import BaseCommand, CommandError
+from billing.ledger import RECONCILE_CHUNK_SIZE, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Verify (and repair) every student balance against their bills'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report differences, change nothing')
+        parser.add_argument(
+            '--chunk-size', type=int, default=RECONCILE_CHUNK_SIZE,
+            help=f'Students per transaction (default {RECONCILE_CHUNK_SIZE})'
+        )
+        parser.add_argument('--show', type=int, default=10, help='How many differences to list (default 10)')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        def on_chunk(chunk_no, students, mismatches):
+            self.stdout.write(f"Chunk {chunk_no:,}: {students:,} students checked, {mismatches:,} differences so far")
+
+        started = time.perf_counter()
+        mismatches = reconcile(chunk_size=kwargs['chunk_size'], fix=not kwargs['check'], on_chunk=on_chunk)
+
+        for student_id, recorded, actual in mismatches[:kwargs['show']]:
+            self.stdout.write(f"  student #{student_id}: ledger {recorded if recorded is not None else '-'}, bills {actual}")
+        if kwargs['check'] and mismatches:
+            raise CommandError(f"{len(mismatches):,} balances differ from the bills")
+
+        self.stdout.write(self.style.SUCCESS(f"\n✅ Reconciliation completed!"))
+        self.stdout.write(f"Balances {'out of step' if kwargs['check'] else 'corrected'}: {len(mismatches):,}")
+        self.stdout.write(f"Elapsed: {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,47 @@
+"""
+Django management command to bring the analytics rollups up to date
+Usage: python manage.py refresh_rollups [--days N]
+
+Folds rows inserted since the last run (past each source's high-water
+mark, or committed late just below it) into the daily rollups; meant to
+run periodically, e.g. from cron.
+--days N also recomputes the last N days, which catches rows changed in
+place by bulk updates that send no signals. It also replays the outbreak
+detector's window, storing alerts for cases no live detector saw.
+"""
+import datetime
+import time
+from django.core.management.base import BaseCommand, CommandError
+from analytics import outbreaks, reports, rollups
+
+
+class Command(BaseCommand):
+    help = 'Fold new and recently changed rows into the daily rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=0,
+            help='Also recompute this many most recent days (default 0)'
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['days'] < 0:
+            raise CommandError('--days cannot be negative')
+
+        started = time.perf_counter()
+        for source in rollups.source_models():
+            days = rollups.refresh_new_rows(source)
+            if days:
+                reports.invalidate(source)
+            self.stdout.write(f"{source}: {days:,} days with new rows refreshed")
+
+        if kwargs['days']:
+            today = datetime.date.today()
+            rollups.rebuild(today - datetime.timedelta(days=kwargs['days'] - 1), today)
+            reports.invalidate()
+            self.stdout.write(f"Recomputed the last {kwargs['days']:,} days")
+
+        # Cases saved by other processes and bulk imports reach the live detectors only here
+        self.stdout.write(f"Outbreak alerts stored: {len(outbreaks.scan_recent()):,}")
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Rollups refreshed in {time.perf_counter() - started:.2f}s"))
@@ -0,0 +1,93 @@
+"""
+Keyset (seek) pagination for large, append-heavy tables
+
+Pages are addressed by the sort key of their boundary rows instead of an
+OFFSET, so every page costs one indexed range scan however deep it is and
+rows inserted meanwhile never shift later pages.
+"""
+import base64
+from django.db.models import Q
+
+DEFAULT_PER_PAGE = 50
+
+
+def encode_cursor(values):
+    raw = '|'.join(str(v) for v in values)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(model, fields, cursor):
+    """Turn a cursor back into typed key values, or None if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        parts = raw.split('|')
+        if len(parts) != len(fields):
+            return None
+        return [model._meta.get_field(f).to_python(v) for f, v in zip(fields, parts)]
+    except Exception:
+        return None
+
+
+def seek_filter(fields, values, descending):
+    """Q for rows strictly after (fields) = (values) in the given sort direction"""
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for i, field in enumerate(fields):
+        step = Q(**{f'{field}__{lookup}': values[i]})
+        for prior, value in zip(fields[:i], values[:i]):
+            step &= Q(**{prior: value})
+        condition |= step
+    return condition
+
+
+class KeysetPage:
+    """
+    One page of a queryset ordered by fields, all descending (newest first)
+    when descending=True. The last field must be unique (e.g. 'id').
+
+    `after` continues past the cursor's row, `before` goes back to the rows
+    preceding it. next_cursor / previous_cursor are None at either end.
+    """
+
+    def __init__(self, queryset, fields, after=None, before=None,
+                 per_page=DEFAULT_PER_PAGE, descending=True):
+        self.fields = list(fields)
+        model = queryset.model
+        prefix = '-' if descending else ''
+        reverse_prefix = '' if descending else '-'
+
+        cursor = decode_cursor(model, self.fields, before or after) if (before or after) else None
+        backwards = bool(before) and cursor is not None
+
+        if backwards:
+            queryset = queryset.filter(seek_filter(self.fields, cursor, not descending))
+            queryset = queryset.order_by(*(reverse_prefix + f for f in self.fields))
+        else:
+            if cursor is not None:
+                queryset = queryset.filter(seek_filter(self.fields, cursor, descending))
+            queryset = queryset.order_by(*(prefix + f for f in self.fields))
+
+        # One extra row tells us whether there is anything beyond this page
+        rows = list(queryset[:per_page + 1])
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        if backwards:
+            rows.reverse()
+
+        self.object_list = rows
+        self.has_next = (not backwards and has_more) or (backwards and bool(rows))
+        self.has_previous = (backwards and has_more) or (not backwards and cursor is not None and bool(rows))
+        self.next_cursor = self._cursor(rows[-1]) if self.has_next else None
+        self.previous_cursor = self._cursor(rows[0]) if self.has_previous else None
+
+    def _cursor(self, obj):
+        return encode_cursor(getattr(obj, f) for f in self.fields)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
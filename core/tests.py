@@ -1,3 +1,642 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import date, time, timedelta
+from io import StringIO
+import unittest
+import warnings
+from contextlib import redirect_stdout
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+import generate_large_dataset
+from appointments.models import Appointment, AppointmentSlot
+from billing import ledger
+from billing.models import Bill
+from core.exporter import TableExport
+from core.importer import APPOINTMENT_ORDER_FILE, CSV_COLUMNS, BulkImporter, CsvSource, partition, shard_for
+from core.pagination import seek_filter
+from lab.models import LabTest
+from medical.models import Consultation, Prescription
+from pharmacy.models import DispenseRecord, Drug
+from students.models import StudentProfile
+
+
+def make_row(index, student_id=None, consultation=True, **overrides):
+    row = {
+        'student_id': student_id or f"HU-UGR-2023-{10000 + index:05d}",
+        'full_name': 'Hana Bekele',
+        'college': 'CNCS',
+        'department': 'Computer Science',
+        'phone': '0911223344',
+        'gender': 'F',
+        'year': '2',
+        'appointment_id': f"APT-{10000 + index:05d}",
+        'appointment_doctor': 'Dr. Lensa',
+        'appointment_date': '2024-03-01',
+        'appointment_time': '09:30',
+        'appointment_reason': 'Fever',
+        'appointment_status': 'Completed',
+        'consultation_id': f"CONS-{10000 + index:05d}" if consultation else '',
+        'symptoms': 'High fever and body aches' if consultation else '',
+        'diagnosis': 'Malaria' if consultation else '',
+        'consultation_doctor': 'Dr. Roba' if consultation else '',
+        'consultation_date': '2024-03-01' if consultation else '',
+        'lab_test_id': f"LAB-{10000 + index:05d}",
+        'test_type': 'Malaria',
+        'test_result': 'Positive',
+        'lab_technician': 'Merga',
+        'lab_date': '2024-03-01',
+        'bill_id': f"BILL-{10000 + index:05d}",
+        'service': 'Malaria Test',
+        'amount': '25',
+        'bill_status': 'Pending',
+        'bill_date': '2024-03-01',
+    }
+    row.update(overrides)
+    return row
+
+
+class ImportCsvTestMixin:
+    def write_csv(self, rows, compress=False):
+        handle, path = tempfile.mkstemp(suffix='.csv.gz' if compress else '.csv')
+        os.close(handle)
+        opener = gzip.open if compress else open
+        with opener(path, 'wt', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def import_csv(self, path, *args):
+        out = StringIO()
+        call_command('import_csv', path, *args, stdout=out)
+        return out.getvalue()
+
+
+class BulkImportTests(ImportCsvTestMixin, TestCase):
+    def test_bulk_import_links_consultations_to_appointments(self):
+        rows = [make_row(i, consultation=i % 2 == 0) for i in range(5)]
+        # A returning student reuses the existing profile
+        rows.append(make_row(5, student_id=rows[0]['student_id']))
+        output = self.import_csv(self.write_csv(rows), '--batch-size', '2')
+
+        self.assertEqual(StudentProfile.objects.count(), 5)
+        self.assertEqual(Appointment.objects.count(), 6)
+        self.assertEqual(Consultation.objects.count(), 4)
+        self.assertEqual(LabTest.objects.count(), 6)
+        self.assertEqual(Bill.objects.count(), 6)
+        for consultation in Consultation.objects.select_related('appointment'):
+            self.assertEqual(consultation.student_id, consultation.appointment.student_id)
+            self.assertEqual(consultation.doctor.username, 'dr_roba')
+        self.assertIn('Students created: 5', output)
+        self.assertIn('Batch 3:', output)
+
+    def test_record_dates_come_from_the_csv(self):
+        row = make_row(0, consultation_date='2022-05-02', lab_date='2022-05-03', bill_date='')
+        self.import_csv(self.write_csv([row]))
+
+        self.assertEqual(Consultation.objects.get().date, date(2022, 5, 2))
+        self.assertEqual(LabTest.objects.get().date, date(2022, 5, 3))
+        # A blank date falls back to the appointment date
+        self.assertEqual(Bill.objects.get().date, date(2024, 3, 1))
+
+    def test_bad_rows_go_to_reject_file(self):
+        rows = [
+            make_row(0),
+            make_row(1, appointment_date='not-a-date'),
+            make_row(2, bill_id=''),
+            make_row(3),
+        ]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        reject_path = os.path.join(directory.name, 'rejects.csv')
+        output = self.import_csv(self.write_csv(rows), '--reject-file', reject_path)
+
+        self.assertEqual(Appointment.objects.count(), 2)
+        self.assertIn('Error at row 2', output)
+        self.assertIn('Rows rejected: 2', output)
+        with open(reject_path, encoding='utf-8') as f:
+            rejected = list(csv.DictReader(f))
+        self.assertEqual([r['row'] for r in rejected], ['2', '3'])
+        self.assertEqual(rejected[1]['error'], 'missing bill_id')
+        self.assertEqual(rejected[0]['appointment_id'], 'APT-10001')
+
+    def test_reimport_updates_instead_of_duplicating(self):
+        path = self.write_csv([make_row(i) for i in range(3)])
+        self.import_csv(path)
+        path = self.write_csv([make_row(i, appointment_status='Cancelled') for i in range(3)])
+        output = self.import_csv(path)
+
+        self.assertEqual(Appointment.objects.count(), 3)
+        self.assertEqual(Consultation.objects.count(), 3)
+        self.assertEqual(LabTest.objects.count(), 3)
+        self.assertEqual(Bill.objects.count(), 3)
+        self.assertFalse(Appointment.objects.exclude(status='Cancelled').exists())
+        self.assertIn('Appointments created: 0', output)
+        self.assertIn('Records updated: 12', output)
+
+    def test_import_keeps_balances_in_step(self):
+        student_id = make_row(0)['student_id']
+        self.import_csv(self.write_csv([make_row(0), make_row(1, student_id=student_id, amount='40')]))
+        student = StudentProfile.objects.get(student_id=student_id)
+        self.assertEqual(ledger.balance(student.pk), Decimal('65.00'))
+
+        self.import_csv(self.write_csv([make_row(1, student_id=student_id, amount='40', bill_status='Paid')]))
+        self.assertEqual(ledger.balance(student.pk), Decimal('25.00'))
+        self.assertEqual(ledger.reconcile(fix=False), [])
+
+    def test_resume_continues_after_last_committed_chunk(self):
+        path = self.write_csv([make_row(i) for i in range(5)], compress=True)
+        write = BulkImporter._write
+        calls = []
+
+        def crash_on_second_chunk(importer, batch):
+            calls.append(len(batch))
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return write(importer, batch)
+
+        with mock.patch.object(BulkImporter, '_write', crash_on_second_chunk):
+            with self.assertRaises(KeyboardInterrupt):
+                self.import_csv(path, '--batch-size', '2')
+        self.assertEqual(Appointment.objects.count(), 2)
+        self.assertTrue(os.path.exists(f"{path}.checkpoint"))
+
+        output = self.import_csv(path, '--batch-size', '2', '--resume')
+
+        self.assertIn('Resuming after row 2', output)
+        self.assertIn('Appointments created: 5', output)
+        self.assertEqual(Appointment.objects.count(), 5)
+        self.assertFalse(os.path.exists(f"{path}.checkpoint"))
+
+    def test_database_errors_do_not_move_the_checkpoint(self):
+        path = self.write_csv([make_row(i) for i in range(4)])
+        write = BulkImporter._write
+        calls = []
+
+        def lose_connection_on_second_chunk(importer, batch):
+            calls.append(len(batch))
+            if len(calls) == 2:
+                raise OperationalError('server closed the connection unexpectedly')
+            return write(importer, batch)
+
+        with mock.patch.object(BulkImporter, '_write', lose_connection_on_second_chunk):
+            with self.assertRaises(OperationalError):
+                self.import_csv(path, '--batch-size', '2')
+        # Not retried row by row, nothing rejected, and the checkpoint still sits after the first chunk
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual(Appointment.objects.count(), 2)
+        with open(f"{path}.checkpoint") as f:
+            state = json.load(f)
+        with open(path, 'rb') as f:
+            first_chunk_end = len(b''.join(f.readline() for _ in range(3)))
+        self.assertEqual((state['rows'], state['offset']), (2, first_chunk_end))
+
+        self.import_csv(path, '--batch-size', '2', '--resume')
+        self.assertEqual(Appointment.objects.count(), 4)
+
+
+class PartitionTests(ImportCsvTestMixin, TestCase):
+    def test_student_rows_share_a_shard(self):
+        rows = [make_row(i, student_id=f"HU-UGR-2023-{10000 + i % 4:05d}") for i in range(12)]
+        shard_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, shard_dir)
+        with CsvSource(self.write_csv(rows)) as source:
+            paths, doctors, technicians = partition(source, shard_dir, 3)
+
+        self.assertEqual(doctors, {'Dr. Lensa', 'Dr. Roba'})
+        self.assertEqual(technicians, {'Merga'})
+        seen = {}
+        total = 0
+        for shard, path in enumerate(paths):
+            with CsvSource(path) as shard_source:
+                for row in shard_source:
+                    self.assertEqual(seen.setdefault(row['student_id'], shard), shard)
+                    total += 1
+        self.assertEqual(total, 12)
+        with open(os.path.join(shard_dir, APPOINTMENT_ORDER_FILE)) as f:
+            self.assertEqual(f.read().split(), [row['appointment_id'] for row in rows])
+
+
+@unittest.skipIf(connection.vendor == 'sqlite', 'SQLite takes one writer; import_csv never runs workers on it')
+class ParallelImportTests(ImportCsvTestMixin, TransactionTestCase):
+    def test_workers_import_everything_and_first_row_wins_a_slot(self):
+        rows = [make_row(i, appointment_time=f'{8 + i:02d}:00') for i in range(8)]
+        # Students in different shards after the same slot as rows 0 and 1
+        rivals = [i for i in range(8, 40) if shard_for(make_row(i)['student_id'], 2)
+                  != shard_for(make_row(0)['student_id'], 2)][:2]
+        rows += [make_row(rivals[0], appointment_time='08:00'), make_row(rivals[1], appointment_time='08:00')]
+        rows.insert(0, rows.pop())  # A rival is first in the file for 08:00...
+        path = self.write_csv(rows)
+
+        output = self.import_csv(path, '--workers', '2', '--batch-size', '2')
+        self.assertIn('Shard 2/2', output)
+
+        self.assertIn('Appointments created: 10', output)
+        self.assertIn('Bills created: 10', output)
+        self.assertEqual(Appointment.objects.count(), 10)
+        self.assertEqual(Consultation.objects.filter(appointment__isnull=False).count(), 10)
+        self.assertEqual(ledger.reconcile(fix=False), [])
+        # ...so it holds the slot, whichever shard finished first; the other 08:00 bookings hold none
+        self.assertEqual(
+            dict(AppointmentSlot.objects.values_list('appointment__external_id', 'time__hour')),
+            {rows[0]['appointment_id']: 8, **{f'APT-{10000 + i:05d}': 8 + i for i in range(1, 8)}},
+        )
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'COPY needs PostgreSQL')
+class CopyImportTests(ImportCsvTestMixin, TestCase):
+    def test_copy_import_matches_the_batched_importer(self):
+        rows = [make_row(i) for i in range(3)]
+        rows.append(make_row(3, student_id=rows[0]['student_id'], amount='40', consultation=False))
+        output = self.import_csv(self.write_csv(rows), '--copy')
+
+        self.assertIn('Staging: 4 rows', output)
+        self.assertIn('Students created: 3', output)
+        self.assertIn('Consultations created: 3', output)
+        self.assertEqual(Appointment.objects.count(), 4)
+        self.assertEqual(Consultation.objects.filter(doctor__username='dr_roba').count(), 3)
+        self.assertEqual(AppointmentSlot.objects.count(), 1)
+        self.assertEqual(ledger.reconcile(fix=False), [])
+        student = StudentProfile.objects.get(student_id=rows[0]['student_id'])
+        self.assertEqual(ledger.balance(student.pk), Decimal('65.00'))
+
+        output = self.import_csv(self.write_csv(rows), '--copy')
+        self.assertIn('Appointments created: 0', output)
+        self.assertEqual(Appointment.objects.count(), 4)
+
+    def test_diagnoses_are_coded_like_the_batched_importer(self):
+        diagnoses = ['Malaria', 'b54', 'Urinary tract infection', 'Malaria, P. falciparum', 'Appendicitis']
+        path = self.write_csv([make_row(i, diagnosis=text) for i, text in enumerate(diagnoses)])
+
+        self.import_csv(path, '--copy')
+        copied = dict(Consultation.objects.values_list('diagnosis', 'diagnosis_code__code'))
+        Consultation.objects.update(diagnosis_code=None)
+        self.import_csv(path)
+        batched = dict(Consultation.objects.values_list('diagnosis', 'diagnosis_code__code'))
+
+        self.assertEqual(copied, batched)
+        self.assertEqual(copied, {
+            'Malaria': 'B54', 'b54': 'B54', 'Urinary tract infection': 'N39.0',
+            'Malaria, P. falciparum': 'B54', 'Appendicitis': None,
+        })
+
+
+@unittest.skipIf(connection.vendor == 'postgresql', 'PostgreSQL runs --copy for real')
+class CopyFallbackTests(ImportCsvTestMixin, TestCase):
+    def test_copy_falls_back_to_the_batched_importer(self):
+        output = self.import_csv(self.write_csv([make_row(i) for i in range(2)]), '--copy')
+
+        self.assertIn(f'COPY is not available on {connection.vendor}', output)
+        self.assertIn('Appointments created: 2', output)
+        self.assertEqual(Appointment.objects.count(), 2)
+
+
+class BenchmarkImportTests(ImportCsvTestMixin, TestCase):
+    def test_every_run_is_rolled_back(self):
+        path = self.write_csv([make_row(i) for i in range(3)])
+        out = StringIO()
+        call_command('benchmark_import', path, '--backends', 'row,bulk,copy', stdout=out)
+        output = out.getvalue()
+
+        self.assertIn(f'Benchmarking 3 rows on {connection.vendor}', output)
+        self.assertRegex(output, r'row +[\d.]+s')
+        self.assertIn('bulk vs row:', output)
+        if connection.vendor == 'postgresql':
+            self.assertIn('copy vs row:', output)
+        else:
+            self.assertIn('Skipping copy', output)
+        self.assertFalse(Appointment.objects.exists())
+        self.assertFalse(StudentProfile.objects.exists())
+
+    def test_unknown_backend_is_refused(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown backends: fast'):
+            call_command('benchmark_import', self.write_csv([make_row(0)]), '--backends', 'bulk,fast')
+
+
+class PharmacyImportTests(ImportCsvTestMixin, TestCase):
+    def write_pharmacy_csvs(self, visits_path, drugs, prescriptions, dispenses):
+        root = os.path.splitext(visits_path)[0]
+        for name, header, rows in (
+            ('drugs', ['name', 'unit', 'stock', 'expiry_date'], drugs),
+            ('prescriptions', ['prescription_id', 'consultation_id', 'drug_name', 'dosage', 'instructions'],
+             prescriptions),
+            ('dispenses', ['dispense_id', 'student_id', 'drug_name', 'quantity', 'pharmacist', 'date'],
+             dispenses),
+        ):
+            path = f"{root}_{name}.csv"
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(rows)
+            self.addCleanup(os.remove, path)
+
+    def test_prescriptions_and_dispenses_link_by_natural_key(self):
+        rows = [make_row(i) for i in range(2)]
+        path = self.write_csv(rows)
+        self.import_csv(path)
+        self.write_pharmacy_csvs(
+            path,
+            drugs=[['Paracetamol 500mg', 'tablets', '100', '2026-01-31']],
+            prescriptions=[
+                ['RX-1', 'CONS-10000', 'Paracetamol 500mg', '1 x 3 daily', 'After meals'],
+                ['RX-2', 'CONS-10001', 'Paracetamol 500mg', '1 daily', ''],
+                ['RX-3', 'CONS-99999', 'Paracetamol 500mg', '1 daily', ''],
+            ],
+            dispenses=[
+                ['DSP-1', rows[0]['student_id'], 'Paracetamol 500mg', '10', 'Abdi', '2024-03-02'],
+                ['DSP-2', rows[1]['student_id'], 'Unknown Drug', '10', 'Abdi', '2024-03-02'],
+            ]
+        )
+        out = StringIO()
+        call_command('import_pharmacy', path, stdout=out)
+        call_command('import_pharmacy', path, stdout=StringIO())
+
+        self.assertEqual(Drug.objects.count(), 1)
+        self.assertEqual(Prescription.objects.count(), 2)
+        self.assertEqual(
+            Prescription.objects.get(external_id='RX-1').consultation.external_id, 'CONS-10000'
+        )
+        dispense = DispenseRecord.objects.get()
+        self.assertEqual(dispense.student.student_id, rows[0]['student_id'])
+        self.assertEqual(dispense.pharmacist.role, 'pharmacist')
+        self.assertEqual(dispense.date, date(2024, 3, 2))
+        self.assertIn('Rows skipped (unknown consultation, student or drug): 2', out.getvalue())
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN every hot query and fail if it falls back to scanning the whole
+    table or sorting it: each must be served by one of the Meta.indexes.
+
+    SQLite plans without statistics, as for a large table. PostgreSQL would
+    rightly seq scan a seeded test table, so seq scans and sorts are
+    disabled there: a plan that still needs one has no index to use.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.doctor = User.objects.create_user('dr_plan', role='doctor')
+        technician = User.objects.create_user('tech_plan', role='lab_tech')
+        cls.student = StudentProfile.objects.create(
+            user=User.objects.create_user('student_plan', role='student'),
+            student_id='HU-UGR-2023-99999', college='CNCS', department='ICT', gender='M', year=1
+        )
+        start = date(2024, 1, 1)
+        appointments = Appointment.objects.bulk_create([
+            Appointment(student=cls.student, doctor=cls.doctor, date=start + timedelta(days=i),
+                        time=time(8 + i % 9, 0), reason='Check-up', status='Pending')
+            for i in range(50)
+        ])
+        Consultation.objects.bulk_create([
+            Consultation(appointment=a, student=cls.student, doctor=cls.doctor,
+                         symptoms='Fever', diagnosis='Flu', date=a.date)
+            for a in appointments
+        ])
+        LabTest.objects.bulk_create([
+            LabTest(student=cls.student, test_type='Malaria', technician=technician,
+                    date=a.date, is_completed=i % 2 == 0)
+            for i, a in enumerate(appointments)
+        ])
+        Bill.objects.bulk_create([
+            Bill(student=cls.student, service='Malaria Test', amount=25, date=a.date, status='Pending')
+            for a in appointments
+        ])
+
+    def plan(self, queryset):
+        if connection.vendor == 'postgresql':
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('SET LOCAL enable_sort = off')
+                return queryset.explain()
+        return queryset.explain()
+
+    def assertIndexed(self, queryset):
+        plan = self.plan(queryset)
+        table = queryset.model._meta.db_table
+        if connection.vendor == 'sqlite':
+            full_scan = re.search(rf'\bSCAN {table}\b(?! USING)', plan)
+            filesort = 'USE TEMP B-TREE FOR ORDER BY' in plan
+        elif connection.vendor == 'postgresql':
+            full_scan = 'Seq Scan' in plan
+            filesort = re.search(r'(^|->)\s*(Incremental )?Sort\b', plan, re.MULTILINE)
+        else:
+            self.skipTest(f'No plan checks for {connection.vendor}')
+        self.assertFalse(full_scan, f'Full table scan:\n{plan}')
+        self.assertFalse(filesort, f'Sort without an index:\n{plan}')
+
+    def test_manage_appointments(self):
+        newest = Appointment.objects.select_related('student__user', 'doctor').order_by('-date', '-time', '-id')
+        self.assertIndexed(newest[:51])
+        self.assertIndexed(newest.filter(doctor=self.doctor)[:51])
+        self.assertIndexed(newest.filter(status='Pending')[:51])
+        self.assertIndexed(newest.filter(date__range=(date(2024, 1, 1), date(2024, 1, 31)))[:51])
+        # A later keyset page seeks into the index instead of skipping rows
+        after = seek_filter(['date', 'time', 'id'], [date(2024, 2, 1), time(9, 0), 20], descending=True)
+        self.assertIndexed(newest.filter(after)[:51])
+        self.assertIndexed(newest.filter(after, doctor=self.doctor)[:51])
+
+    def test_student_history(self):
+        self.assertIndexed(
+            Appointment.objects.filter(student=self.student).order_by('-date', '-time')
+        )
+        self.assertIndexed(Consultation.objects.filter(student=self.student).order_by('-date'))
+        self.assertIndexed(
+            Bill.objects.filter(student=self.student, status='Pending').order_by('-date')
+        )
+
+    def test_admin_changelists(self):
+        year = {'date__gte': date(2024, 1, 1), 'date__lt': date(2025, 1, 1)}
+        for queryset in (
+            Appointment.objects.order_by('-date', '-time', '-id'),
+            Appointment.objects.filter(status='Completed', **year).order_by('-date', '-time', '-id'),
+            Appointment.objects.filter(doctor=self.doctor).order_by('-date', '-time', '-id'),
+            Bill.objects.order_by('-date', '-id'),
+            Bill.objects.filter(status='Paid', **year).order_by('-date', '-id'),
+            LabTest.objects.filter(test_type='Malaria', **year).order_by('-date', '-id'),
+            LabTest.objects.filter(is_completed=False).order_by('-date', '-id'),
+            Consultation.objects.filter(doctor=self.doctor).order_by('-date', '-id'),
+            Consultation.objects.filter(**year).order_by('-date', '-id'),
+        ):
+            with self.subTest(query=str(queryset.query)):
+                self.assertIndexed(queryset[:100])
+
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.staff = User.objects.create_user('epi_admin', password='pw', role='admin', is_staff=True)
+        cls.doctor = User.objects.create_user('dr_export', password='pw', role='doctor')
+        student = StudentProfile.objects.create(
+            user=User.objects.create_user('st_export', first_name='Hana', role='student'),
+            student_id='HU-UGR-2023-70000', college='CNCS', department='Biology',
+            gender='F', year=3
+        )
+        Bill.objects.bulk_create([
+            Bill(student=student, service=f'Service {i}', amount=Decimal('12.50') * i, date=date(2024, 5, 1) + timedelta(days=i))
+            for i in range(1, 8)
+        ])
+
+    def export_file(self, *args):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'out')
+        out = StringIO()
+        call_command('export_table', 'bills', '--output', path, '--chunk-size', '3', *args, stdout=out)
+        self.assertIn('Rows: ', out.getvalue())
+        return path
+
+    def test_gzip_csv_has_demographics_but_no_names(self):
+        with gzip.open(self.export_file('--to', '2024-05-05'), 'rt', newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([row['service'] for row in rows], [f'Service {i}' for i in range(1, 5)])
+        self.assertEqual((rows[0]['amount'], rows[0]['college'], rows[0]['year']), ('12.50', 'CNCS', '3'))
+        self.assertNotIn('phone', rows[0])
+        self.assertNotIn('Hana', str(rows))
+
+    @unittest.skipUnless(pyarrow, 'needs pyarrow')
+    def test_parquet_and_arrow_write_one_group_per_chunk(self):
+        import pyarrow.ipc as pa_ipc
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(self.export_file('--format', 'parquet'))
+        self.assertEqual((parquet.metadata.num_rows, parquet.metadata.num_row_groups), (7, 3))
+        table = parquet.read()
+        self.assertEqual(table.column('amount').to_pylist()[-1], Decimal('87.50'))
+        self.assertEqual(table.column('date').to_pylist()[0], date(2024, 5, 2))
+
+        with pa_ipc.open_file(self.export_file('--format', 'arrow')) as reader:
+            self.assertEqual(reader.num_record_batches, 3)
+            self.assertEqual(reader.read_all().column('student_id').to_pylist(), ['HU-UGR-2023-70000'] * 7)
+
+    def test_export_view_streams_for_admin_staff_only(self):
+        self.client.login(username='dr_export', password='pw')
+        self.assertRedirects(self.client.get('/export/bills/'), '/dashboard/', fetch_redirect_response=False)
+
+        self.client.login(username='epi_admin', password='pw')
+        response = self.client.get('/export/bills/', {'from': '2024-05-07'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="bills.csv.gz"')
+        text = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertEqual(len(text.splitlines()), 3)
+        self.assertEqual(self.client.get('/export/students/').status_code, 404)
+        self.assertEqual(self.client.get('/export/bills/', {'format': 'xlsx'}).status_code, 400)
+
+    def test_unknown_format_fails_before_querying(self):
+        with self.assertNumQueries(0), self.assertRaises(ValueError):
+            TableExport('bills', 'xlsx')
+
+
+class AsyncExportTests(TransactionTestCase):
+    async def test_export_streams_without_buffering_under_asgi(self):
+        staff = await sync_to_async(get_user_model().objects.create_user)(
+            'epi_admin', role='admin', is_staff=True
+        )
+        student = await StudentProfile.objects.acreate(
+            user=await sync_to_async(get_user_model().objects.create_user)('st_async', role='student'),
+            student_id='HU-UGR-2023-71000', college='CNCS', department='Biology', gender='F', year=3
+        )
+        await Bill.objects.abulk_create([
+            Bill(student=student, service=f'Service {i}', amount=Decimal('10.00'), date=date(2024, 5, i))
+            for i in range(1, 6)
+        ])
+        await sync_to_async(self.async_client.force_login)(staff)
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            response = await self.async_client.get('/export/bills/')
+            self.assertTrue(response.is_async)
+            content = b''.join([chunk async for chunk in response])
+        self.assertEqual([str(w.message) for w in caught if 'StreamingHttpResponse' in str(w.message)], [])
+        self.assertEqual(len(gzip.decompress(content).decode().splitlines()), 6)
+
+
+class DatasetGeneratorTests(SimpleTestCase):
+    def generate(self, generator_class, directory, name, **options):
+        generator = generator_class(
+            num_records=options.pop('records', 2500), output_file=os.path.join(directory, name),
+            start_date=generate_large_dataset.START_DATE, seed=7, **options
+        )
+        with redirect_stdout(StringIO()):
+            generator.generate_all_records()
+        return generator
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_seed_gives_identical_output_for_any_chunk_size_and_worker_count(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        outputs = [
+            self.read(self.generate(generate_large_dataset.HealthRecordGenerator, directory, name,
+                                    chunk_size=chunk_size, workers=workers).output_file)
+            for name, chunk_size, workers in (
+                ('one.csv', 2500, 1), ('small.csv', 333, 1), ('pool.csv', 700, 3),
+            )
+        ]
+        self.assertEqual(outputs[0].count(b'\n'), 2501)
+        self.assertEqual(outputs[1], outputs[0])
+        self.assertEqual(outputs[2], outputs[0])
+        other_seed = generate_large_dataset.HealthRecordGenerator(
+            2500, os.path.join(directory, 'other.csv'), generate_large_dataset.START_DATE, seed=8, chunk_size=2500
+        )
+        with redirect_stdout(StringIO()):
+            other_seed.generate_all_records()
+        self.assertNotEqual(self.read(other_seed.output_file), outputs[0])
+
+    def test_visit_histories_do_not_depend_on_chunking(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        runs = [
+            self.generate(generate_large_dataset.MultiVisitRecordGenerator, directory, f'visits{n}.csv',
+                          records=1200, chunk_size=chunk_size, workers=workers)
+            for n, (chunk_size, workers) in enumerate([(1200, 1), (250, 2)])
+        ]
+        for fmt in ('csv', 'prescriptions', 'dispenses'):
+            self.assertEqual(self.read(runs[1].output_path(fmt)), self.read(runs[0].output_path(fmt)), fmt)
+
+    @unittest.skipUnless(pyarrow, 'needs pyarrow')
+    def test_vectorized_parquet_and_arrow_round_trip(self):
+        import pyarrow.ipc as pa_ipc
+        import pyarrow.parquet as pq
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        generator = self.generate(generate_large_dataset.VectorizedRecordGenerator, directory, 'records.csv',
+                                  records=250, chunk_size=100, workers=1, formats=('csv', 'parquet', 'arrow'))
+        with open(generator.output_path('csv'), newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 250)
+
+        parquet = pq.ParquetFile(generator.output_path('parquet'))
+        self.assertEqual((parquet.metadata.num_rows, parquet.metadata.num_row_groups), (250, 3))
+        with pa_ipc.open_file(generator.output_path('arrow')) as reader:
+            self.assertEqual(reader.num_record_batches, 3)
+            arrow = reader.read_all()
+        for table in (parquet.read(), arrow):
+            self.assertEqual(table.column_names, generator.fieldnames)
+            for field in ('student_id', 'appointment_date', 'consultation_id', 'amount', 'year'):
+                self.assertEqual([str(value) for value in table.column(field).to_pylist()],
+                                 [row[field] for row in rows], field)
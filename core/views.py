@@ -1,5 +1,14 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
 from django.shortcuts import render, redirect
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+from .exporter import TABLES, TableExport
 
 def home(request):
     if request.user.is_authenticated:
@@ -23,3 +32,51 @@ def dashboard(request):
         return redirect('/admin/') # Or a custom admin dashboard
     else:
         return render(request, 'core/dashboard.html') # Fallback
+
+async def iterate_in_thread(iterable):
+    """
+    Async iterator over a blocking iterable, so ASGI servers stream it
+    instead of buffering it whole. Every next() runs on one dedicated
+    thread, keeping the database cursor the iterable holds on one connection.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    iterator = iter(iterable)
+    done = object()
+    step = sync_to_async(next, thread_sensitive=False, executor=executor)
+
+    def finish():
+        if hasattr(iterator, 'close'):
+            iterator.close()
+        connections.close_all()
+
+    try:
+        while (chunk := await step(iterator, done)) is not done:
+            yield chunk
+    finally:
+        await sync_to_async(finish, thread_sensitive=False, executor=executor)()
+        executor.shutdown()
+
+@login_required
+def export_table(request, table):
+    """Stream a whole clinical table as ?format=csv|parquet|arrow, optionally limited by ?from= and ?to="""
+    # Whole-population exports are for admin-site staff, like the changelists they replace
+    if not request.user.is_staff:
+        messages.error(request, 'Access denied.')
+        return redirect('dashboard')
+    if table not in TABLES:
+        raise Http404(f"No table {table}")
+
+    try:
+        start, end = (
+            datetime.date.fromisoformat(request.GET[key]) if request.GET.get(key) else None
+            for key in ('from', 'to')
+        )
+        export = TableExport(table, request.GET.get('format', 'csv'), start, end)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    # Django 4.2 buffers a synchronous iterator whole when serving over ASGI
+    content = iterate_in_thread(export) if isinstance(request, ASGIRequest) else export
+    response = StreamingHttpResponse(content, content_type=export.content_type)
+    response['Content-Disposition'] = f'attachment; filename="{export.filename}"'
+    return response
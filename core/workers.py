@@ -0,0 +1,17 @@
+"""
+Process pool initializer for commands that fan work out to processes
+
+It lives apart from the modules it serves because a spawned worker
+imports it before Django is set up, when no model may be imported yet.
+"""
+import django
+from django.conf import settings
+
+
+def setup_worker(database_name):
+    """
+    Set up Django on the database the parent process is using (which,
+    under the test runner, is the test database)
+    """
+    settings.DATABASES['default']['NAME'] = database_name
+    django.setup()
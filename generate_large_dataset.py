@@ -1,11 +1,47 @@
 """
 Generate 20,000 student health records for Haramaya University Health Center
 Clean and organized data generator for testing the health management system
+
+Usage: python generate_large_dataset.py [--records N] [--output PATH] [--seed S]
+                                        [--workers N] [--chunk-size N] [--parts]
+                                        [--mode python|numpy|visits] [--formats csv,parquet,arrow]
+                                        [--years N] [--visit-alpha A] [--doctor-skew S]
+
+Records are generated in chunks, but seeded in blocks of SEED_BLOCK records,
+each block with its own seed derived from --seed, so a given seed always
+produces byte-identical output whatever the chunk size or number of worker
+processes. --mode numpy draws whole columns at once (NumPy required), seeded
+per chunk, so its output depends on --chunk-size; it can also write
+Parquet / Arrow IPC (pyarrow required).
+
+--mode visits treats --records as a number of students and gives each a
+heavy-tailed number of visits spread over --years, with a skewed doctor
+load, plus prescriptions, dispense records and a drug list in
+<output>_prescriptions.csv, <output>_dispenses.csv and <output>_drugs.csv
+(load them with manage.py import_csv, then manage.py import_pharmacy).
 """
+import argparse
 import csv
+import hashlib
 import random
 import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from itertools import accumulate
+
+try:
+    import numpy as np
+except ImportError:  # Only needed for --mode numpy
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:  # Only needed for Parquet / Arrow output
+    pa = None
 
 
 # ============================================================================
@@ -15,6 +51,20 @@ NUM_RECORDS = 20000
 OUTPUT_FILE = 'data/complete_health_records.csv'
 START_DATE = datetime(2024, 1, 1)
 DATE_RANGE_DAYS = 365
+CHUNK_SIZE = 50000
+SEED_BLOCK = 1000      # Records per seed; changing it changes every seeded dataset
+
+FORMAT_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+PARQUET_COMPRESSION = 'zstd'
+ARROW_COMPRESSION = 'zstd'
+
+# --mode visits
+MULTI_YEAR_START = datetime(2021, 1, 1)
+DEFAULT_YEARS = 4
+VISIT_ALPHA = 1.5      # Pareto shape for visits per student; lower = heavier tail
+MAX_VISITS = 100
+DOCTOR_SKEW = 1.2      # Zipf exponent for doctor load; 0 = uniform
+DISPENSE_RATE = 0.85   # Share of prescriptions that are dispensed
 
 
 # ============================================================================
@@ -92,6 +142,25 @@ class DataPool:
     STATUSES = ['Pending', 'Approved', 'Completed', 'Cancelled']
     
     BILL_STATUSES = ['Paid', 'Pending']
+    
+    DRUGS = [
+        ('Paracetamol 500mg', 'tablets'), ('Amoxicillin 500mg', 'capsules'),
+        ('Artemether/Lumefantrine', 'tablets'), ('Oral Rehydration Salts', 'sachets'),
+        ('Ibuprofen 400mg', 'tablets'), ('Ciprofloxacin 500mg', 'tablets'),
+        ('Metronidazole 250mg', 'tablets'), ('Omeprazole 20mg', 'capsules'),
+        ('Cetirizine 10mg', 'tablets'), ('Salbutamol Inhaler', 'inhalers'),
+        ('Ferrous Sulfate', 'tablets'), ('Chloramphenicol Eye Drops', 'bottles'),
+        ('Cough Syrup', 'bottles'), ('Hydrocortisone Cream', 'tubes'),
+        ('Vitamin B Complex', 'tablets'), ('Doxycycline 100mg', 'capsules')
+    ]
+    
+    DOSAGES = ['1 x 2 daily', '1 x 3 daily', '2 x 2 daily', '1 daily', 'As needed']
+    
+    INSTRUCTIONS = ['After meals', 'Before meals', 'With plenty of water', 'For 5 days', 'For 7 days', '']
+    
+    DISPENSE_QUANTITIES = [6, 10, 12, 14, 20, 21, 30]
+    
+    PHARMACISTS = ['Abdi', 'Meron', 'Yonas', 'Selam']
 
 
 # ============================================================================
@@ -101,9 +170,9 @@ class Generator:
     """Helper functions for generating realistic data"""
     
     @staticmethod
-    def phone_number():
+    def phone_number(rng=random):
         """Generate Ethiopian phone number (09XXXXXXXX)"""
-        return f"09{random.randint(10000000, 99999999)}"
+        return f"09{rng.randint(10000000, 99999999)}"
     
     @staticmethod
     def student_id(index, year):
@@ -111,27 +180,33 @@ class Generator:
         return f"HU-UGR-{year}-{10000 + index:05d}"
     
     @staticmethod
-    def date(base_date, days_range):
+    def date(base_date, days_range, rng=random):
         """Generate random date within range"""
-        random_days = random.randint(0, days_range)
+        random_days = rng.randint(0, days_range)
         return (base_date + timedelta(days=random_days)).strftime('%Y-%m-%d')
     
     @staticmethod
-    def time():
+    def time(rng=random):
         """Generate appointment time (8:00 AM - 4:30 PM)"""
-        hour = random.randint(8, 16)
-        minute = random.choice([0, 30])
+        hour = rng.randint(8, 16)
+        minute = rng.choice([0, 30])
         return f"{hour:02d}:{minute:02d}"
     
     @staticmethod
-    def full_name(gender):
+    def full_name(gender, rng=random):
         """Generate full name based on gender"""
         if gender == 'M':
-            first_name = random.choice(DataPool.FIRST_NAMES_MALE)
+            first_name = rng.choice(DataPool.FIRST_NAMES_MALE)
         else:
-            first_name = random.choice(DataPool.FIRST_NAMES_FEMALE)
-        last_name = random.choice(DataPool.LAST_NAMES)
+            first_name = rng.choice(DataPool.FIRST_NAMES_FEMALE)
+        last_name = rng.choice(DataPool.LAST_NAMES)
         return f"{first_name} {last_name}"
+    
+    @staticmethod
+    def chunk_seed(seed, chunk_index):
+        """Derive an independent, reproducible seed for one chunk (or seed block)"""
+        digest = hashlib.sha256(f"{seed}:{chunk_index}".encode()).digest()
+        return int.from_bytes(digest[:8], 'big')
 
 
 # ============================================================================
@@ -140,10 +215,18 @@ class Generator:
 class HealthRecordGenerator:
     """Main class for generating health records"""
     
-    def __init__(self, num_records, output_file, start_date):
+    def __init__(self, num_records, output_file, start_date, seed=None, workers=1,
+                 chunk_size=CHUNK_SIZE, parts=False, days_range=DATE_RANGE_DAYS):
         self.num_records = num_records
         self.output_file = output_file
         self.start_date = start_date
+        self.seed = seed if seed is not None else random.SystemRandom().randrange(2 ** 32)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.parts = parts
+        self.days_range = days_range
+        self.formats = ('csv',)
+        self.rng = random.Random(self.seed)
         self.fieldnames = [
             'student_id', 'full_name', 'college', 'department', 'phone', 'gender', 'year',
             'appointment_id', 'appointment_doctor', 'appointment_date', 'appointment_time',
@@ -155,33 +238,33 @@ class HealthRecordGenerator:
     
     def generate_student_info(self, index):
         """Generate student information"""
-        gender = random.choice(['M', 'F'])
-        college = random.choice(DataPool.COLLEGES)
-        department = random.choice(DataPool.DEPARTMENTS.get(college, ['General']))
-        year = random.randint(1, 5)
-        student_year = random.randint(2021, 2024)
+        gender = self.rng.choice(['M', 'F'])
+        college = self.rng.choice(DataPool.COLLEGES)
+        department = self.rng.choice(DataPool.DEPARTMENTS.get(college, ['General']))
+        year = self.rng.randint(1, 5)
+        student_year = self.rng.randint(2021, 2024)
         
         return {
             'student_id': Generator.student_id(index, student_year),
-            'full_name': Generator.full_name(gender),
+            'full_name': Generator.full_name(gender, self.rng),
             'college': college,
             'department': department,
-            'phone': Generator.phone_number(),
+            'phone': Generator.phone_number(self.rng),
             'gender': gender,
             'year': year
         }
     
     def generate_appointment_info(self, index):
         """Generate appointment information"""
-        apt_date = Generator.date(self.start_date, DATE_RANGE_DAYS)
+        apt_date = Generator.date(self.start_date, self.days_range, self.rng)
         
         return {
             'appointment_id': f"APT-{10000 + index:05d}",
-            'appointment_doctor': random.choice(DataPool.DOCTORS),
+            'appointment_doctor': self.rng.choice(DataPool.DOCTORS),
             'appointment_date': apt_date,
-            'appointment_time': Generator.time(),
-            'appointment_reason': random.choice(DataPool.APPOINTMENT_REASONS),
-            'appointment_status': random.choice(DataPool.STATUSES),
+            'appointment_time': Generator.time(self.rng),
+            'appointment_reason': self.rng.choice(DataPool.APPOINTMENT_REASONS),
+            'appointment_status': self.rng.choice(DataPool.STATUSES),
             'date': apt_date
         }
     
@@ -198,9 +281,9 @@ class HealthRecordGenerator:
         
         return {
             'consultation_id': f"CONS-{10000 + index:05d}",
-            'symptoms': random.choice(DataPool.SYMPTOMS),
-            'diagnosis': random.choice(DataPool.DIAGNOSES),
-            'consultation_doctor': random.choice(DataPool.DOCTORS),
+            'symptoms': self.rng.choice(DataPool.SYMPTOMS),
+            'diagnosis': self.rng.choice(DataPool.DIAGNOSES),
+            'consultation_doctor': self.rng.choice(DataPool.DOCTORS),
             'consultation_date': ''  # Will be set to appointment date
         }
     
@@ -208,9 +291,9 @@ class HealthRecordGenerator:
         """Generate lab test information"""
         return {
             'lab_test_id': f"LAB-{10000 + index:05d}",
-            'test_type': random.choice(DataPool.TEST_TYPES),
-            'test_result': random.choice(DataPool.TEST_RESULTS),
-            'lab_technician': random.choice(DataPool.TECHNICIANS),
+            'test_type': self.rng.choice(DataPool.TEST_TYPES),
+            'test_result': self.rng.choice(DataPool.TEST_RESULTS),
+            'lab_technician': self.rng.choice(DataPool.TECHNICIANS),
             'lab_date': ''  # Will be set to appointment date
         }
     
@@ -218,9 +301,9 @@ class HealthRecordGenerator:
         """Generate billing information"""
         return {
             'bill_id': f"BILL-{10000 + index:05d}",
-            'service': random.choice(DataPool.SERVICES),
-            'amount': random.choice(DataPool.SERVICE_AMOUNTS),
-            'bill_status': random.choice(DataPool.BILL_STATUSES),
+            'service': self.rng.choice(DataPool.SERVICES),
+            'amount': self.rng.choice(DataPool.SERVICE_AMOUNTS),
+            'bill_status': self.rng.choice(DataPool.BILL_STATUSES),
             'bill_date': ''  # Will be set to appointment date
         }
     
@@ -229,7 +312,7 @@ class HealthRecordGenerator:
         # Generate all components
         student = self.generate_student_info(index)
         appointment = self.generate_appointment_info(index)
-        has_consultation = random.random() > 0.3  # 70% have consultations
+        has_consultation = self.rng.random() > 0.3  # 70% have consultations
         consultation = self.generate_consultation_info(index, has_consultation)
         lab = self.generate_lab_info(index)
         billing = self.generate_billing_info(index)
@@ -255,41 +338,464 @@ class HealthRecordGenerator:
             os.makedirs(output_dir)
             print(f"📁 Created directory: {output_dir}")
     
+    def output_path(self, fmt):
+        """Final output path for one format (CSV uses output_file as given)"""
+        if fmt == 'csv':
+            return self.output_file
+        return f"{os.path.splitext(self.output_file)[0]}{FORMAT_EXTENSIONS[fmt]}"
+    
+    def chunk_path(self, chunk_index, fmt='csv'):
+        """Numbered part file for one chunk, next to the output file"""
+        root = os.path.splitext(self.output_file)[0]
+        return f"{root}.part-{chunk_index:05d}{FORMAT_EXTENSIONS[fmt]}"
+    
+    def chunks(self):
+        """(chunk_index, first_index, stop_index) for every chunk"""
+        for chunk_index, start in enumerate(range(0, self.num_records, self.chunk_size)):
+            yield chunk_index, start, min(start + self.chunk_size, self.num_records)
+    
+    def seeded_indexes(self, start, stop):
+        """
+        Yield start .. stop - 1 with self.rng reseeded at every SEED_BLOCK
+        boundary, so each record depends only on the seed and its index
+        """
+        for i in range(start - start % SEED_BLOCK, stop):
+            if i % SEED_BLOCK == 0:
+                self.rng = random.Random(Generator.chunk_seed(self.seed, i // SEED_BLOCK))
+            if i < start:
+                # The chunk starts mid-block: replay the block's earlier draws
+                self.skip_record(i)
+                continue
+            yield i
+    
+    def skip_record(self, index):
+        """Make the draws of one record without writing it"""
+        self.generate_record(index)
+    
+    def generate_chunk(self, chunk):
+        """Write one chunk of records to its part file, returning ({format: path}, count)"""
+        chunk_index, start, stop = chunk
+        path = self.chunk_path(chunk_index)
+        
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if self.parts:
+                writer.writerow(self.header('csv'))
+            for i in self.seeded_indexes(start, stop):
+                record = self.generate_record(i)
+                writer.writerow([record[field] for field in self.fieldnames])
+        
+        return {'csv': path}, stop - start
+    
     def generate_all_records(self):
-        """Generate all records and write to CSV file"""
+        """Generate all records and write them in every requested format"""
         self.ensure_output_directory()
         
         print(f"🏥 Generating {self.num_records:,} student health records...")
-        print(f"📝 Output file: {self.output_file}\n")
+        print(f"📝 Output file: {self.output_file}")
+        print(f"🎲 Seed: {self.seed} | Workers: {self.workers} | Chunk size: {self.chunk_size:,}\n")
         
-        with open(self.output_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=self.fieldnames)
-            writer.writeheader()
-            
-            for i in range(self.num_records):
-                record = self.generate_record(i)
-                writer.writerow(record)
-                
-                # Progress indicator
-                if (i + 1) % 1000 == 0:
-                    print(f"✓ Generated {i + 1:,} records...")
+        chunks = list(self.chunks())
+        if self.workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                parts = self.collect_chunks(pool.map(self.generate_chunk, chunks))
+        else:
+            parts = self.collect_chunks(map(self.generate_chunk, chunks))
         
         print(f"\n✅ Successfully generated {self.num_records:,} student health records!")
-        print(f"📁 File saved: {self.output_file}")
-        print(f"💾 File size: {os.path.getsize(self.output_file) / (1024*1024):.2f} MB")
+        for fmt in self.formats:
+            paths = [chunk_paths[fmt] for chunk_paths in parts]
+            if self.parts:
+                total_size = sum(os.path.getsize(path) for path in paths)
+                print(f"📁 {fmt}: {len(paths)} part files next to {self.output_path(fmt)} "
+                      f"({total_size / (1024*1024):.2f} MB)")
+                continue
+            self.merge_parts(fmt, paths)
+            print(f"📁 File saved: {self.output_path(fmt)}")
+            print(f"💾 File size: {os.path.getsize(self.output_path(fmt)) / (1024*1024):.2f} MB")
+    
+    def header(self, fmt):
+        """Column names of one output"""
+        return self.fieldnames
+    
+    def merge_parts(self, fmt, paths):
+        """Concatenate CSV part files, in chunk order, into the output file"""
+        with open(self.output_path(fmt), 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(self.header(fmt))
+        with open(self.output_path(fmt), 'ab') as out:
+            for path in paths:
+                with open(path, 'rb') as part:
+                    shutil.copyfileobj(part, out)
+                os.remove(path)
+    
+    def collect_chunks(self, results):
+        """Consume chunk results in order, printing progress"""
+        parts = []
+        generated = 0
+        for chunk_paths, count in results:
+            parts.append(chunk_paths)
+            generated += count
+            print(f"✓ Generated {generated:,} records...")
+        return parts
+
+
+class VectorizedRecordGenerator(HealthRecordGenerator):
+    """
+    Draws whole columns at once with NumPy instead of one record at a time.
+    
+    Produces the same columns and value distributions as HealthRecordGenerator
+    (not the same values), and can also write compressed Parquet and Arrow IPC.
+    """
+    
+    def __init__(self, *args, formats=('csv',), **kwargs):
+        if np is None:
+            raise ImportError("NumPy is required for --mode numpy (pip install numpy)")
+        if set(formats) - {'csv'} and pa is None:
+            raise ImportError("pyarrow is required for Parquet/Arrow output (pip install pyarrow)")
+        super().__init__(*args, **kwargs)
+        self.formats = tuple(formats)
+    
+    def generate_columns(self, chunk_index, start, stop):
+        """Generate one chunk as a dict of column name -> NumPy array"""
+        rng = np.random.default_rng([self.seed, chunk_index])
+        n = stop - start
+        
+        def pick(pool):
+            return np.asarray(pool)[rng.integers(0, len(pool), n)]
+        
+        def keyed(prefix, index):
+            return np.char.add(prefix, np.char.zfill((10000 + index).astype(str), 5))
+        
+        index = np.arange(start, stop)
+        
+        # Student
+        gender = pick(['M', 'F'])
+        first_name = np.where(gender == 'M', pick(DataPool.FIRST_NAMES_MALE),
+                              pick(DataPool.FIRST_NAMES_FEMALE))
+        college_idx = rng.integers(0, len(DataPool.COLLEGES), n)
+        departments = [DataPool.DEPARTMENTS.get(c, ['General']) for c in DataPool.COLLEGES]
+        counts = np.asarray([len(d) for d in departments])
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        flat_departments = np.asarray([d for group in departments for d in group])
+        department_idx = offsets[college_idx] + (rng.random(n) * counts[college_idx]).astype(np.int64)
+        student_year = rng.integers(2021, 2025, n).astype(str)
+        
+        # Appointment; dates are shared by consultation, lab and bill
+        dates = (np.datetime64(self.start_date.date())
+                 + rng.integers(0, self.days_range + 1, n)).astype(str)
+        slots = np.asarray([f"{h:02d}:{m:02d}" for h in range(8, 17) for m in (0, 30)])
+        has_consultation = rng.random(n) > 0.3
+        
+        def consultation(values):
+            return np.where(has_consultation, values, '')
+        
+        return {
+            'student_id': keyed(np.char.add(np.char.add('HU-UGR-', student_year), '-'), index),
+            'full_name': np.char.add(np.char.add(first_name, ' '), pick(DataPool.LAST_NAMES)),
+            'college': np.asarray(DataPool.COLLEGES)[college_idx],
+            'department': flat_departments[department_idx],
+            'phone': np.char.add('09', rng.integers(10000000, 100000000, n).astype(str)),
+            'gender': gender,
+            'year': rng.integers(1, 6, n),
+            'appointment_id': keyed('APT-', index),
+            'appointment_doctor': pick(DataPool.DOCTORS),
+            'appointment_date': dates,
+            'appointment_time': slots[rng.integers(0, len(slots), n)],
+            'appointment_reason': pick(DataPool.APPOINTMENT_REASONS),
+            'appointment_status': pick(DataPool.STATUSES),
+            'consultation_id': consultation(keyed('CONS-', index)),
+            'symptoms': consultation(pick(DataPool.SYMPTOMS)),
+            'diagnosis': consultation(pick(DataPool.DIAGNOSES)),
+            'consultation_doctor': consultation(pick(DataPool.DOCTORS)),
+            'consultation_date': consultation(dates),
+            'lab_test_id': keyed('LAB-', index),
+            'test_type': pick(DataPool.TEST_TYPES),
+            'test_result': pick(DataPool.TEST_RESULTS),
+            'lab_technician': pick(DataPool.TECHNICIANS),
+            'lab_date': dates,
+            'bill_id': keyed('BILL-', index),
+            'service': pick(DataPool.SERVICES),
+            'amount': pick(DataPool.SERVICE_AMOUNTS),
+            'bill_status': pick(DataPool.BILL_STATUSES),
+            'bill_date': dates,
+        }
+    
+    def generate_chunk(self, chunk):
+        """Write one chunk in every requested format, returning ({format: path}, count)"""
+        chunk_index, start, stop = chunk
+        columns = self.generate_columns(chunk_index, start, stop)
+        paths = {fmt: self.chunk_path(chunk_index, fmt) for fmt in self.formats}
+        
+        if pa is None:
+            with open(paths['csv'], 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                if self.parts:
+                    writer.writerow(self.header('csv'))
+                writer.writerows(zip(*(columns[field].tolist() for field in self.fieldnames)))
+            return paths, stop - start
+        
+        table = pa.table({field: columns[field] for field in self.fieldnames})
+        for fmt, path in paths.items():
+            if fmt == 'csv':
+                pa_csv.write_csv(table, path, pa_csv.WriteOptions(
+                    include_header=self.parts, quoting_style='none'
+                ))
+            elif fmt == 'parquet':
+                pq.write_table(table, path, compression=PARQUET_COMPRESSION)
+            else:
+                with pa_ipc.new_file(path, table.schema, options=pa_ipc.IpcWriteOptions(compression=ARROW_COMPRESSION)) as writer:
+                    writer.write_table(table)
+        return paths, stop - start
+    
+    def merge_parts(self, fmt, paths):
+        """Stream part files into one output file, one row group / batch per chunk"""
+        if fmt == 'csv':
+            return super().merge_parts(fmt, paths)
+        
+        writer = None
+        try:
+            for path in paths:
+                if fmt == 'parquet':
+                    table = pq.read_table(path)
+                    if writer is None:
+                        writer = pq.ParquetWriter(self.output_path(fmt), table.schema,
+                                                  compression=PARQUET_COMPRESSION)
+                else:
+                    with pa_ipc.open_file(path) as reader:
+                        table = reader.read_all()
+                    if writer is None:
+                        writer = pa_ipc.new_file(self.output_path(fmt), table.schema,
+                                                 options=pa_ipc.IpcWriteOptions(compression=ARROW_COMPRESSION))
+                writer.write_table(table)
+                os.remove(path)
+        finally:
+            if writer is not None:
+                writer.close()
+
 
+class MultiVisitRecordGenerator(HealthRecordGenerator):
+    """
+    Students with long, skewed visit histories instead of one visit each.
+    
+    num_records counts students. Each draws a Pareto-distributed number of
+    visits (most come once or twice, a few dozens of times), dated after
+    their enrollment and sorted. Doctors are picked with Zipf weights so a
+    few carry most of the load. Completed visits get a consultation, most
+    consultations prescribe drugs, and most prescriptions are dispensed.
+    Every row keeps the import_csv columns; the extra entities go to their
+    own CSV files keyed by the visit's natural keys.
+    """
+    
+    PRESCRIPTION_FIELDS = ['prescription_id', 'consultation_id', 'drug_name', 'dosage', 'instructions']
+    DISPENSE_FIELDS = ['dispense_id', 'student_id', 'drug_name', 'quantity', 'pharmacist', 'date']
+    DRUG_FIELDS = ['name', 'unit', 'stock', 'expiry_date']
+    
+    def __init__(self, *args, years=DEFAULT_YEARS, visit_alpha=VISIT_ALPHA,
+                 max_visits=MAX_VISITS, doctor_skew=DOCTOR_SKEW, **kwargs):
+        kwargs.setdefault('days_range', 365 * years)
+        super().__init__(*args, **kwargs)
+        self.formats = ('csv', 'prescriptions', 'dispenses')
+        self.visit_alpha = visit_alpha
+        self.max_visits = max_visits
+        self.doctor_weights = list(accumulate(
+            1 / rank ** doctor_skew for rank in range(1, len(DataPool.DOCTORS) + 1)
+        ))
+        self.end_date = self.start_date + timedelta(days=self.days_range)
+        self.visits_written = 0
+    
+    def output_path(self, fmt):
+        if fmt == 'csv':
+            return self.output_file
+        return f"{os.path.splitext(self.output_file)[0]}_{fmt}.csv"
+    
+    def chunk_path(self, chunk_index, fmt='csv'):
+        root = os.path.splitext(self.output_file)[0]
+        suffix = '.csv' if fmt == 'csv' else f'_{fmt}.csv'
+        return f"{root}.part-{chunk_index:05d}{suffix}"
+    
+    def header(self, fmt):
+        return {
+            'csv': self.fieldnames,
+            'prescriptions': self.PRESCRIPTION_FIELDS,
+            'dispenses': self.DISPENSE_FIELDS,
+        }[fmt]
+    
+    def doctor(self):
+        return self.rng.choices(DataPool.DOCTORS, cum_weights=self.doctor_weights)[0]
+    
+    def visit_count(self):
+        return min(int(self.rng.paretovariate(self.visit_alpha)), self.max_visits)
+    
+    def visit_dates(self, student_id, count):
+        """Sorted visit dates between the student's enrollment (September of their ID year) and the end date"""
+        enrolled = datetime(int(student_id.split('-')[2]), 9, 1)
+        first = max(self.start_date, min(enrolled, self.end_date))
+        span = (self.end_date - first).days
+        return sorted(first + timedelta(days=self.rng.randint(0, span)) for _ in range(count))
+    
+    def generate_visits(self, index):
+        """Yield (record, prescriptions, dispenses) for every visit of one student"""
+        student = self.generate_student_info(index)
+        dates = self.visit_dates(student['student_id'], self.visit_count())
+        
+        for visit, visit_date in enumerate(dates, 1):
+            key = f"{index:07d}-{visit:03d}"
+            apt_date = visit_date.strftime('%Y-%m-%d')
+            # Only the latest visit can still be open
+            if visit == len(dates):
+                status = self.rng.choice(DataPool.STATUSES)
+            else:
+                status = 'Completed' if self.rng.random() < 0.9 else 'Cancelled'
+            has_consultation = status == 'Completed'
+            
+            record = {
+                **student,
+                'appointment_id': f"APT-{key}",
+                'appointment_doctor': self.doctor(),
+                'appointment_date': apt_date,
+                'appointment_time': Generator.time(self.rng),
+                'appointment_reason': self.rng.choice(DataPool.APPOINTMENT_REASONS),
+                'appointment_status': status,
+                **self.generate_consultation_info(index, has_consultation),
+                **self.generate_lab_info(index),
+                **self.generate_billing_info(index),
+            }
+            record.update(lab_test_id=f"LAB-{key}", lab_date=apt_date,
+                          bill_id=f"BILL-{key}", bill_date=apt_date)
+            
+            prescriptions, dispenses = [], []
+            if has_consultation:
+                record.update(consultation_id=f"CONS-{key}", consultation_date=apt_date,
+                              consultation_doctor=record['appointment_doctor'])
+                drugs = self.rng.sample(DataPool.DRUGS, self.rng.choice([0, 1, 1, 2, 2, 3]))
+                for n, (drug_name, _) in enumerate(drugs, 1):
+                    prescriptions.append([
+                        f"RX-{key}-{n}", record['consultation_id'], drug_name,
+                        self.rng.choice(DataPool.DOSAGES), self.rng.choice(DataPool.INSTRUCTIONS)
+                    ])
+                    if self.rng.random() < DISPENSE_RATE:
+                        dispensed = visit_date + timedelta(days=self.rng.choice([0, 0, 0, 1]))
+                        dispenses.append([
+                            f"DSP-{key}-{n}", student['student_id'], drug_name,
+                            self.rng.choice(DataPool.DISPENSE_QUANTITIES),
+                            self.rng.choice(DataPool.PHARMACISTS), dispensed.strftime('%Y-%m-%d')
+                        ])
+            yield record, prescriptions, dispenses
+    
+    def skip_record(self, index):
+        for _ in self.generate_visits(index):
+            pass
+    
+    def generate_chunk(self, chunk):
+        """Write one chunk of students to visit, prescription and dispense part files"""
+        chunk_index, start, stop = chunk
+        paths = {fmt: self.chunk_path(chunk_index, fmt) for fmt in self.formats}
+        files = {fmt: open(path, 'w', newline='', encoding='utf-8') for fmt, path in paths.items()}
+        visits = 0
+        try:
+            writers = {fmt: csv.writer(f) for fmt, f in files.items()}
+            if self.parts:
+                for fmt, writer in writers.items():
+                    writer.writerow(self.header(fmt))
+            for i in self.seeded_indexes(start, stop):
+                for record, prescriptions, dispenses in self.generate_visits(i):
+                    writers['csv'].writerow([record[field] for field in self.fieldnames])
+                    writers['prescriptions'].writerows(prescriptions)
+                    writers['dispenses'].writerows(dispenses)
+                    visits += 1
+        finally:
+            for f in files.values():
+                f.close()
+        return paths, visits
+    
+    def collect_chunks(self, results):
+        parts = []
+        students = 0
+        for chunk_paths, visits in results:
+            parts.append(chunk_paths)
+            students += self.chunk_size
+            self.visits_written += visits
+            print(f"✓ Generated {min(students, self.num_records):,} students, "
+                  f"{self.visits_written:,} visits...")
+        return parts
+    
+    def generate_all_records(self):
+        super().generate_all_records()
+        self.write_drugs()
+        print(f"📊 {self.visits_written:,} visits from "
+              f"{self.start_date:%Y-%m-%d} to {self.end_date:%Y-%m-%d}")
+    
+    def write_drugs(self):
+        """The drug list every prescription and dispense record refers to"""
+        rng = random.Random(self.seed)
+        expiry = self.end_date + timedelta(days=365)
+        with open(self.output_path('drugs'), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.DRUG_FIELDS)
+            for name, unit in DataPool.DRUGS:
+                writer.writerow([name, unit, rng.randint(50, 2000),
+                                 (expiry + timedelta(days=rng.randint(0, 365))).strftime('%Y-%m-%d')])
+        print(f"📁 File saved: {self.output_path('drugs')}")
 
 
 # ============================================================================
 # MAIN EXECUTION
 # ============================================================================
+def parse_args():
+    """Command line options; defaults match the original 20k-record fixture"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=NUM_RECORDS, help='Number of records to generate')
+    parser.add_argument('--output', default=OUTPUT_FILE, help='Output CSV path')
+    parser.add_argument('--seed', type=int, help='Seed for reproducible output (random if omitted)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Records per chunk')
+    parser.add_argument('--parts', action='store_true',
+                        help='Keep numbered part files instead of concatenating them')
+    parser.add_argument('--mode', choices=['python', 'numpy', 'visits'], default='python',
+                        help='Generate record by record, column by column with NumPy, or as '
+                             'multi-visit student histories (--records then counts students)')
+    parser.add_argument('--formats', default='csv',
+                        help=f"Comma-separated outputs for --mode numpy: {', '.join(FORMAT_EXTENSIONS)}")
+    parser.add_argument('--years', type=int, default=DEFAULT_YEARS,
+                        help=f'--mode visits: years of history from {MULTI_YEAR_START:%Y-%m-%d}')
+    parser.add_argument('--visit-alpha', type=float, default=VISIT_ALPHA,
+                        help='--mode visits: Pareto shape of visits per student (lower = heavier tail)')
+    parser.add_argument('--doctor-skew', type=float, default=DOCTOR_SKEW,
+                        help='--mode visits: Zipf exponent of doctor load (0 = uniform)')
+    args = parser.parse_args()
+    
+    args.formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    unknown = set(args.formats) - set(FORMAT_EXTENSIONS)
+    if unknown:
+        parser.error(f"unknown formats: {', '.join(sorted(unknown))}")
+    if args.mode != 'numpy' and args.formats != ['csv']:
+        parser.error('Parquet / Arrow output needs --mode numpy')
+    if args.years < 1 or args.visit_alpha <= 0:
+        parser.error('--years must be at least 1 and --visit-alpha positive')
+    return args
+
+
 def main():
     """Main function to run the generator"""
-    generator = HealthRecordGenerator(
-        num_records=NUM_RECORDS,
-        output_file=OUTPUT_FILE,
-        start_date=START_DATE
+    args = parse_args()
+    options = dict(
+        num_records=args.records,
+        output_file=args.output,
+        start_date=START_DATE,
+        seed=args.seed,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        parts=args.parts
     )
+    if args.mode == 'numpy':
+        generator = VectorizedRecordGenerator(formats=args.formats, **options)
+    elif args.mode == 'visits':
+        options['start_date'] = MULTI_YEAR_START
+        generator = MultiVisitRecordGenerator(
+            years=args.years, visit_alpha=args.visit_alpha, doctor_skew=args.doctor_skew, **options
+        )
+    else:
+        generator = HealthRecordGenerator(**options)
     generator.generate_all_records()
 
 
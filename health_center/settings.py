@@ -108,6 +108,20 @@ DATABASES = {
 }
 
 
+# Cache: analytics report versions, patient timelines, the staff directory.
+# The default LocMemCache is per process, so with several web workers, or a
+# cron job or management command invalidating, the other processes keep
+# serving stale entries (and 304s). Deployments running more than one process
+# must set CACHE_TABLE to share a database cache; build.sh creates the table.
+CACHE_TABLE = os.environ.get('CACHE_TABLE')
+if CACHE_TABLE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': CACHE_TABLE,
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -178,3 +192,19 @@ if not DEBUG:
     SECURE_HSTS_INCLUDE_SUBDOMAINS = True
     SECURE_HSTS_PRELOAD = True
 
+
+# Analytics API (analytics/views.py): read-only, throttled per user so one
+# dashboard cannot crowd out the clinic's own requests
+REST_FRAMEWORK = {
+    'DEFAULT_THROTTLE_RATES': {
+        'analytics': os.environ.get('ANALYTICS_API_RATE', '60/minute'),
+    },
+}
+
+
+# Live appointment events (appointments/events.py). The in-process broker only
+# reaches clients of the same worker; use the PostgreSQL broker when running
+# several workers against PostgreSQL.
+APPOINTMENT_EVENTS_BROKER = os.environ.get(
+    'APPOINTMENT_EVENTS_BROKER', 'appointments.events.InProcessBroker'
+)
@@ -9,6 +9,9 @@ urlpatterns = [
     path('students/', include('students.urls')),
     path('appointments/', include('appointments.urls')),
     path('medical/', include('medical.urls')),
+    path('pharmacy/', include('pharmacy.urls')),
+    path('billing/', include('billing.urls')),
+    path('api/analytics/', include('analytics.urls')),
     path('accounts/', include('django.contrib.auth.urls')), # Built-in auth urls
 ]
 
@@ -1,9 +1,12 @@
 from django.contrib import admin
 from .models import LabTest
+from accounts.directory import StaffDirectoryAdminMixin
 
 @admin.register(LabTest)
-class LabTestAdmin(admin.ModelAdmin):
+class LabTestAdmin(StaffDirectoryAdminMixin, admin.ModelAdmin):
+    staff_fields = {'technician': 'lab_tech'}
     list_display = ['id', 'student', 'test_type', 'is_completed', 'technician', 'date']
     list_filter = ['test_type', 'is_completed', 'date']
     search_fields = ['student__user__username', 'test_type']
     date_hierarchy = 'date'
+    ordering = ['-date', '-id']
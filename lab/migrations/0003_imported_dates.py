@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:19
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lab', '0002_external_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='labtest',
+            name='date',
+            field=models.DateField(default=datetime.date.today, editable=False),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lab', '0003_imported_dates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='labtest',
+            index=models.Index(fields=['date', 'id'], name='labtest_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labtest',
+            index=models.Index(fields=['test_type', 'date', 'id'], name='labtest_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labtest',
+            index=models.Index(fields=['student', 'date', 'id'], name='labtest_student_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labtest',
+            index=models.Index(condition=models.Q(('is_completed', False)), fields=['date', 'id'], name='labtest_pending_idx'),
+        ),
+    ]
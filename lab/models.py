@@ -1,3 +1,4 @@
+import datetime
 from django.db import models
 from django.conf import settings
 from students.models import StudentProfile
@@ -12,12 +13,24 @@ class LabTest(models.Model):
         ('Other', 'Other'),
     )
     
-    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='lab_tests')
+    external_id = models.CharField(max_length=20, unique=True, null=True, blank=True, help_text="Natural key of imported records, e.g. LAB-10000")
+    # Indexed through labtest_student_date_idx
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, db_index=False, related_name='lab_tests')
     test_type = models.CharField(max_length=50, choices=TEST_TYPES)
     result = models.TextField(blank=True, null=True)
     technician = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='tests_conducted', limit_choices_to={'role': 'lab_tech'})
-    date = models.DateField(auto_now_add=True)
+    date = models.DateField(default=datetime.date.today, editable=False)
     is_completed = models.BooleanField(default=False)
 
+    class Meta:
+        # Admin filters by test type and date; the pending queue stays small, so it
+        # gets a partial index instead of another full one
+        indexes = [
+            models.Index(fields=['date', 'id'], name='labtest_date_idx'),
+            models.Index(fields=['test_type', 'date', 'id'], name='labtest_type_date_idx'),
+            models.Index(fields=['student', 'date', 'id'], name='labtest_student_date_idx'),
+            models.Index(fields=['date', 'id'], condition=models.Q(is_completed=False), name='labtest_pending_idx'),
+        ]
+
     def __str__(self):
         return f"{self.test_type} for {self.student.user.username}"
@@ -1,14 +1,25 @@
 from django.contrib import admin
-from .models import Consultation, Prescription
+from .models import Consultation, DiagnosisCode, Prescription
+from accounts.directory import StaffDirectoryAdminMixin
+from .search import FullTextSearchAdminMixin
 
 @admin.register(Consultation)
-class ConsultationAdmin(admin.ModelAdmin):
-    list_display = ['id', 'student', 'doctor', 'date']
-    list_filter = ['date', 'doctor']
-    search_fields = ['student__user__username', 'diagnosis', 'symptoms']
+class ConsultationAdmin(FullTextSearchAdminMixin, StaffDirectoryAdminMixin, admin.ModelAdmin):
+    staff_fields = {'doctor': 'doctor'}
+    list_display = ['id', 'student', 'doctor', 'diagnosis_code', 'date']
+    list_filter = ['date', 'doctor', 'diagnosis_code']
+    # Shows the search box; the full-text index answers it (see medical.search)
+    search_fields = ['symptoms', 'diagnosis', 'notes']
+    search_index = 'consultations'
     date_hierarchy = 'date'
+    ordering = ['-date', '-id']
 
 @admin.register(Prescription)
 class PrescriptionAdmin(admin.ModelAdmin):
     list_display = ['id', 'consultation', 'drug_name', 'dosage']
     search_fields = ['drug_name', 'consultation__student__user__username']
+
+@admin.register(DiagnosisCode)
+class DiagnosisCodeAdmin(admin.ModelAdmin):
+    list_display = ['code', 'name']
+    search_fields = ['code', 'name', 'aliases']
@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class MedicalConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'medical'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_migrate, post_save
+        from billing.models import Bill
+        from lab.models import LabTest
+        from pharmacy.models import DispenseRecord
+        from . import search, timeline
+        from .models import Consultation, Prescription
+
+        for model in (Consultation, Prescription, LabTest, Bill, DispenseRecord):
+            post_save.connect(timeline.on_record_changed, sender=model, dispatch_uid='patient_timeline')
+            post_delete.connect(timeline.on_record_changed, sender=model, dispatch_uid='patient_timeline')
+
+        # Restores the SQLite search triggers after migrations that rebuild tables
+        post_migrate.connect(search.on_post_migrate, sender=self, dispatch_uid='clinical_search')
@@ -0,0 +1,80 @@
+"""
+Mapping free-text diagnoses onto DiagnosisCode
+
+Doctors write 'Malaria', 'malaria ' or 'Malaria, falciparum' for the same
+condition. normalize() folds case, punctuation and spacing, and
+DiagnosisMatcher looks the result up among the names, codes and aliases
+of every DiagnosisCode. If the whole text does not match, it tries the
+part before the first comma, semicolon or bracket. Anything else stays
+uncoded for a person to review.
+"""
+import re
+from collections import Counter
+
+from django.db import transaction
+
+from .models import Consultation, DiagnosisCode
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+def normalize(text):
+    return ' '.join(re.findall(r'[^\W_]+', (text or '').lower()))
+
+
+class DiagnosisMatcher:
+    """Loads every code once (one query); match() then runs in memory"""
+
+    def __init__(self):
+        self.lookup = {}
+        for pk, code, name, aliases in DiagnosisCode.objects.values_list('pk', 'code', 'name', 'aliases'):
+            for label in [code, name, *aliases.splitlines()]:
+                key = normalize(label)
+                if key:
+                    self.lookup.setdefault(key, pk)
+
+    def match(self, text):
+        """pk of the DiagnosisCode text names, or None"""
+        key = normalize(text)
+        if key in self.lookup:
+            return self.lookup[key]
+        head = normalize(re.split(r'[,;(]', text or '', maxsplit=1)[0])
+        return self.lookup.get(head)
+
+
+def backfill(batch_size=DEFAULT_BATCH_SIZE, recode=False, on_batch=None):
+    """
+    Code consultations in primary-key chunks, one UPDATE per code per chunk.
+    Only uncoded rows are touched unless recode=True. Returns
+    (coded, uncoded Counter of normalized text).
+    """
+    matcher = DiagnosisMatcher()
+    queryset = Consultation.objects.order_by('pk')
+    if not recode:
+        queryset = queryset.filter(diagnosis_code__isnull=True)
+
+    coded = 0
+    uncoded = Counter()
+    last_pk = 0
+    batch_no = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).values_list('pk', 'diagnosis', 'diagnosis_code')[:batch_size])
+        if not rows:
+            return coded, uncoded
+        last_pk = rows[-1][0]
+        batch_no += 1
+
+        by_code = {}
+        for pk, diagnosis, current in rows:
+            code = matcher.match(diagnosis)
+            if code is None:
+                uncoded[normalize(diagnosis)] += 1
+            elif code != current:
+                by_code.setdefault(code, []).append(pk)
+        if by_code:
+            with transaction.atomic():
+                for code, pks in by_code.items():
+                    coded += Consultation.objects.filter(pk__in=pks).update(diagnosis_code=code)
+
+        if on_batch:
+            on_batch(batch_no, len(rows), coded)
@@ -1,22 +1,64 @@
 from django import forms
-from .models import Consultation, Prescription
+from pharmacy.catalog import catalog
+from .diagnoses import DiagnosisMatcher
+from .models import Consultation, DiagnosisCode, Prescription
 
 class ConsultationForm(forms.ModelForm):
     class Meta:
         model = Consultation
-        fields = ['symptoms', 'diagnosis', 'notes']
+        fields = ['symptoms', 'diagnosis', 'diagnosis_code', 'notes']
         widgets = {
             'symptoms': forms.Textarea(attrs={'rows': 3, 'class': 'form-control'}),
             'diagnosis': forms.Textarea(attrs={'rows': 3, 'class': 'form-control'}),
+            'diagnosis_code': forms.Select(attrs={'class': 'form-select'}),
             'notes': forms.Textarea(attrs={'rows': 2, 'class': 'form-control'}),
         }
+        help_texts = {
+            'diagnosis_code': 'Leave blank to code it from the diagnosis text.',
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('diagnosis_code') and cleaned_data.get('diagnosis'):
+            code = DiagnosisMatcher().match(cleaned_data['diagnosis'])
+            if code is not None:
+                cleaned_data['diagnosis_code'] = DiagnosisCode.objects.get(pk=code)
+        return cleaned_data
 
 class PrescriptionForm(forms.ModelForm):
     class Meta:
         model = Prescription
         fields = ['drug_name', 'dosage', 'instructions']
         widgets = {
-            'drug_name': forms.TextInput(attrs={'class': 'form-control'}),
+            'drug_name': forms.TextInput(attrs={
+                'class': 'form-control drug-autocomplete', 'list': 'drug-options', 'autocomplete': 'off'
+            }),
             'dosage': forms.TextInput(attrs={'class': 'form-control'}),
             'instructions': forms.Textarea(attrs={'rows': 2, 'class': 'form-control'}),
         }
+
+    def clean_drug_name(self):
+        drug = catalog.find(self.cleaned_data['drug_name'])
+        if drug is None:
+            raise forms.ValidationError('Choose a drug that is in stock and not expired.')
+        self.instance.drug_id = drug.pk
+        return drug.name
+
+PrescriptionFormSet = forms.inlineformset_factory(
+    Consultation, Prescription, form=PrescriptionForm, extra=3, max_num=10, can_delete=False
+)
+
+class ClinicalSearchForm(forms.Form):
+    SCOPES = (
+        ('consultations', 'Consultations'),
+        ('appointments', 'Appointment reasons'),
+    )
+
+    q = forms.CharField(
+        max_length=200,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Symptoms, diagnosis, notes...'})
+    )
+    scope = forms.ChoiceField(
+        choices=SCOPES, required=False,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def install(apps, schema_editor):
+    from medical import search
+    search.install(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    from medical import search
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0004_hot_query_indexes'),
+        ('appointments', '0004_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_drugs(apps, schema_editor):
+    Drug = apps.get_model('pharmacy', 'Drug')
+    Prescription = apps.get_model('medical', 'Prescription')
+    Prescription.objects.update(drug=models.Subquery(
+        Drug.objects.filter(name__iexact=models.OuterRef('drug_name')).order_by('pk').values('pk')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0003_hot_query_indexes'),
+        ('medical', '0005_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prescription',
+            name='drug',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='prescriptions', to='pharmacy.drug'),
+        ),
+        migrations.RunPython(link_drugs, migrations.RunPython.noop),
+    ]
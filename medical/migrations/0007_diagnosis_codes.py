@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# The diagnoses recorded so far (see generate_large_dataset.DataPool.DIAGNOSES)
+SEED_CODES = [
+    ('A01.0', 'Typhoid', 'typhoid fever\nenteric fever'),
+    ('A05.9', 'Food poisoning', 'bacterial food poisoning'),
+    ('B54', 'Malaria', 'unspecified malaria'),
+    ('D64.9', 'Anemia', 'anaemia'),
+    ('E14.9', 'Diabetes', 'diabetes mellitus\nDM'),
+    ('G43.9', 'Migraine', ''),
+    ('H10.9', 'Conjunctivitis', 'pink eye'),
+    ('I10', 'Hypertension', 'high blood pressure\nHTN'),
+    ('J00', 'Common cold', 'cold\nnasopharyngitis\nURTI'),
+    ('J03.9', 'Tonsillitis', 'acute tonsillitis'),
+    ('J11', 'Flu', 'influenza'),
+    ('J40', 'Bronchitis', ''),
+    ('K29.7', 'Gastritis', ''),
+    ('L23.9', 'Allergic dermatitis', 'allergic contact dermatitis'),
+    ('M13.9', 'Arthritis', ''),
+    ('N39.0', 'UTI', 'urinary tract infection'),
+    ('T14.3', 'Muscle strain', 'strain\nsprain'),
+]
+
+
+def seed_codes(apps, schema_editor):
+    DiagnosisCode = apps.get_model('medical', 'DiagnosisCode')
+    DiagnosisCode.objects.bulk_create([
+        DiagnosisCode(code=code, name=name, aliases=aliases) for code, name, aliases in SEED_CODES
+    ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical', '0006_prescription_drug'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiagnosisCode',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('code', models.CharField(help_text='ICD-10 code, or a local code for conditions ICD does not split out', max_length=10, unique=True)),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('aliases', models.TextField(blank=True, help_text='Other spellings doctors write for this diagnosis, one per line')),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='consultation',
+            name='diagnosis_code',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='consultations', to='medical.diagnosiscode'),
+        ),
+        migrations.AddIndex(
+            model_name='consultation',
+            index=models.Index(fields=['diagnosis_code', 'date'], name='consult_dx_date_idx'),
+        ),
+        migrations.RunPython(seed_codes, migrations.RunPython.noop),
+    ]
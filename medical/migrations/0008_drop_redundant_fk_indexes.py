@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('students', '0001_initial'),
+        ('medical', '0007_diagnosis_codes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='consultation',
+            name='doctor',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='consultations_conducted', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='consultation',
+            name='student',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='consultations', to='students.studentprofile'),
+        ),
+    ]
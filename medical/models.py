@@ -1,23 +1,53 @@
+import datetime
 from django.db import models
 from django.conf import settings
 from students.models import StudentProfile
 from appointments.models import Appointment
+from pharmacy.models import Drug
+
+class DiagnosisCode(models.Model):
+    # A few hundred rows at most; consultations reference it with a 2-byte key
+    id = models.SmallAutoField(primary_key=True)
+    code = models.CharField(max_length=10, unique=True, help_text="ICD-10 code, or a local code for conditions ICD does not split out")
+    name = models.CharField(max_length=200, unique=True)
+    aliases = models.TextField(blank=True, help_text="Other spellings doctors write for this diagnosis, one per line")
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return f"{self.code} {self.name}"
 
 class Consultation(models.Model):
+    external_id = models.CharField(max_length=20, unique=True, null=True, blank=True, help_text="Natural key of imported records, e.g. CONS-10000")
     appointment = models.OneToOneField(Appointment, on_delete=models.CASCADE, related_name='consultation')
-    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='consultations')
-    doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='consultations_conducted')
+    # Both indexed through the composite indexes in Meta, which lead with them
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, db_index=False, related_name='consultations')
+    doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False, related_name='consultations_conducted')
     symptoms = models.TextField()
     diagnosis = models.TextField()
+    # Indexed through consult_dx_date_idx, which morbidity reports group and filter on
+    diagnosis_code = models.ForeignKey(DiagnosisCode, on_delete=models.PROTECT, null=True, blank=True, db_index=False, related_name='consultations')
     notes = models.TextField(blank=True, null=True)
-    date = models.DateField(auto_now_add=True)
+    date = models.DateField(default=datetime.date.today, editable=False)
+
+    class Meta:
+        # my_medical_records and the admin (date_hierarchy, doctor filter) list newest first
+        indexes = [
+            models.Index(fields=['student', 'date', 'id'], name='consult_student_date_idx'),
+            models.Index(fields=['doctor', 'date', 'id'], name='consult_doctor_date_idx'),
+            models.Index(fields=['date', 'id'], name='consult_date_idx'),
+            models.Index(fields=['diagnosis_code', 'date'], name='consult_dx_date_idx'),
+        ]
 
     def __str__(self):
         return f"CONS-{self.id} : {self.student.user.username}"
 
 class Prescription(models.Model):
+    external_id = models.CharField(max_length=30, unique=True, null=True, blank=True, help_text="Natural key of imported records, e.g. RX-0000001-001-1")
     consultation = models.ForeignKey(Consultation, on_delete=models.CASCADE, related_name='prescriptions')
-    drug_name = models.CharField(max_length=200) # Can be linked to Pharmacy Drug later if needed strictly
+    drug = models.ForeignKey(Drug, on_delete=models.SET_NULL, null=True, blank=True, related_name='prescriptions')
+    drug_name = models.CharField(max_length=200) # Kept as written, so history survives stock and catalog changes
     dosage = models.CharField(max_length=200)
     instructions = models.TextField(blank=True, null=True)
 
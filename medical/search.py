@@ -0,0 +1,297 @@
+"""
+Full-text search over consultation notes and appointment reasons
+
+Each SearchIndex is kept current by the database itself, so bulk_create
+and the COPY importer are covered too:
+
+* PostgreSQL: a GIN index on the tsvector of the searched columns. Queries
+  use the same expression, ranked with ts_rank, excerpts from ts_headline.
+* SQLite (development): an external-content FTS5 table maintained by
+  triggers, ranked with bm25, excerpts from snippet(). Django rebuilds
+  SQLite tables to alter them, which drops their triggers, so install()
+  also runs after every migrate (see MedicalConfig.ready).
+
+Every word of the query must match, and the last letters may be missing
+('malar' finds 'malaria'). Other databases fall back to icontains.
+"""
+import re
+from dataclasses import dataclass, field
+
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+SEARCH_CONFIG = 'english'
+MAX_TERMS = 8
+
+# Highlight markers: control characters never found in clinical text, so the
+# excerpt can be HTML-escaped before they become <mark> tags
+_START, _STOP = '\x02', '\x03'
+
+
+def terms(query):
+    """Lower-cased words of a user query, at most MAX_TERMS of them"""
+    return re.findall(r'[^\W_]+', query.lower())[:MAX_TERMS]
+
+
+def highlight(excerpt):
+    return mark_safe(escape(excerpt).replace(_START, '<mark>').replace(_STOP, '</mark>'))
+
+
+@dataclass
+class Hit:
+    object: object
+    rank: float
+    highlights: dict = field(default_factory=dict)
+
+
+class SearchResults:
+    """
+    Lazily ranked hits for one query, best first. Has count() and slicing,
+    so it can be handed to a Paginator; each page is one ranked query plus
+    one query loading its objects.
+    """
+
+    def __init__(self, index, query, queryset):
+        self.index = index
+        self.terms = terms(query)
+        self.queryset = queryset
+
+    def count(self):
+        if not self.terms:
+            return 0
+        return self.index.filter(self.index.model.objects.all(), ' '.join(self.terms)).count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('SearchResults only supports slicing')
+        if not self.terms:
+            return []
+        offset = key.start or 0
+        rows = self.index.ranked(self.terms, key.stop - offset, offset)
+        objects = self.queryset.in_bulk([row[0] for row in rows])
+        return [
+            Hit(objects[pk], rank, {
+                name: highlight(excerpt) for name, excerpt in zip(self.index.fields, excerpts)
+                if excerpt and _START in excerpt
+            })
+            for pk, rank, *excerpts in rows if pk in objects
+        ]
+
+
+class SearchIndex:
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = list(fields)
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    @property
+    def fts_table(self):
+        return f'{self.table}_fts'
+
+    def columns(self):
+        return [self.model._meta.get_field(name).column for name in self.fields]
+
+    # Schema
+
+    def install(self, conn):
+        if conn.vendor == 'postgresql':
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {self.table}_search_idx '
+                    f'ON {self.table} USING GIN (({self._document()}))'
+                )
+        elif conn.vendor == 'sqlite':
+            self._install_sqlite(conn)
+
+    def uninstall(self, conn):
+        with conn.cursor() as cursor:
+            if conn.vendor == 'postgresql':
+                cursor.execute(f'DROP INDEX IF EXISTS {self.table}_search_idx')
+            elif conn.vendor == 'sqlite':
+                for suffix in ('ai', 'ad', 'au'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {self.fts_table}_{suffix}')
+                cursor.execute(f'DROP TABLE IF EXISTS {self.fts_table}')
+
+    def _install_sqlite(self, conn):
+        columns = self.columns()
+        names = ', '.join(columns)
+        new = ', '.join(f'new.{c}' for c in columns)
+        old = ', '.join(f'old.{c}' for c in columns)
+        fts = self.fts_table
+        triggers = {
+            f'{fts}_ai': f'AFTER INSERT ON {self.table} BEGIN '
+                         f'INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END',
+            f'{fts}_ad': f'AFTER DELETE ON {self.table} BEGIN '
+                         f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); END",
+            f'{fts}_au': f'AFTER UPDATE OF {names} ON {self.table} BEGIN '
+                         f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); "
+                         f'INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END',
+        }
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [self.table]
+            )
+            existing = {row[0] for row in cursor.fetchall()}
+            if existing >= set(triggers):
+                return
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, '
+                f"content='{self.table}', content_rowid='id', tokenize='porter unicode61')"
+            )
+            for name, body in triggers.items():
+                cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+            # Rows written while the triggers were missing
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+    # Queries
+
+    def _document(self, qualified=False):
+        prefix = f'{connection.ops.quote_name(self.table)}.' if qualified else ''
+        text = " || ' ' || ".join(f"coalesce({prefix}{c}, '')" for c in self.columns())
+        return f"to_tsvector('{SEARCH_CONFIG}', {text})"
+
+    def _match_expression(self, words):
+        if connection.vendor == 'postgresql':
+            return ' & '.join(f'{w}:*' for w in words)
+        return ' '.join(f'"{w}"*' for w in words)
+
+    def condition(self, query):
+        """Q matching rows that contain every word of query (unranked)"""
+        words = terms(query)
+        if not words:
+            return Q(pk__in=[])
+        match = self._match_expression(words)
+        if connection.vendor == 'postgresql':
+            return Q(RawSQL(
+                f"{self._document(qualified=True)} @@ to_tsquery('{SEARCH_CONFIG}', %s)",
+                [match], output_field=BooleanField(),
+            ))
+        if connection.vendor == 'sqlite':
+            return Q(pk__in=RawSQL(
+                f'SELECT rowid FROM {self.fts_table} WHERE {self.fts_table} MATCH %s', [match]
+            ))
+        condition = Q()
+        for word in words:
+            condition &= Q(*[Q(**{f'{name}__icontains': word}) for name in self.fields], _connector=Q.OR)
+        return condition
+
+    def filter(self, queryset, query):
+        return queryset.filter(self.condition(query))
+
+    def ranked(self, words, limit, offset=0):
+        """[(pk, rank, excerpt per field...)] best match first"""
+        match = self._match_expression(words)
+        columns = self.columns()
+        if connection.vendor == 'postgresql':
+            options = f'StartSel={_START}, StopSel={_STOP}, MaxWords=25, MinWords=10'
+            headlines = ', '.join(
+                f"ts_headline('{SEARCH_CONFIG}', coalesce({c}, ''), query, %s)" for c in columns
+            )
+            sql = (
+                f'SELECT id, ts_rank({self._document()}, query) AS rank, {headlines} '
+                f"FROM {self.table}, to_tsquery('{SEARCH_CONFIG}', %s) query "
+                f'WHERE {self._document()} @@ query ORDER BY rank DESC, id DESC LIMIT %s OFFSET %s'
+            )
+            params = [options] * len(columns) + [match, limit, offset]
+        elif connection.vendor == 'sqlite':
+            fts = self.fts_table
+            snippets = ', '.join(
+                f"snippet({fts}, {i}, '{_START}', '{_STOP}', '…', 16)" for i in range(len(columns))
+            )
+            # bm25() is lower for better matches
+            sql = (
+                f'SELECT rowid, -bm25({fts}) AS rank, {snippets} FROM {fts} '
+                f'WHERE {fts} MATCH %s ORDER BY rank DESC, rowid DESC LIMIT %s OFFSET %s'
+            )
+            params = [match, limit, offset]
+        else:
+            pks = self.filter(self.model.objects.order_by('-pk'), ' '.join(words)).values_list('pk', flat=True)
+            return [(pk, 0.0) + (None,) * len(columns) for pk in pks[offset:offset + limit]]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def search(self, query, queryset=None):
+        """
+        SearchResults for query over the whole table. queryset only says how
+        hits are loaded (e.g. select_related); rows it leaves out are dropped
+        from a page rather than replaced, so it should not filter.
+        """
+        return SearchResults(self, query, queryset if queryset is not None else self.model.objects.all())
+
+
+def _indexes():
+    from appointments.models import Appointment
+    from .models import Consultation
+    return {
+        'consultations': SearchIndex(Consultation, ['symptoms', 'diagnosis', 'notes']),
+        'appointments': SearchIndex(Appointment, ['reason']),
+    }
+
+
+INDEXES = {}
+
+
+def get_index(name):
+    if not INDEXES:
+        INDEXES.update(_indexes())
+    return INDEXES[name]
+
+
+def install(conn=connection):
+    tables = set(conn.introspection.table_names())
+    for name in ('consultations', 'appointments'):
+        index = get_index(name)
+        if index.table in tables:
+            index.install(conn)
+
+
+def uninstall(conn=connection):
+    for name in ('consultations', 'appointments'):
+        get_index(name).uninstall(conn)
+
+
+def on_post_migrate(sender, using, **kwargs):
+    conn = connections[using]
+    if ('medical', '0005_fulltext_search') in MigrationRecorder(conn).applied_migrations():
+        install(conn)
+
+
+class FullTextSearchAdminMixin:
+    """
+    ModelAdmin mixin answering the changelist search box from a SearchIndex.
+    A term that is exactly a student ID or username also finds that student's
+    rows through search_student_field, and one that is exactly a staff
+    username finds that doctor's rows through search_doctor_field. Both are
+    looked up first so the final query stays on this table's indexes.
+    """
+    search_index = None
+    search_student_field = 'student'
+    search_doctor_field = None
+
+    def get_search_results(self, request, queryset, search_term):
+        from students.models import StudentProfile
+
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        condition = get_index(self.search_index).condition(term)
+        if self.search_student_field:
+            students = list(StudentProfile.objects.filter(
+                Q(student_id__in={term, term.upper()}) | Q(user__username=term.lower())
+            ).values_list('pk', flat=True))
+            if students:
+                condition |= Q(**{f'{self.search_student_field}__in': students})
+        if self.search_doctor_field:
+            doctors = list(get_user_model().objects.filter(username__iexact=term).values_list('pk', flat=True))
+            if doctors:
+                condition |= Q(**{f'{self.search_doctor_field}__in': doctors})
+        return queryset.filter(condition), False
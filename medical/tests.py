@@ -1,3 +1,342 @@
-from django.test import TestCase
+from datetime import date, time, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.admin.sites import site
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from analytics import outbreaks
+from appointments.models import Appointment
+from appointments.signals import appointment_status_changed
+from billing.models import Bill
+from lab.models import LabTest
+from pharmacy.catalog import catalog
+from pharmacy.models import DispenseRecord, Drug
+from students.models import StudentProfile
+from io import StringIO
+from unittest import mock
+
+from . import search, timeline
+from .diagnoses import DiagnosisMatcher, backfill
+from .models import Consultation, DiagnosisCode, Prescription
+
+User = get_user_model()
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PatientTimelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user('dr_obse', role='doctor', first_name='Obse', last_name='Tadesse')
+        cls.technician = User.objects.create_user('tech_kebede', role='lab_tech', first_name='Kebede')
+        user = User.objects.create_user('st_hawi', role='student', first_name='Hawi', password='x')
+        cls.student = StudentProfile.objects.create(
+            user=user, student_id='HU-UGR-2023-20000', college='CNCS',
+            department='Biology', gender='F', year=3
+        )
+        cls.drug = Drug.objects.create(name='Amoxicillin', stock=100, unit='capsules',
+                                       expiry_date=date(2030, 1, 1))
+        cls.first_day = date(2024, 3, 1)
+
+    def setUp(self):
+        cache.clear()
+
+    def add_visit(self, day, paid=False):
+        appointment = Appointment.objects.create(
+            student=self.student, doctor=self.doctor, date=day, time=time(9, 0), reason='Fever'
+        )
+        consultation = Consultation.objects.create(
+            appointment=appointment, student=self.student, doctor=self.doctor,
+            symptoms='Fever', diagnosis='Malaria', date=day
+        )
+        Prescription.objects.create(consultation=consultation, drug_name='Coartem', dosage='4 tablets')
+        LabTest.objects.create(student=self.student, test_type='Malaria', technician=self.technician, date=day)
+        DispenseRecord.objects.create(student=self.student, drug=self.drug, quantity=2, date=day)
+        Bill.objects.create(student=self.student, service='Consultation', amount=Decimal('50.00'),
+                            date=day, status='Paid' if paid else 'Pending')
+        return consultation
+
+    def test_merged_newest_first_with_totals(self):
+        self.add_visit(self.first_day, paid=True)
+        latest = self.add_visit(self.first_day + timedelta(days=10))
+
+        summary = timeline.build_summary(self.student.pk)
+        self.assertEqual([e['kind'] for e in summary['entries']],
+                         ['consultation', 'lab_test', 'dispense', 'bill'] * 2)
+        first = summary['entries'][0]
+        self.assertEqual((first['id'], first['staff']), (latest.pk, 'Obse Tadesse'))
+        self.assertEqual(first['prescriptions'][0]['drug_name'], 'Coartem')
+        self.assertEqual(summary['entries'][1]['staff'], 'Kebede')
+        self.assertEqual(summary['counts']['consultation'], 2)
+        self.assertEqual(summary['pending_tests'], 2)
+        self.assertEqual(summary['outstanding'], Decimal('50.00'))
+
+    def test_query_count_does_not_grow_with_visits(self):
+        self.add_visit(self.first_day)
+        with self.assertNumQueries(5):
+            timeline.build_summary(self.student.pk)
+        for day in range(1, 20):
+            self.add_visit(self.first_day + timedelta(days=day))
+        with self.assertNumQueries(5):
+            summary = timeline.build_summary(self.student.pk)
+        self.assertEqual(len(summary['entries']), 80)
+
+    def test_cached_until_a_record_changes(self):
+        consultation = self.add_visit(self.first_day)
+        timeline.get_summary(self.student.pk)
+        with self.assertNumQueries(0):
+            timeline.get_summary(self.student.pk)
+
+        Prescription.objects.create(consultation=consultation, drug_name='Paracetamol', dosage='500mg')
+        entries = timeline.get_summary(self.student.pk)['entries']
+        self.assertEqual(len(entries[0]['prescriptions']), 2)
+
+        Bill.objects.get().delete()
+        self.assertEqual(timeline.get_summary(self.student.pk)['counts']['bill'], 0)
+
+        timeline.get_summary(self.student.pk)
+        timeline.invalidate_all()
+        with self.assertNumQueries(5):
+            timeline.get_summary(self.student.pk)
+
+    def test_student_and_staff_pages(self):
+        for day in range(8):
+            self.add_visit(self.first_day + timedelta(days=day))
+
+        self.client.force_login(self.student.user)
+        response = self.client.get(reverse('my_medical_records'), {'page': 2})
+        self.assertEqual(response.context['page'].number, 2)
+        self.assertEqual(len(response.context['page']), 32 - timeline.TIMELINE_PER_PAGE)
+        self.assertRedirects(self.client.get(reverse('patient_timeline', args=[self.student.pk])),
+                             reverse('dashboard'), fetch_redirect_response=False)
+
+        self.client.force_login(self.doctor)
+        response = self.client.get(reverse('patient_timeline', args=[self.student.pk]))
+        self.assertContains(response, 'Medical Records: Hawi')
+        self.assertEqual(len(response.context['page']), timeline.TIMELINE_PER_PAGE)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ClinicalSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user('dr_abebe', role='doctor', first_name='Abebe')
+        user = User.objects.create_user('st_lemi', role='student', first_name='Lemi')
+        cls.student = StudentProfile.objects.create(
+            user=user, student_id='HU-UGR-2023-30000', college='CNCS',
+            department='Physics', gender='M', year=1
+        )
+
+    def consult(self, symptoms, diagnosis, notes=None, day=1):
+        appointment = Appointment.objects.create(
+            student=self.student, doctor=self.doctor, date=date(2024, 5, day), time=time(8, 0),
+            reason=symptoms
+        )
+        return Consultation.objects.create(
+            appointment=appointment, student=self.student, doctor=self.doctor,
+            symptoms=symptoms, diagnosis=diagnosis, notes=notes
+        )
+
+    def hits(self, query, scope='consultations'):
+        return search.get_index(scope).search(query)[0:20]
+
+    def test_ranked_prefix_matches_with_escaped_highlights(self):
+        self.consult('Fever and headache', 'Malaria, <b>falciparum</b>', day=1)
+        strong = self.consult('Malaria symptoms, fever', 'Malaria', 'Malaria follow-up', day=2)
+        self.consult('Cough', 'Common cold', day=3)
+
+        hits = self.hits('malar')
+        self.assertEqual(len(hits), 2)
+        self.assertEqual(hits[0].object, strong)
+        self.assertGreater(hits[0].rank, hits[1].rank)
+        self.assertIn('<mark>', hits[1].highlights['diagnosis'])
+        # Escaped by SQLite's snippet(); PostgreSQL's ts_headline drops tags itself
+        self.assertNotIn('<b>', hits[1].highlights['diagnosis'])
+        self.assertIn('falciparum', hits[1].highlights['diagnosis'])
+        self.assertEqual(search.get_index('consultations').search('malar fever').count(), 2)
+        self.assertEqual(search.get_index('consultations').search('malar cough').count(), 0)
+        self.assertEqual(self.hits('"; DROP --'), [])
+
+    def test_index_follows_updates_deletes_and_bulk_inserts(self):
+        consultation = self.consult('Rash', 'Dermatitis')
+        consultation.diagnosis = 'Scabies'
+        consultation.save()
+        self.assertEqual(self.hits('dermatitis'), [])
+        self.assertEqual(len(self.hits('scabies')), 1)
+        self.assertEqual(len(self.hits('rash', scope='appointments')), 1)
+
+        consultation.delete()
+        self.assertEqual(self.hits('scabies'), [])
+
+        Appointment.objects.bulk_create([
+            Appointment(student=self.student, doctor=self.doctor, date=date(2024, 6, 1),
+                        time=time(9, 0), reason='Sprained ankle')
+        ])
+        self.assertEqual(len(self.hits('ankle', scope='appointments')), 1)
+
+    def test_install_restores_dropped_triggers(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite triggers only')
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER medical_consultation_fts_ai')
+        self.consult('Insomnia', 'Stress')
+        self.assertEqual(self.hits('insomnia'), [])
+        search.install()
+        self.assertEqual(len(self.hits('insomnia')), 1)
+
+    def test_admin_and_doctor_search(self):
+        self.consult('Stomach ache', 'Gastritis')
+        admin = site._registry[Consultation]
+        request = RequestFactory().get('/')
+        queryset, _ = admin.get_search_results(request, Consultation.objects.all(), 'gastr')
+        self.assertEqual(queryset.count(), 1)
+        queryset, _ = admin.get_search_results(request, Consultation.objects.all(), 'hu-ugr-2023-30000')
+        self.assertEqual(queryset.count(), 1)
+        other_doctor = User.objects.create_user('dr_other', role='doctor')
+        Appointment.objects.create(student=self.student, doctor=other_doctor, date=date(2024, 6, 2),
+                                   time=time(9, 0), reason='Headache')
+        queryset, _ = site._registry[Appointment].get_search_results(request, Appointment.objects.all(), 'DR_Abebe')
+        self.assertEqual(set(queryset.values_list('doctor__username', flat=True)), {'dr_abebe'})
+
+        self.client.force_login(self.student.user)
+        self.assertRedirects(self.client.get(reverse('clinical_search')), reverse('dashboard'),
+                             fetch_redirect_response=False)
+        self.client.force_login(self.doctor)
+        response = self.client.get(reverse('clinical_search'), {'q': 'stomach'})
+        self.assertContains(response, '<mark>Stomach</mark>')
+        response = self.client.get(reverse('clinical_search'), {'q': 'stomach', 'scope': 'appointments'})
+        self.assertEqual(response.context['page'].paginator.count, 1)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class CreateConsultationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user('dr_gadaa', role='doctor', first_name='Gadaa')
+        user = User.objects.create_user('st_bilise', role='student', first_name='Bilise')
+        student = StudentProfile.objects.create(
+            user=user, student_id='HU-UGR-2023-40000', college='CNCS',
+            department='Chemistry', gender='F', year=2
+        )
+        cls.appointment = Appointment.objects.create(
+            student=student, doctor=cls.doctor, date=date.today(), time=time(10, 0),
+            reason='Cough', status='Approved'
+        )
+        future = date.today() + timedelta(days=90)
+        cls.amoxicillin = Drug.objects.create(name='Amoxicillin', stock=30, unit='capsules', expiry_date=future)
+        Drug.objects.create(name='Paracetamol', stock=50, unit='tablets', expiry_date=future)
+        Drug.objects.create(name='Codeine', stock=0, unit='tablets', expiry_date=future)
+
+    def setUp(self):
+        catalog.reload()
+        self.client.force_login(self.doctor)
+
+    def post(self, *prescriptions):
+        data = {
+            'symptoms': 'Productive cough', 'diagnosis': 'Bronchitis', 'notes': '',
+            'prescriptions-TOTAL_FORMS': '3', 'prescriptions-INITIAL_FORMS': '0',
+            'prescriptions-MIN_NUM_FORMS': '0', 'prescriptions-MAX_NUM_FORMS': '10',
+        }
+        for i, (drug, dosage) in enumerate(prescriptions):
+            data.update({f'prescriptions-{i}-drug_name': drug, f'prescriptions-{i}-dosage': dosage})
+        return self.client.post(reverse('create_consultation', args=[self.appointment.pk]), data)
+
+    def test_consultation_and_prescriptions_saved_together(self):
+        self.assertContains(self.client.get(reverse('create_consultation', args=[self.appointment.pk])),
+                            'prescriptions-TOTAL_FORMS')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(('amoxicillin', '500mg three times daily'), ('Paracetamol', '1g as needed'))
+        self.assertRedirects(response, reverse('manage_appointments'), fetch_redirect_response=False)
+
+        inserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "medical_prescription"')]
+        self.assertEqual(len(inserts), 1)
+        consultation = Consultation.objects.get()
+        self.assertEqual(consultation.diagnosis_code.code, 'J40')
+        prescriptions = list(consultation.prescriptions.order_by('drug_name'))
+        self.assertEqual([(p.drug_name, p.drug_id) for p in prescriptions][0], ('Amoxicillin', self.amoxicillin.pk))
+        self.assertEqual(len(prescriptions), 2)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, 'Completed')
+
+    def test_completion_goes_through_transitions(self):
+        received = []
+        handler = lambda sender, pks, status, **kwargs: received.append((pks, status))
+        appointment_status_changed.connect(handler)
+        self.addCleanup(appointment_status_changed.disconnect, handler)
+        # The coded diagnosis is an outbreak case; keep the detector's warm-up out of this test
+        with mock.patch.object(outbreaks.detector, 'record'), self.captureOnCommitCallbacks(execute=True):
+            self.post(('Paracetamol', '1g'))
+        self.assertEqual(received, [([self.appointment.pk], 'Completed')])
+
+    def test_only_approved_appointments_take_a_consultation(self):
+        Appointment.objects.filter(pk=self.appointment.pk).update(status='Pending')
+        response = self.post(('Paracetamol', '1g'))
+        self.assertRedirects(response, reverse('manage_appointments'), fetch_redirect_response=False)
+        self.assertFalse(Consultation.objects.exists())
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, 'Pending')
+
+    def test_unavailable_drug_saves_nothing(self):
+        response = self.post(('Paracetamol', '1g'), ('Codeine', '30mg'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['formset'].errors[1]['drug_name'])
+        self.assertFalse(Consultation.objects.exists())
+        self.assertFalse(Prescription.objects.exists())
+
+
+class DiagnosisCodeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user('dr_galana', role='doctor')
+        user = User.objects.create_user('st_ayantu', role='student')
+        cls.student = StudentProfile.objects.create(
+            user=user, student_id='HU-UGR-2023-50000', college='CBE',
+            department='Economics', gender='F', year=4
+        )
+
+    def consult(self, diagnosis, day=1):
+        appointment = Appointment.objects.create(
+            student=self.student, doctor=self.doctor, date=date(2024, 7, day), time=time(8, 0), reason='Visit'
+        )
+        return Consultation.objects.create(
+            appointment=appointment, student=self.student, doctor=self.doctor,
+            symptoms='Fever', diagnosis=diagnosis
+        )
+
+    def test_matcher_folds_spelling_and_uses_aliases(self):
+        matcher = DiagnosisMatcher()
+        malaria = DiagnosisCode.objects.get(code='B54').pk
+        self.assertEqual(matcher.match('  MALARIA '), malaria)
+        self.assertEqual(matcher.match('Malaria, P. falciparum'), malaria)
+        self.assertEqual(matcher.match('b54'), malaria)
+        self.assertEqual(matcher.match('Urinary tract infection'), DiagnosisCode.objects.get(name='UTI').pk)
+        self.assertIsNone(matcher.match('Appendicitis'))
+
+    def test_backfill_codes_in_chunks_and_reports_leftovers(self):
+        for day, diagnosis in enumerate(['Malaria', 'malaria.', 'Typhoid fever', 'Appendicitis', 'Flu'], 1):
+            self.consult(diagnosis, day)
+
+        batches = []
+        coded, uncoded = backfill(batch_size=2, on_batch=lambda *args: batches.append(args))
+        self.assertEqual(coded, 4)
+        self.assertEqual(uncoded, {'appendicitis': 1})
+        self.assertEqual([rows for _, rows, _ in batches], [2, 2, 1])
+
+        counts = dict(
+            Consultation.objects.values_list('diagnosis_code__code').annotate(n=Count('id')).values_list('diagnosis_code__code', 'n')
+        )
+        self.assertEqual(counts, {'B54': 2, 'A01.0': 1, 'J11': 1, None: 1})
+
+        # A second run only reads the row that is still uncoded
+        with self.assertNumQueries(3):
+            self.assertEqual(backfill(batch_size=2), (0, {'appendicitis': 1}))
+
+        out = StringIO()
+        call_command('backfill_diagnosis_codes', stdout=out)
+        self.assertIn('appendicitis', out.getvalue())
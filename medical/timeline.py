@@ -0,0 +1,182 @@
+"""
+Unified patient timeline: consultations (with their prescriptions), lab
+tests, bills and dispensed drugs of one student, newest first
+
+build_summary() reads each source once, already in index order
+(student, date, id), and merges the streams, so assembling a timeline
+costs the same five queries however many visits the student has. The
+summary is a plain list of dicts and is cached per student; receivers
+connected in MedicalConfig.ready drop a student's entry whenever one of
+its records is saved or deleted, and bulk loaders call invalidate_all().
+
+Those drops only reach other processes through a shared cache (set
+CACHE_TABLE; see settings). With the default per-process LocMemCache a
+worker can show a timeline up to TIMELINE_TIMEOUT old, which is why it is
+kept short.
+"""
+import heapq
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import transaction
+
+from accounts.directory import display_name
+from billing.models import Bill
+from lab.models import LabTest
+from pharmacy.models import DispenseRecord
+from .models import Consultation, Prescription
+
+CACHE_PREFIX = 'patient_timeline'
+TIMELINE_TIMEOUT = 300
+TIMELINE_PER_PAGE = 25
+
+# Within one day the consultation heads the visit, followed by what it led to
+KIND_RANK = {'consultation': 3, 'lab_test': 2, 'dispense': 1, 'bill': 0}
+
+_GENERATION_KEY = f'{CACHE_PREFIX}:generation'
+
+
+def _generation():
+    generation = cache.get(_GENERATION_KEY)
+    if generation is None:
+        # Seeded from the clock so an evicted counter never revives old entries
+        cache.add(_GENERATION_KEY, time.time_ns(), None)
+        generation = cache.get(_GENERATION_KEY)
+    return generation
+
+
+def _cache_key(student_id):
+    return f'{CACHE_PREFIX}:{_generation()}:{student_id}'
+
+
+def _staff_name(row, prefix):
+    if row[f'{prefix}__username'] is None:
+        return ''
+    return display_name(row[f'{prefix}__first_name'], row[f'{prefix}__last_name'], row[f'{prefix}__username'])
+
+
+def _staff_fields(prefix):
+    return [f'{prefix}__first_name', f'{prefix}__last_name', f'{prefix}__username']
+
+
+def _consultations(student_id):
+    prescriptions = {}
+    for row in (Prescription.objects.filter(consultation__student_id=student_id)
+                .order_by('consultation_id', 'id')
+                .values('consultation_id', 'drug_name', 'dosage', 'instructions')):
+        prescriptions.setdefault(row.pop('consultation_id'), []).append(row)
+
+    rows = (Consultation.objects.filter(student_id=student_id).order_by('-date', '-id')
+            .values('id', 'date', 'diagnosis', *_staff_fields('doctor')))
+    for row in rows:
+        yield {
+            'kind': 'consultation', 'id': row['id'], 'date': row['date'],
+            'title': 'Consultation', 'detail': row['diagnosis'],
+            'staff': _staff_name(row, 'doctor'), 'status': '',
+            'prescriptions': prescriptions.get(row['id'], []),
+        }
+
+
+def _lab_tests(student_id):
+    labels = dict(LabTest.TEST_TYPES)
+    rows = (LabTest.objects.filter(student_id=student_id).order_by('-date', '-id')
+            .values('id', 'date', 'test_type', 'result', 'is_completed', *_staff_fields('technician')))
+    for row in rows:
+        yield {
+            'kind': 'lab_test', 'id': row['id'], 'date': row['date'],
+            'title': labels.get(row['test_type'], row['test_type']), 'detail': row['result'] or '',
+            'staff': _staff_name(row, 'technician'),
+            'status': 'Completed' if row['is_completed'] else 'Pending',
+        }
+
+
+def _dispenses(student_id):
+    rows = (DispenseRecord.objects.filter(student_id=student_id).order_by('-date', '-id')
+            .values('id', 'date', 'quantity', 'drug__name', 'drug__unit', *_staff_fields('pharmacist')))
+    for row in rows:
+        yield {
+            'kind': 'dispense', 'id': row['id'], 'date': row['date'],
+            'title': row['drug__name'], 'detail': f"{row['quantity']} {row['drug__unit']}",
+            'staff': _staff_name(row, 'pharmacist'), 'status': '',
+        }
+
+
+def _bills(student_id):
+    rows = (Bill.objects.filter(student_id=student_id).order_by('-date', '-id')
+            .values('id', 'date', 'service', 'amount', 'status'))
+    for row in rows:
+        yield {
+            'kind': 'bill', 'id': row['id'], 'date': row['date'],
+            'title': row['service'], 'detail': '', 'amount': row['amount'],
+            'staff': '', 'status': row['status'],
+        }
+
+
+def _sort_key(entry):
+    return (entry['date'], KIND_RANK[entry['kind']], entry['id'])
+
+
+def build_summary(student_id):
+    """Assemble the timeline and its totals from the database (five queries)"""
+    entries = list(heapq.merge(
+        _consultations(student_id), _lab_tests(student_id), _dispenses(student_id), _bills(student_id),
+        key=_sort_key, reverse=True,
+    ))
+    counts = dict.fromkeys(KIND_RANK, 0)
+    pending_tests = 0
+    outstanding = Decimal('0.00')
+    for entry in entries:
+        counts[entry['kind']] += 1
+        if entry['kind'] == 'lab_test' and entry['status'] == 'Pending':
+            pending_tests += 1
+        elif entry['kind'] == 'bill' and entry['status'] == 'Pending':
+            outstanding += entry['amount']
+    return {
+        'entries': entries,
+        'counts': counts,
+        'pending_tests': pending_tests,
+        'outstanding': outstanding,
+        'last_visit': entries[0]['date'] if entries else None,
+    }
+
+
+def get_summary(student_id):
+    """Cached build_summary()"""
+    key = _cache_key(student_id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = build_summary(student_id)
+        cache.set(key, summary, TIMELINE_TIMEOUT)
+    return summary
+
+
+def get_page(student_id, page_number, per_page=TIMELINE_PER_PAGE):
+    """(summary, page) for one page of a student's timeline"""
+    summary = get_summary(student_id)
+    return summary, Paginator(summary['entries'], per_page).get_page(page_number)
+
+
+def invalidate(student_id):
+    cache.delete(_cache_key(student_id))
+
+
+def invalidate_all():
+    """Forget every cached timeline, e.g. after a bulk import that sends no signals"""
+    try:
+        cache.incr(_GENERATION_KEY)
+    except ValueError:
+        cache.add(_GENERATION_KEY, time.time_ns(), None)
+
+
+def on_record_changed(sender, instance, **kwargs):
+    if isinstance(instance, Prescription):
+        student_id = (Consultation.objects.filter(pk=instance.consultation_id)
+                      .values_list('student_id', flat=True).first())
+    else:
+        student_id = instance.student_id
+    if student_id is not None:
+        # Again after commit, in case a concurrent request re-cached the old rows meanwhile
+        invalidate(student_id)
+        transaction.on_commit(lambda: invalidate(student_id))
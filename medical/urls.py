@@ -4,5 +4,7 @@ from . import views
 urlpatterns = [
     path('consultation/create/<int:appointment_id>/', views.create_consultation, name='create_consultation'),
     path('my-records/', views.my_medical_records, name='my_medical_records'),
+    path('patient/<int:student_pk>/', views.patient_timeline, name='patient_timeline'),
+    path('search/', views.clinical_search, name='clinical_search'),
     path('consultation/<int:consultation_id>/', views.consultation_detail, name='consultation_detail'),
 ]
@@ -1,9 +1,14 @@
+from django.core.paginator import Paginator
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.db import transaction
 from .models import Consultation, Prescription
-from .forms import ConsultationForm, PrescriptionForm
+from .forms import ClinicalSearchForm, ConsultationForm, PrescriptionFormSet
 from appointments.models import Appointment
+from appointments.transitions import transition
+from students.models import StudentProfile
+from . import search, timeline
 
 @login_required
 def create_consultation(request, appointment_id):
@@ -13,26 +18,38 @@ def create_consultation(request, appointment_id):
         return redirect('dashboard')
     
     appointment = get_object_or_404(Appointment, id=appointment_id, doctor=request.user)
+    if appointment.status != 'Approved':
+        messages.error(request, 'Only approved appointments can be completed with a consultation.')
+        return redirect('manage_appointments')
     
     if request.method == 'POST':
         form = ConsultationForm(request.POST)
-        if form.is_valid():
-            consultation = form.save(commit=False)
-            consultation.appointment = appointment
-            consultation.student = appointment.student
-            consultation.doctor = request.user
-            consultation.save()
-            
-            appointment.status = 'Completed'
-            appointment.save()
-            
+        formset = PrescriptionFormSet(request.POST, prefix='prescriptions')
+        if form.is_valid() and formset.is_valid():
+            with transaction.atomic():
+                # Approved -> Completed through transitions, which also publishes the change
+                if not transition(Appointment.objects.filter(pk=appointment.pk), 'Completed'):
+                    messages.error(request, 'This appointment is no longer approved.')
+                    return redirect('manage_appointments')
+
+                consultation = form.save(commit=False)
+                consultation.appointment = appointment
+                consultation.student = appointment.student
+                consultation.doctor = request.user
+                consultation.save()
+
+                formset.instance = consultation
+                Prescription.objects.bulk_create(formset.save(commit=False))
+
             messages.success(request, 'Consultation recorded successfully!')
             return redirect('manage_appointments')
     else:
         form = ConsultationForm()
-    
+        formset = PrescriptionFormSet(prefix='prescriptions')
+
     return render(request, 'medical/create_consultation.html', {
         'form': form,
+        'formset': formset,
         'appointment': appointment
     })
 
@@ -43,12 +60,27 @@ def my_medical_records(request):
         messages.error(request, 'Access denied.')
         return redirect('dashboard')
     
-    consultations = Consultation.objects.filter(
-        student=request.user.student_profile
-    ).order_by('-date')
-    
+    summary, page = timeline.get_page(request.user.student_profile.pk, request.GET.get('page'))
+
     return render(request, 'medical/my_records.html', {
-        'consultations': consultations
+        'summary': summary,
+        'page': page,
+    })
+
+@login_required
+def patient_timeline(request, student_pk):
+    """Staff view a student's full medical history"""
+    if not request.user.is_staff_member():
+        messages.error(request, 'Access denied.')
+        return redirect('dashboard')
+
+    patient = get_object_or_404(StudentProfile.objects.select_related('user'), pk=student_pk)
+    summary, page = timeline.get_page(patient.pk, request.GET.get('page'))
+
+    return render(request, 'medical/my_records.html', {
+        'patient': patient,
+        'summary': summary,
+        'page': page,
     })
 
 @login_required
@@ -68,3 +100,27 @@ def consultation_detail(request, consultation_id):
     return render(request, 'medical/consultation_detail.html', {
         'consultation': consultation
     })
+
+SEARCH_RESULTS_PER_PAGE = 20
+
+@login_required
+def clinical_search(request):
+    """Doctors search consultation notes and appointment reasons"""
+    if request.user.role != 'doctor':
+        messages.error(request, 'Only doctors can search clinical records.')
+        return redirect('dashboard')
+
+    form = ClinicalSearchForm(request.GET or None)
+    page = None
+    if form.is_valid():
+        scope = form.cleaned_data['scope'] or 'consultations'
+        queryset = (Consultation if scope == 'consultations' else Appointment).objects.select_related(
+            'student__user', 'doctor'
+        )
+        results = search.get_index(scope).search(form.cleaned_data['q'], queryset)
+        page = Paginator(results, SEARCH_RESULTS_PER_PAGE).get_page(request.GET.get('page'))
+
+    return render(request, 'medical/search.html', {
+        'form': form,
+        'page': page,
+    })
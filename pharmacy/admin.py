@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Drug, DispenseRecord
+from accounts.directory import StaffDirectoryAdminMixin
 
 @admin.register(Drug)
 class DrugAdmin(admin.ModelAdmin):
@@ -8,8 +9,10 @@ class DrugAdmin(admin.ModelAdmin):
     search_fields = ['name']
 
 @admin.register(DispenseRecord)
-class DispenseRecordAdmin(admin.ModelAdmin):
+class DispenseRecordAdmin(StaffDirectoryAdminMixin, admin.ModelAdmin):
+    staff_fields = {'pharmacist': 'pharmacist'}
     list_display = ['id', 'student', 'drug', 'quantity', 'pharmacist', 'date']
     list_filter = ['date', 'pharmacist']
     search_fields = ['student__user__username', 'drug__name']
     date_hierarchy = 'date'
+    ordering = ['-date', '-id']
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class PharmacyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pharmacy'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from . import catalog
+        from .models import Drug
+
+        post_save.connect(catalog.on_drug_saved, sender=Drug, dispatch_uid='drug_catalog')
+        post_delete.connect(catalog.on_drug_deleted, sender=Drug, dispatch_uid='drug_catalog')
@@ -0,0 +1,127 @@
+"""
+In-memory prefix index of the drugs that can be prescribed
+
+DrugCatalog keeps every in-stock drug in a list sorted by lower-cased
+name, so a prefix lookup is one bisect and a short scan, with no query.
+It loads once per process. After that, post_save and post_delete on Drug
+move single entries in or out (see PharmacyConfig.ready), so stock
+changes are reflected immediately in the process that made them. Other
+processes reload after RELOAD_SECONDS, and bulk loaders call reload().
+Changes are applied on commit, so a rolled-back save never shows up.
+Expiry is checked at lookup time, so drugs drop out the day they expire.
+"""
+import bisect
+import datetime
+import threading
+import time
+from typing import NamedTuple
+
+from django.db import transaction
+
+from .models import Drug
+
+AUTOCOMPLETE_LIMIT = 10
+RELOAD_SECONDS = 300
+
+
+class Entry(NamedTuple):
+    pk: int
+    name: str
+    stock: int
+    unit: str
+    expiry_date: datetime.date
+
+    def as_dict(self):
+        return {'id': self.pk, 'name': self.name, 'stock': self.stock, 'unit': self.unit}
+
+
+def _key(entry):
+    return (entry.name.lower(), entry.pk)
+
+
+class DrugCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._entries = []
+        self._by_pk = {}
+        self._loaded_at = None
+
+    def reload(self):
+        rows = Drug.objects.filter(stock__gt=0).values_list('pk', 'name', 'stock', 'unit', 'expiry_date')
+        entries = sorted((Entry(*row) for row in rows), key=_key)
+        with self._lock:
+            self._entries = entries
+            self._keys = [_key(e) for e in entries]
+            self._by_pk = {e.pk: e for e in entries}
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > RELOAD_SECONDS:
+            self.reload()
+
+    def update(self, drug):
+        """Move one drug in or out of the index after it was saved"""
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            self._remove(drug.pk)
+            if drug.stock > 0:
+                entry = Entry(drug.pk, drug.name, drug.stock, drug.unit, drug.expiry_date)
+                i = bisect.bisect_left(self._keys, _key(entry))
+                self._keys.insert(i, _key(entry))
+                self._entries.insert(i, entry)
+                self._by_pk[entry.pk] = entry
+
+    def remove(self, pk):
+        with self._lock:
+            self._remove(pk)
+
+    def _remove(self, pk):
+        entry = self._by_pk.pop(pk, None)
+        if entry is not None:
+            i = bisect.bisect_left(self._keys, _key(entry))
+            del self._keys[i]
+            del self._entries[i]
+
+    def complete(self, prefix, limit=AUTOCOMPLETE_LIMIT, today=None):
+        """Available drugs whose name starts with prefix (case-insensitive), by name"""
+        self._ensure_loaded()
+        prefix = prefix.strip().lower()
+        today = today or datetime.date.today()
+        results = []
+        with self._lock:
+            i = bisect.bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and self._keys[i][0].startswith(prefix) and len(results) < limit:
+                entry = self._entries[i]
+                if entry.expiry_date >= today:
+                    results.append(entry)
+                i += 1
+        return results
+
+    def find(self, name, today=None):
+        """The available drug called name (case-insensitive), preferring the most stock"""
+        self._ensure_loaded()
+        name = name.strip().lower()
+        today = today or datetime.date.today()
+        best = None
+        with self._lock:
+            i = bisect.bisect_left(self._keys, (name,))
+            while i < len(self._keys) and self._keys[i][0] == name:
+                entry = self._entries[i]
+                if entry.expiry_date >= today and (best is None or entry.stock > best.stock):
+                    best = entry
+                i += 1
+        return best
+
+
+catalog = DrugCatalog()
+
+
+def on_drug_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: catalog.update(instance))
+
+
+def on_drug_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: catalog.remove(pk))
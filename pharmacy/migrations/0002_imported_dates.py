@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:19
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispenserecord',
+            name='external_id',
+            field=models.CharField(blank=True, help_text='Natural key of imported records, e.g. DSP-0000001-001-1', max_length=30, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='dispenserecord',
+            name='date',
+            field=models.DateField(default=datetime.date.today, editable=False),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0002_imported_dates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dispenserecord',
+            index=models.Index(fields=['date', 'id'], name='dispense_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dispenserecord',
+            index=models.Index(fields=['student', 'date', 'id'], name='dispense_student_date_idx'),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import datetime
 from django.db import models
 from django.conf import settings
 from students.models import StudentProfile
@@ -12,11 +13,18 @@ class Drug(models.Model):
         return f"{self.name} ({self.stock} {self.unit})"
 
 class DispenseRecord(models.Model):
+    external_id = models.CharField(max_length=30, unique=True, null=True, blank=True, help_text="Natural key of imported records, e.g. DSP-0000001-001-1")
     student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='dispensed_drugs')
     drug = models.ForeignKey(Drug, on_delete=models.CASCADE)
     quantity = models.IntegerField()
     pharmacist = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='dispensed_records', limit_choices_to={'role': 'pharmacist'})
-    date = models.DateField(auto_now_add=True)
+    date = models.DateField(default=datetime.date.today, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'id'], name='dispense_date_idx'),
+            models.Index(fields=['student', 'date', 'id'], name='dispense_student_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.quantity} {self.drug.name} to {self.student.user.username}"
@@ -1,3 +1,61 @@
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.urls import reverse
+
+from .catalog import catalog
+from .models import Drug
+
+User = get_user_model()
+
+
+class DrugCatalogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        future = date.today() + timedelta(days=365)
+        cls.amoxicillin = Drug.objects.create(name='Amoxicillin', stock=40, unit='capsules', expiry_date=future)
+        Drug.objects.create(name='Amlodipine', stock=10, unit='tablets', expiry_date=future)
+        Drug.objects.create(name='Ampicillin', stock=0, unit='vials', expiry_date=future)
+        Drug.objects.create(name='Amoxiclav', stock=5, unit='tablets', expiry_date=date.today() - timedelta(days=1))
+        Drug.objects.create(name='Paracetamol', stock=100, unit='tablets', expiry_date=future)
+
+    def setUp(self):
+        catalog.reload()
+
+    def names(self, prefix):
+        return [entry.name for entry in catalog.complete(prefix)]
+
+    def test_prefix_lookup_skips_empty_and_expired_stock(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('am'), ['Amlodipine', 'Amoxicillin'])
+        self.assertEqual(self.names('AMOX'), ['Amoxicillin'])
+        self.assertEqual(self.names('x'), [])
+        self.assertEqual(catalog.find(' amoxicillin ').pk, self.amoxicillin.pk)
+        self.assertIsNone(catalog.find('Ampicillin'))
+
+    def test_follows_stock_changes_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ampicillin = Drug.objects.get(name='Ampicillin')
+            ampicillin.stock = 12
+            ampicillin.save()
+            self.amoxicillin.stock = 0
+            self.amoxicillin.save()
+        self.assertEqual(self.names('am'), ['Amlodipine', 'Ampicillin'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ampicillin.delete()
+        self.assertEqual(self.names('amp'), [])
+
+    def test_autocomplete_endpoint(self):
+        doctor = User.objects.create_user('dr_fayo', role='doctor')
+        student = User.objects.create_user('st_jiru', role='student')
+        url = reverse('drug_autocomplete')
+
+        self.client.force_login(student)
+        self.assertEqual(self.client.get(url, {'q': 'am'}).status_code, 403)
 
-# Create your tests here.
+        self.client.force_login(doctor)
+        drugs = self.client.get(url, {'q': 'para'}).json()['drugs']
+        self.assertEqual(drugs, [{'id': drugs[0]['id'], 'name': 'Paracetamol', 'stock': 100, 'unit': 'tablets'}])
+        self.assertEqual(self.client.get(url).json()['drugs'], [])
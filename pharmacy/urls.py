@@ -0,0 +1,6 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('drugs/autocomplete/', views.drug_autocomplete, name='drug_autocomplete'),
+]
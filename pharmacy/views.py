@@ -1,3 +1,13 @@
-from django.shortcuts import render
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from .catalog import catalog
 
-# Create your views here.
+@login_required
+def drug_autocomplete(request):
+    """Available drugs whose name starts with ?q=, for prescription forms"""
+    if not request.user.is_staff_member():
+        return JsonResponse({'error': 'Access denied.'}, status=403)
+
+    prefix = request.GET.get('q', '').strip()
+    drugs = catalog.complete(prefix) if prefix else []
+    return JsonResponse({'drugs': [drug.as_dict() for drug in drugs]})